@@ -1,4 +1,5 @@
 import numpy as np
+from digicampipe.io.buffer import BufferPool
 
 
 def fill_electronic_baseline(events):
@@ -38,13 +39,30 @@ def compute_baseline_with_min(events):
         yield event
 
 
-def subtract_baseline(events):
+def subtract_baseline(events, n_buffers=None):
+    """
+    Subtract the baseline from the adc samples.
+    The result is written in a new array, or in the buffers of a
+    `BufferPool` of `n_buffers` buffers if `n_buffers` is given.
+    """
+    pool = None if n_buffers is None else BufferPool(n_buffers)
+    out = None
 
     for event in events:
 
         baseline = event.data.baseline
+        adc_samples = event.data.adc_samples
+        dtype = np.result_type(adc_samples, baseline)
+
+        if pool is not None:
+
+            out = pool.get(adc_samples.shape, dtype)
 
-        event.data.adc_samples = event.data.adc_samples.astype(baseline.dtype)
-        event.data.adc_samples -= baseline[..., np.newaxis]
+        event.data.adc_samples = np.subtract(
+            adc_samples,
+            baseline[..., np.newaxis],
+            out=out,
+            dtype=dtype
+        )
 
         yield event
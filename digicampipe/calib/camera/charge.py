@@ -1,9 +1,8 @@
 import numpy as np
+import numba
 from scipy.ndimage.filters import convolve1d
-from digicampipe.utils.utils import get_pulse_shape
-from iminuit import Minuit
-import matplotlib.pyplot as plt
-from probfit import Chi2Regression
+from digicampipe.utils.pulse_template import default_template
+from digicampipe.calib.camera.time import BIN_TIME
 
 
 def compute_charge(events, integral_width, shift, maximum_width=2):
@@ -31,7 +30,7 @@ def compute_charge(events, integral_width, shift, maximum_width=2):
 
         charges = np.zeros(convolved_signal.shape) * np.nan
         charges[pulse_mask] = convolved_signal[
-            np.roll(pulse_mask, shift, axis=1)
+            np.roll(pulse_mask, shift, axis=-1)
         ]
         event.data.reconstructed_charge = charges
 
@@ -52,61 +51,410 @@ def compute_amplitude(events):
         yield event
 
 
-def fit_template(events, pulse_width=(4, 5), rise_time=12):
+PULSE_DTYPE = np.dtype([
+    ('event', np.int32),
+    ('pixel', np.int32),
+    ('sample', np.int32),
+    ('charge', np.float64),
+    ('amplitude', np.float64),
+    ('time', np.float64),
+])
+
+
+def pulses_from_mask(pulse_mask):
+    """
+    Sparse table of the pulses of `pulse_mask`, one row per pulse (True
+    sample) with the fields of `PULSE_DTYPE`. `event` is the index of the
+    event in a block of events (0 for a single event), the reconstructed
+    fields are set to NaN.
+    """
+
+    positions = np.nonzero(pulse_mask)
+    pulses = np.zeros(len(positions[-1]), dtype=PULSE_DTYPE)
+    pulses['event'] = positions[0] if pulse_mask.ndim == 3 else 0
+    pulses['pixel'] = positions[-2]
+    pulses['sample'] = positions[-1]
+    pulses['charge'] = np.nan
+    pulses['amplitude'] = np.nan
+    pulses['time'] = np.nan
+
+    return pulses
+
+
+def compute_pulses(events, integral_width, shift=0, template=None):
+    """
+    Sparse counterpart of `compute_charge()` and `compute_amplitude()`:
+    fills `event.data.pulses`, c.f. `pulses_from_mask()`, instead of arrays
+    of the size of `adc_samples` that are NaN but at the pulses. Only the
+    samples of the pulses are read.
+
+    The charge is the sum of `integral_width` samples around the pulse
+    shifted by `shift` samples (same window as `compute_charge()`), the
+    amplitude is the sample of the pulse and the time its position in ns.
+    If a `PulseTemplate` is given, the amplitude and the time are fitted
+    instead, c.f. `fit_pulse_template()`, per pixel templates being
+    evaluated with the camera pixel ids of `event.pixel_id`.
+    Works on single events as well as on blocks of events.
+
+    :param events: a stream of events
+    :param integral_width: width of the integration window
+    :param shift: number of samples to shift before integrating
+    :param template: a `PulseTemplate` to fit, by default no fit
+    """
 
     for event in events:
 
-        adc_samples = event.data.adc_samples.copy()
-        time = np.arange(adc_samples.shape[-1]) * 4
-        pulse_indices = event.data.pulse_mask
-        pulse_indices = np.argwhere(pulse_indices)
-        pulse_indices = [tuple(arr) for arr in pulse_indices]
-        amplitudes = np.zeros(adc_samples.shape) * np.nan
-        times = np.zeros(adc_samples.shape) * np.nan
+        pixel_id = None if template is None else event.pixel_id
+        event.data.pulses = pulses_from_samples(
+            event.data.adc_samples, event.data.pulse_mask, integral_width,
+            shift=shift, template=template, pixel_id=pixel_id)
+
+        yield event
+
+
+def pulses_from_samples(adc_samples, pulse_mask, integral_width, shift=0,
+                        template=None, pixel_id=None):
+    """
+    Pulses of `pulse_mask` with their charge, amplitude and time, c.f.
+    `compute_pulses()`
 
-        plt.figure()
+    :param adc_samples: array of shape (n_pixels, n_samples) or
+    (n_events, n_pixels, n_samples)
+    :param pulse_mask: boolean array of the shape of `adc_samples`
+    :param pixel_id: camera pixel ids of the rows of `adc_samples`, c.f.
+    `fit_pulse_template()`
+    :return: structured array of dtype `PULSE_DTYPE`, `pixel` being the
+    row in `adc_samples`
+    """
+
+    pulses = pulses_from_mask(pulse_mask)
+    leading = (pulses['pixel'], ) if pulse_mask.ndim == 2 else \
+        (pulses['event'], pulses['pixel'])
 
-        for pulse_index in pulse_indices:
+    pulses['charge'] = _window_sum(adc_samples, leading, pulses['sample'],
+                                   integral_width, shift)
 
-            left = pulse_index[-1] - int(pulse_width[0])
-            left = max(0, left)
-            right = pulse_index[-1] + int(pulse_width[1]) + 1
-            right = min(adc_samples.shape[-1] - 1, right)
+    if template is None:
 
-            y = adc_samples[pulse_index[0], left:right]
-            t = time[left:right]
+        pulses['amplitude'] = adc_samples[leading + (pulses['sample'], )]
+        pulses['time'] = pulses['sample'] * BIN_TIME
 
-            where_baseline = np.arange(adc_samples.shape[-1])
-            where_baseline = (where_baseline < left) + \
-                             (where_baseline >= right)
-            where_baseline = adc_samples[pulse_index[0]][where_baseline]
+    else:
 
-            baseline_0 = np.mean(where_baseline)
-            baseline_std = np.std(where_baseline)
-            limit_baseline = (baseline_0 - baseline_std,
-                              baseline_0 + baseline_std)
+        amplitude, time, _, _ = fit_pulse_template(
+            adc_samples, leading + (pulses['sample'], ), template=template,
+            pixel_id=pixel_id)
+        pulses['amplitude'] = amplitude
+        pulses['time'] = time
 
-            t_0 = time[pulse_index[-1]] - rise_time
-            limit_t = (t_0 - 2 * 4, t_0 + 2 * 4)
+    return pulses
 
-            amplitude_0 = np.max(y)
-            limit_amplitude = (max(np.min(y), 0), amplitude_0 * 1.2)
 
-            chi2 = Chi2Regression(get_pulse_shape, t, y)
-            m = Minuit(chi2, t=t_0,
-                       amplitude=amplitude_0,
-                       limit_t=limit_t,
-                       limit_amplitude=limit_amplitude,
-                       baseline=baseline_0,
-                       limit_baseline=limit_baseline,
-                       print_level=0, pedantic=False)
-            m.migrad()
+def _window_sum(adc_samples, leading, samples, integral_width, shift):
+    """
+    Sum of `integral_width` samples centred on `samples + shift`, the
+    waveforms being reflected at their ends as in `convolve1d`
+    """
 
-            adc_samples[pulse_index[0]] -= get_pulse_shape(time, **m.values)
-            amplitudes[pulse_index] = m.values['amplitude']
-            times[pulse_index] = m.values['t']
+    n_samples = adc_samples.shape[-1]
+    centre = (samples + shift) % n_samples
+    window = centre[:, np.newaxis] + np.arange(integral_width) - \
+        (integral_width - 1) // 2
+    window = np.where(window < 0, -window - 1, window)
+    window = np.where(window >= n_samples, 2 * n_samples - window - 1,
+                      window)
+    leading = tuple(index[:, np.newaxis] for index in leading)
+
+    return np.sum(adc_samples[leading + (window, )], axis=-1)
+
+
+def fit_template(events, pulse_width=(4, 5), rise_time=12, template=None,
+                 max_shift=8, shift_step=1., n_newton=3, use_numba=True):
+    """
+    Fit the pulses found in `pulse_mask` with the pulse template, c.f.
+    `fit_pulse_template()`. Fills `reconstructed_amplitude` and
+    `reconstructed_time` (time origin of the template in ns) at the pulse
+    positions, NaN elsewhere. Works on single events as well as on blocks
+    of events. Per pixel templates are evaluated with the camera pixel ids
+    of `event.pixel_id`.
+
+    :param template: a `PulseTemplate`, by default the SST-1M template
+    """
+
+    template = default_template() if template is None else template
+
+    for event in events:
+
+        adc_samples = event.data.adc_samples
+        pulse_positions = np.nonzero(event.data.pulse_mask)
+        amplitudes = np.zeros(adc_samples.shape) * np.nan
+        times = np.zeros(adc_samples.shape) * np.nan
+
+        amplitude, time, _, _ = fit_pulse_template(
+            adc_samples, pulse_positions, template=template,
+            pulse_width=pulse_width, rise_time=rise_time,
+            max_shift=max_shift, shift_step=shift_step, n_newton=n_newton,
+            use_numba=use_numba, pixel_id=event.pixel_id,
+        )
+        amplitudes[pulse_positions] = amplitude
+        times[pulse_positions] = time
 
         event.data.reconstructed_amplitude = amplitudes
         event.data.reconstructed_time = times
 
         yield event
+
+
+def fit_pulse_template(adc_samples, pulse_positions, template=None,
+                       pulse_width=(4, 5), rise_time=12, max_shift=8,
+                       shift_step=1., n_newton=3, use_numba=True,
+                       pixel_id=None):
+    """
+    Least squares fit of `amplitude * template(t - time) + baseline` to the
+    samples around each pulse, all the pulses at once.
+
+    For a given time the model is linear in the amplitude and the baseline
+    which are then solved in closed form. The time is first scanned on a
+    grid of `shift_step` ns within `max_shift` ns of the expected time
+    (pulse position - `rise_time`) and then refined with Gauss-Newton steps,
+    each step being kept only if it decreases the chi2. Overlapping pulses
+    are fitted independently.
+
+    :param adc_samples: array of shape (..., n_pixels, n_samples)
+    :param pulse_positions: tuple of index arrays of the pulse samples,
+    e.g. `np.nonzero(pulse_mask)`
+    :param template: a `PulseTemplate`, by default the SST-1M template.
+    Per pixel templates are evaluated with the camera pixel id of the pulses.
+    :param pulse_width: number of samples fitted before and after the pulse
+    position
+    :param rise_time: time between the template origin and the pulse
+    position (ns)
+    :param max_shift: maximum distance of the fitted time to the expected
+    time (ns)
+    :param shift_step: step of the grid of times (ns)
+    :param n_newton: maximum number of Gauss-Newton steps
+    :param use_numba: use the compiled kernel instead of numpy
+    :param pixel_id: camera pixel ids of the rows (pixel axis) of
+    `adc_samples`, e.g. `event.pixel_id` when a subset of the pixels is
+    read. By default the rows are the pixels 0, 1, ...
+    :return: amplitude, time (ns), baseline and chi2 of each pulse
+    """
+
+    template = default_template() if template is None else template
+    pulse_positions = tuple(np.asarray(index) for index in pulse_positions)
+    samples = pulse_positions[-1]
+    n_samples = adc_samples.shape[-1]
+
+    window = samples[:, np.newaxis] + np.arange(-pulse_width[0],
+                                                pulse_width[1] + 1)
+    weights = ((window >= 0) & (window < n_samples)).astype(np.float64)
+    window = np.clip(window, 0, n_samples - 1)
+    leading = tuple(index[:, np.newaxis] for index in pulse_positions[:-1])
+    y = adc_samples[leading + (window, )].astype(np.float64)
+    t_window = window * float(BIN_TIME)
+    t_0 = samples * float(BIN_TIME) - rise_time
+    shifts = np.arange(-max_shift, max_shift + shift_step / 2., shift_step)
+
+    if template.n_pixels is None:
+
+        pixel_id = None
+
+    elif pixel_id is None:
+
+        pixel_id = pulse_positions[-2]
+
+    else:
+
+        pixel_id = np.asarray(pixel_id)[pulse_positions[-2]]
+
+    if use_numba:
+
+        tables = template.table.reshape(-1, template.table.shape[-1])
+        derivatives = template.table_derivative.reshape(tables.shape)
+        table_index = np.zeros(len(samples), dtype=np.int64) \
+            if pixel_id is None else pixel_id.astype(np.int64)
+
+        return _fit_pulses(y, weights, t_window, t_0, tables, derivatives,
+                           table_index, template.time[0],
+                           template.resolution, shifts, float(max_shift),
+                           n_newton)
+
+    if pixel_id is not None:
+
+        pixel_id = pixel_id[:, np.newaxis]
+
+    best_chi2 = np.full(len(samples), np.inf)
+    time = t_0.copy()
+    amplitude = np.zeros(len(samples))
+    baseline = np.zeros(len(samples))
+
+    for shift in shifts:
+
+        t = t_0 + shift
+        shape = template(t_window - t[:, np.newaxis], pixel_id=pixel_id)
+        a, b, chi2 = _linear_fit(y, shape, weights)
+        better = chi2 < best_chi2
+        best_chi2[better] = chi2[better]
+        time[better] = t[better]
+        amplitude[better] = a[better]
+        baseline[better] = b[better]
+
+    for _ in range(n_newton):
+
+        t = t_window - time[:, np.newaxis]
+        shape = template(t, pixel_id=pixel_id)
+        gradient = -amplitude[:, np.newaxis] * \
+            template.derivative(t, pixel_id=pixel_id)
+        residual = y - amplitude[:, np.newaxis] * shape - \
+            baseline[:, np.newaxis]
+        numerator = np.sum(weights * residual * gradient, axis=-1)
+        denominator = np.sum(weights * gradient ** 2, axis=-1)
+        step = np.divide(numerator, denominator,
+                         out=np.zeros(len(samples)), where=denominator > 0)
+        new_time = np.clip(time + step, t_0 - max_shift, t_0 + max_shift)
+
+        shape = template(t_window - new_time[:, np.newaxis],
+                         pixel_id=pixel_id)
+        a, b, chi2 = _linear_fit(y, shape, weights)
+        better = chi2 < best_chi2
+        best_chi2[better] = chi2[better]
+        time[better] = new_time[better]
+        amplitude[better] = a[better]
+        baseline[better] = b[better]
+
+    return amplitude, time, baseline, best_chi2
+
+
+def _linear_fit(y, shape, weights):
+    """Closed form weighted least squares of y = a * shape + b"""
+
+    s = np.sum(weights, axis=-1)
+    s_t = np.sum(weights * shape, axis=-1)
+    s_tt = np.sum(weights * shape ** 2, axis=-1)
+    s_y = np.sum(weights * y, axis=-1)
+    s_ty = np.sum(weights * shape * y, axis=-1)
+    determinant = s * s_tt - s_t ** 2
+    valid = determinant > 0
+    a = np.divide(s * s_ty - s_t * s_y, determinant,
+                  out=np.zeros(determinant.shape), where=valid)
+    b = (s_y - a * s_t) / np.maximum(s, 1)
+    chi2 = np.sum(weights * (y - a[..., np.newaxis] * shape -
+                             b[..., np.newaxis]) ** 2, axis=-1)
+
+    return a, b, chi2
+
+
+@numba.njit
+def _lookup(table, start, resolution, t):
+    """Same linear interpolation as `PulseTemplate`, 0 outside"""
+
+    position = (t - start) / resolution
+
+    if position < 0 or position > table.shape[0] - 3:
+
+        return 0.
+
+    index = int(np.floor(position)) + 1
+    fraction = position - (index - 1)
+
+    return table[index] + fraction * (table[index + 1] - table[index])
+
+
+@numba.njit
+def _linear_fit_pulse(y, shape, weights):
+
+    s = s_t = s_tt = s_y = s_ty = 0.
+
+    for j in range(len(y)):
+
+        s += weights[j]
+        s_t += weights[j] * shape[j]
+        s_tt += weights[j] * shape[j] ** 2
+        s_y += weights[j] * y[j]
+        s_ty += weights[j] * shape[j] * y[j]
+
+    determinant = s * s_tt - s_t ** 2
+    a = (s * s_ty - s_t * s_y) / determinant if determinant > 0 else 0.
+    b = (s_y - a * s_t) / max(s, 1.)
+    chi2 = 0.
+
+    for j in range(len(y)):
+
+        chi2 += weights[j] * (y[j] - a * shape[j] - b) ** 2
+
+    return a, b, chi2
+
+
+@numba.njit(parallel=True)
+def _fit_pulses(y, weights, t_window, t_0, tables, derivatives, table_index,
+                start, resolution, shifts, max_shift, n_newton):
+
+    n_pulses, n_window = y.shape
+    amplitude = np.zeros(n_pulses)
+    time = np.zeros(n_pulses)
+    baseline = np.zeros(n_pulses)
+    best_chi2 = np.zeros(n_pulses)
+
+    for i in numba.prange(n_pulses):
+
+        table = tables[table_index[i]]
+        derivative = derivatives[table_index[i]]
+        shape = np.zeros(n_window)
+        best = np.inf
+        best_t = t_0[i]
+        best_a = 0.
+        best_b = 0.
+
+        for k in range(len(shifts)):
+
+            t = t_0[i] + shifts[k]
+
+            for j in range(n_window):
+
+                shape[j] = _lookup(table, start, resolution,
+                                   t_window[i, j] - t)
+
+            a, b, chi2 = _linear_fit_pulse(y[i], shape, weights[i])
+
+            if chi2 < best:
+
+                best, best_t, best_a, best_b = chi2, t, a, b
+
+        for _ in range(n_newton):
+
+            numerator = 0.
+            denominator = 0.
+
+            for j in range(n_window):
+
+                t = t_window[i, j] - best_t
+                value = _lookup(table, start, resolution, t)
+                gradient = -best_a * _lookup(derivative, start, resolution, t)
+                residual = y[i, j] - best_a * value - best_b
+                numerator += weights[i, j] * residual * gradient
+                denominator += weights[i, j] * gradient ** 2
+
+            if denominator <= 0:
+
+                break
+
+            t = min(max(best_t + numerator / denominator, t_0[i] - max_shift),
+                    t_0[i] + max_shift)
+
+            for j in range(n_window):
+
+                shape[j] = _lookup(table, start, resolution,
+                                   t_window[i, j] - t)
+
+            a, b, chi2 = _linear_fit_pulse(y[i], shape, weights[i])
+
+            if chi2 < best:
+
+                best, best_t, best_a, best_b = chi2, t, a, b
+
+        amplitude[i] = best_a
+        time[i] = best_t
+        baseline[i] = best_b
+        best_chi2[i] = best
+
+    return amplitude, time, baseline, best_chi2
@@ -1,6 +1,7 @@
 from digicampipe.utils import utils, calib
+from digicampipe.io.buffer import BufferPool
+from digicampipe.image import cleaning
 import numpy as np
-from ctapipe.image import cleaning
 
 
 def calibrate_to_dl1(
@@ -8,8 +9,38 @@ def calibrate_to_dl1(
     time_integration_options,
     picture_threshold=7,
     boundary_threshold=4,
-    additional_mask=None
+    additional_mask=None,
+    max_time_difference=None,
+    keep_largest_island=False,
+    constants=None,
 ):
+    """
+    Calibrate the r1 waveforms to p.e. images and clean them.
+
+    The cleaning (c.f. `digicampipe.image.cleaning`) keeps the pixels above
+    3 standard deviations of the baseline that pass the tailcuts, extended
+    with all the connected pixels above `boundary_threshold`.
+
+    :param max_time_difference: if given, only the pixels with a neighbour
+    whose time differs by at most `max_time_difference` ns are kept
+    :param keep_largest_island: keep only the island of largest charge
+    :param constants: `calib.CalibrationConstants` of the run, e.g. shared
+    with `calibrate_to_r1()`. If its time integration options are not set,
+    `time_integration_options` is attached to it.
+    """
+
+    if constants is None:
+        constants = calib.CalibrationConstants()
+
+    if constants.time_integration_options is None:
+        constants.time_integration_options = time_integration_options
+
+    time_integration_options = constants.time_integration_options
+    gain = constants.gains
+
+    # the r1 adc samples are not modified, the cleaned samples are only
+    # needed during the loop
+    cleaned_samples = BufferPool(n_buffers=1)
 
     for i, event in enumerate(event_stream):
 
@@ -17,7 +48,7 @@ def calibrate_to_dl1(
 
             if i == 0:
                 geom = event.inst.geom[telescope_id]
-                pixel_id = np.arange(geom.pix_x.shape[0])
+                neighbors = cleaning.neighbor_matrix_sparse(geom)
 
             r0_camera = event.r0.tel[telescope_id]
             r1_camera = event.r1.tel[telescope_id]
@@ -26,28 +57,31 @@ def calibrate_to_dl1(
             adc_samples = r1_camera.adc_samples
 
             mask_for_cleaning = (
-                adc_samples > 3 * r0_camera.standard_deviation[:, np.newaxis]
+                adc_samples > 3 * r0_camera.standard_deviation[..., np.newaxis]
             )
             dl1_camera.cleaning_mask = np.any(mask_for_cleaning, axis=-1)
 
-            adc_samples[~dl1_camera.cleaning_mask] = 0.
-
-            gain_init = calib.get_gains()
-            gain = gain_init  # * r1_camera.gain_drop
+            adc_samples = np.multiply(
+                adc_samples,
+                dl1_camera.cleaning_mask[..., np.newaxis],
+                out=cleaned_samples.get(adc_samples.shape, adc_samples.dtype)
+            )
 
             # Integrate the data
             adc_integrated = utils.integrate(
                 adc_samples, time_integration_options['window_width']
             )
 
-            pe_samples_trace = adc_integrated / gain[:, np.newaxis]
+            # the trace is zero padded to a multiple of n_samples
             n_samples = adc_samples.shape[-1]
-            dl1_camera.pe_samples_trace = np.pad(
-                pe_samples_trace, (
-                    (0, 0),
-                    (0, n_samples - pe_samples_trace.shape[-1] % n_samples)
-                ), 'constant'
+            n_integrated = adc_integrated.shape[-1]
+            pe_samples_trace = np.zeros(
+                adc_integrated.shape[:-1] +
+                (n_integrated + n_samples - n_integrated % n_samples, )
             )
+            np.divide(adc_integrated, gain[:, np.newaxis],
+                      out=pe_samples_trace[..., :n_integrated])
+            dl1_camera.pe_samples_trace = pe_samples_trace
 
             # Compute the charge
             dl1_camera.pe_samples, dl1_camera.time_bin = utils.extract_charge(
@@ -59,64 +93,47 @@ def calibrate_to_dl1(
             )
             dl1_camera.pe_samples = dl1_camera.pe_samples / gain
 
-            # mask pixels which goes above N sigma
-
-            dl1_camera.cleaning_mask *= cleaning.tailcuts_clean(
-                geom=geom,
-                image=dl1_camera.pe_samples,
-                picture_thresh=picture_threshold,
-                boundary_thresh=boundary_threshold,
+            # all the images of a block of events are cleaned at once
+            # (c.f. digicampipe.io.event_stream.batch_events)
+            image = dl1_camera.pe_samples
+            cleaning_mask = dl1_camera.cleaning_mask & cleaning.tailcuts(
+                image,
+                neighbors,
+                picture_threshold=picture_threshold,
+                boundary_threshold=boundary_threshold,
                 keep_isolated_pixels=False
             )
 
-            # recursive selection of neighboring pixels
-            # threshold is 2*boundary_threshold, maybe we should introduce
-            # yet a 3rd threshold in the args of the function
-            image = dl1_camera.pe_samples
-            """
-            recursion = True
-            border = False
-            while recursion:
-                recursion = False
-                for i in pixel_id[dl1_camera.cleaning_mask]:
-                    num_neighbors = 0
-                    for j in pixel_id[geom.neighbor_matrix[i] & ~dl1_camera.cleaning_mask]:
-                        num_neighbors = num_neighbors + 1
-                        if image[j] > boundary_threshold:
-                            dl1_camera.cleaning_mask[j] = True
-                            recursion = True
-                    if num_neighbors != 6:
-                        border = True
-
-            dl1_camera.on_border = border
-
-            """
-            # repaired piece of code from Cyril. The commented version above leads to border_flag = 1 in almost all events.
-            recursion = True
-            while recursion:
-                recursion = False
-                for i in pixel_id[dl1_camera.cleaning_mask]:
-                    for j in pixel_id[geom.neighbor_matrix[i] &
-                                      (~dl1_camera.cleaning_mask)]:
-                        if image[j] > boundary_threshold:
-                            dl1_camera.cleaning_mask[j] = True
-                            recursion = True
-
-            num_neighbors = np.sum(
-                geom.neighbor_matrix[dl1_camera.cleaning_mask], axis=-1
+            # selection of the connected pixels above boundary_threshold
+            cleaning_mask = cleaning.dilate(
+                cleaning_mask, neighbors, image=image,
+                threshold=boundary_threshold
             )
-            dl1_camera.on_border = np.any(num_neighbors < 6)
+
+            if max_time_difference is not None:
+                cleaning_mask = cleaning.time_constrained(
+                    cleaning_mask, neighbors,
+                    time=dl1_camera.time_bin[-1] * 4,
+                    max_time_difference=max_time_difference
+                )
+
+            if keep_largest_island:
+                _, labels = cleaning.label_islands(cleaning_mask, neighbors)
+                cleaning_mask = cleaning.largest_island(labels, image=image)
+
+            dl1_camera.cleaning_mask = cleaning_mask
+            dl1_camera.on_border = cleaning.on_border(cleaning_mask,
+                                                      neighbors)
 
             if additional_mask is not None:
                 dl1_camera.cleaning_mask *= additional_mask
 
             weight = dl1_camera.pe_samples
+            time = dl1_camera.time_bin[-1] * 4
+            dl1_camera.time_spread = np.average(time, weights=weight, axis=-1)
             dl1_camera.time_spread = np.average(
-                dl1_camera.time_bin[1] * 4, weights=weight
-            )
-            dl1_camera.time_spread = np.average(
-                (dl1_camera.time_bin[1] * 4 - dl1_camera.time_spread)**2,
-                weights=weight
+                (time - dl1_camera.time_spread[..., np.newaxis])**2,
+                weights=weight, axis=-1
             )
             dl1_camera.time_spread = np.sqrt(dl1_camera.time_spread)
 
@@ -1,6 +1,7 @@
 from ctapipe.image import hillas
 import numpy as np
 import astropy.units as u
+from digicampipe.io.buffer import modifies
 
 
 def hillas_parameters(geom, image):
@@ -23,9 +24,11 @@ def hillas_parameters(geom, image):
         )
 
 
+@modifies('dl1.cleaning_mask')
 def calibrate_to_dl2(event_stream, reclean=False, shower_distance=80*u.mm):
     '''
     Skips events with size==0
+    The dl1 cleaning mask is updated if reclean is True
     '''
 
     for i, event in enumerate(event_stream):
@@ -39,10 +42,8 @@ def calibrate_to_dl2(event_stream, reclean=False, shower_distance=80*u.mm):
 
             dl1_camera = event.dl1.tel[telescope_id]
 
-            image = dl1_camera.pe_samples
-
             mask = dl1_camera.cleaning_mask
-            image[~mask] = 0.
+            image = np.where(mask, dl1_camera.pe_samples, 0.)
             moments_first = hillas_parameters(geom, image)
             if moments_first.size == 0:
                 continue
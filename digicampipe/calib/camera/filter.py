@@ -1,7 +1,10 @@
 import numpy as np
 import astropy.units as u
+from digicampipe.io.buffer import modifies
 
 
+@modifies('r0.trigger_input_traces', 'r0.trigger_output_patch7',
+          'r0.trigger_output_patch19')
 def set_patches_to_zero(event_stream, unwanted_patch):
 
     for event in event_stream:
@@ -19,6 +22,7 @@ def set_patches_to_zero(event_stream, unwanted_patch):
         yield event
 
 
+@modifies('r0.adc_samples')
 def set_pixels_to_zero(event_stream, unwanted_pixels):
 
     for event in event_stream:
@@ -1,11 +1,13 @@
 import numpy as np
 import peakutils
-from scipy.signal import find_peaks_cwt
-from scipy.ndimage.filters import convolve1d, gaussian_filter1d
-from scipy.signal import correlate
-from tqdm import tqdm
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage.filters import convolve1d, gaussian_filter1d, \
+    maximum_filter1d
+from scipy.fftpack import next_fast_len
+from scipy.signal import fftconvolve
 
-from digicampipe.utils.utils import get_pulse_shape
+from digicampipe.utils.pulse_template import default_template
+from digicampipe.calib.camera.time import BIN_TIME
 
 
 def find_pulse_1(events, threshold, min_distance):
@@ -25,24 +27,170 @@ def find_pulse_1(events, threshold, min_distance):
 
 
 def find_pulse_wavelets(events, threshold_sigma, widths, **kwargs):
+    """
+    Find the pulses with a continuous wavelet transform, c.f.
+    `find_peaks_cwt_mask()`. Only the peaks above `threshold_sigma` times
+    the standard deviation of the waveform are kept.
+    Works on single events as well as on blocks of events.
+
+    :param threshold_sigma: threshold in units of standard deviation
+    :param widths: widths of the ricker wavelets (in samples)
+    :param kwargs: parameters of `find_peaks_cwt_mask()`
+    """
 
     for count, event in enumerate(events):
 
-        adc_samples = event.data.adc_samples
-        pulse_mask = np.zeros(adc_samples.shape, dtype=np.bool)
+        event.data.pulse_mask = wavelets_pulse_mask(
+            event.data.adc_samples, threshold_sigma, widths, **kwargs)
 
-        for pixel_id, adc_sample in tqdm(enumerate(adc_samples), desc='Pixel'):
+        yield event
 
-            threshold = np.std(adc_sample) * threshold_sigma
-            peak_index = find_peaks_cwt(adc_sample, widths, **kwargs)
-            peak_index = peak_index[
-                adc_sample[peak_index] > threshold[pixel_id]
-            ]
-            pulse_mask[pixel_id, peak_index] = True
 
-        event.data.pulse_mask = pulse_mask
+def wavelets_pulse_mask(adc_samples, threshold_sigma, widths, **kwargs):
+    """Pulse mask of `adc_samples`, c.f. `find_pulse_wavelets()`"""
 
-        yield event
+    threshold = np.std(adc_samples, axis=-1) * threshold_sigma
+    pulse_mask = find_peaks_cwt_mask(adc_samples, widths, **kwargs)
+    pulse_mask &= adc_samples > threshold[..., np.newaxis]
+
+    return pulse_mask
+
+
+def ricker(points, width):
+    """Ricker (mexican hat) wavelet of `points` samples"""
+
+    amplitude = 2 / (np.sqrt(3 * width) * (np.pi ** 0.25))
+    t = np.arange(points) - (points - 1) / 2
+    t2 = (t / width) ** 2
+
+    return amplitude * (1 - t2) * np.exp(-t2 / 2)
+
+
+def cwt(adc_samples, widths):
+    """
+    Continuous wavelet transform of the waveforms along the last axis with
+    ricker wavelets, as `scipy.signal.cwt`.
+
+    :return: array of shape (n_widths, ) + adc_samples.shape
+    """
+
+    n_samples = adc_samples.shape[-1]
+    adc_samples = np.asarray(adc_samples, dtype=np.float64)
+    shape = (1, ) * (adc_samples.ndim - 1) + (-1, )
+    transform = np.zeros((len(widths), ) + adc_samples.shape)
+
+    for i, width in enumerate(widths):
+
+        kernel = ricker(min(10 * width, n_samples), width)
+        transform[i] = fftconvolve(adc_samples, kernel.reshape(shape),
+                                   mode='same', axes=-1)
+
+    return transform
+
+
+def find_peaks_cwt_mask(adc_samples, widths, max_distances=None,
+                        gap_thresh=None, min_length=None, min_snr=1,
+                        noise_perc=10, window_size=None):
+    """
+    Vectorised version of `scipy.signal.find_peaks_cwt` working on all the
+    waveforms at once (the last axis being the samples).
+
+    The relative maxima of the wavelet transform are linked into ridge lines
+    from the largest to the smallest width: a maximum continues the longest
+    ridge within `max_distances` samples, ridges without a maximum for more
+    than `gap_thresh` widths are ended. A peak is found at the end of the
+    ridges longer than `min_length`, if the transform there is above
+    `min_snr` times the `noise_perc` percentile of the transform of the
+    smallest width in a window of `window_size` samples.
+    Unlike scipy, a maximum continues the longest and not the closest
+    ridge within reach, so the peaks found can differ in crowded waveforms.
+
+    :return: boolean array of the shape of `adc_samples`, True at the peaks
+    """
+
+    widths = np.atleast_1d(widths)
+    n_widths = len(widths)
+    n_samples = adc_samples.shape[-1]
+
+    if gap_thresh is None:
+        gap_thresh = np.ceil(widths[0])
+
+    if max_distances is None:
+        max_distances = widths / 4.0
+
+    if min_length is None:
+        min_length = np.ceil(n_widths / 4)
+
+    if window_size is None:
+        window_size = np.ceil(n_samples / 20)
+
+    transform = cwt(adc_samples, widths)
+    maxima = np.zeros(transform.shape, dtype=bool)
+    maxima[..., 1:-1] = (transform[..., 1:-1] > transform[..., :-2]) & \
+        (transform[..., 1:-1] > transform[..., 2:])
+    noise = _sliding_percentile(transform[0], int(window_size), noise_perc)
+
+    # ridges are stored at the column of their last maximum
+    alive = np.zeros(adc_samples.shape, dtype=bool)
+    length = np.zeros(adc_samples.shape, dtype=int)
+    gap = np.zeros(adc_samples.shape, dtype=int)
+    last_row = np.zeros(adc_samples.shape, dtype=int)
+    ends = []
+
+    for row in range(n_widths - 1, -1, -1):
+
+        size = 2 * int(max_distances[row]) + 1
+        row_maxima = maxima[row]
+        incoming = maximum_filter1d(np.where(alive, length, 0), size=size,
+                                    axis=-1, mode='constant')
+        consumed = maximum_filter1d(row_maxima, size=size, axis=-1,
+                                    mode='constant')
+        gap = gap + alive
+        unmatched = alive & ~consumed
+        ended = unmatched & (gap > gap_thresh)
+        ends.append((ended, length, last_row))
+        unmatched &= ~ended
+
+        length = np.where(row_maxima, incoming + 1,
+                          np.where(unmatched, length, 0))
+        gap = np.where(row_maxima, 0, gap)
+        last_row = np.where(row_maxima, row, last_row)
+        alive = row_maxima | unmatched
+
+    ends.append((alive, length, last_row))
+    peaks = np.zeros(adc_samples.shape, dtype=bool)
+
+    for ended, length, last_row in ends:
+
+        signal = np.take_along_axis(transform, last_row[np.newaxis], axis=0)
+        snr = np.abs(signal[0] / noise)
+        peaks |= ended & (length >= min_length) & (snr >= min_snr)
+
+    return peaks
+
+
+def _sliding_percentile(x, window_size, percentile):
+
+    # same windows as scipy.signal._peak_finding._filter_ridge_lines
+    n_samples = x.shape[-1]
+    half_window, odd = divmod(window_size, 2)
+    result = np.zeros(x.shape)
+    windows = sliding_window_view(x, window_size, axis=-1)
+    result[..., half_window:half_window + windows.shape[-2]] = \
+        np.percentile(windows, percentile, axis=-1)
+
+    # truncated windows at the edges
+    edges = list(range(half_window)) + \
+        list(range(half_window + windows.shape[-2], n_samples))
+
+    for i in edges:
+
+        start = max(i - half_window, 0)
+        end = min(i + half_window + odd, n_samples)
+        result[..., i] = np.percentile(x[..., start:end], percentile,
+                                       axis=-1)
+
+    return result
 
 
 def find_pulse_fast(events, threshold):
@@ -56,26 +204,35 @@ def find_pulse_fast(events, threshold):
         c = convolve1d(
             input=adc_samples,
             weights=w,
-            axis=1,
+            axis=-1,
             mode='constant',
         )
-        pulse_mask[:, 1:-1] = (
-            (c[:, :-2] <= c[:, 1:-1]) &
-            (c[:, 1:-1] >= c[:, 2:]) &
-            (c[:, 1:-1] > threshold)
+        pulse_mask[..., 1:-1] = (
+            (c[..., :-2] <= c[..., 1:-1]) &
+            (c[..., 1:-1] >= c[..., 2:]) &
+            (c[..., 1:-1] > threshold)
         )
         event.data.pulse_mask = pulse_mask
 
         yield event
 
 
-def find_pulse_correlate(events, threshold):
+def find_pulse_correlate(events, threshold, widths=(1., ), template=None,
+                         method='auto'):
+    """
+    Find the pulses as the local maxima of the matched filter output above
+    `threshold`, c.f. `TemplateBank`. The waveforms are standardised
+    (mean 0, standard deviation 1 per pixel) before filtering and the
+    output of the different widths is combined by taking its maximum.
+    Works on single events as well as on blocks of events.
+
+    :param threshold: threshold on the filter output
+    :param widths: stretch factors of the template time axis
+    :param template: a `PulseTemplate`, by default the SST-1M template
+    :param method: c.f. `TemplateBank.correlate()`
+    """
 
-    time = np.linspace(0, 91*4, num=91)
-    template = get_pulse_shape(time, t=0, amplitude=1, baseline=0)
-    template[template < 0.1] = 0
-    template = np.tile(template, (1296, 1))
-    template = template / np.sum(template, axis=-1)[..., np.newaxis]
+    bank = TemplateBank(widths=widths, template=template)
 
     for count, event in enumerate(events):
         adc_samples = event.data.adc_samples
@@ -83,15 +240,16 @@ def find_pulse_correlate(events, threshold):
 
         mean = np.mean(adc_samples, axis=-1)
         std = np.std(adc_samples, axis=-1)
+        std[std == 0] = 1
 
         adc_samples = (adc_samples - mean[..., np.newaxis])
         adc_samples = adc_samples / std[..., np.newaxis]
-        c = correlate(adc_samples, template)
+        c = bank.correlate(adc_samples, method=method).max(axis=0)
 
-        pulse_mask[:, 1:-1] = (
-            (c[:, :-2] <= c[:, 1:-1]) &
-            (c[:, 1:-1] >= c[:, 2:]) &
-            (c[:, 1:-1] > threshold)
+        pulse_mask[..., 1:-1] = (
+            (c[..., :-2] <= c[..., 1:-1]) &
+            (c[..., 1:-1] >= c[..., 2:]) &
+            (c[..., 1:-1] > threshold)
         )
 
         event.data.pulse_mask = pulse_mask
@@ -99,6 +257,109 @@ def find_pulse_correlate(events, threshold):
         yield event
 
 
+class TemplateBank:
+    """
+    Matched filter bank of the pulse template sampled at different widths.
+
+    The kernel of a width `w` is the template sampled every `BIN_TIME / w`
+    ns, its values below `cut` times the maximum are set to 0 and it is
+    normalised to a sum of 1. All the kernels are aligned on their maximum
+    so that the filter output peaks at the sample of the pulse maximum.
+    The waveforms are only correlated along their last (time) axis, the
+    Fourier transforms of the kernels are computed once per number of
+    samples.
+
+    :param widths: stretch factors of the template time axis
+    :param template: a `PulseTemplate`, by default the SST-1M template
+    :param cut: fraction of the maximum below which the template is set to 0
+    """
+
+    def __init__(self, widths=(1., ), template=None, cut=0.1):
+
+        template = default_template() if template is None else template
+        self.widths = np.atleast_1d(np.asarray(widths, dtype=np.float64))
+        kernels = []
+
+        for width in self.widths:
+
+            n_points = int(np.ceil(template.time[-1] * width / BIN_TIME)) + 1
+            kernel = template(np.arange(n_points) * BIN_TIME / width)
+            kernel[kernel < cut * kernel.max()] = 0
+            kernel = np.trim_zeros(kernel)
+            kernels.append(kernel / kernel.sum())
+
+        peaks = [np.argmax(kernel) for kernel in kernels]
+        self.offset = max(peaks)
+        length = max(len(kernel) - peak for kernel, peak in
+                     zip(kernels, peaks)) + self.offset
+        self.kernels = np.zeros((len(kernels), length))
+
+        for kernel, peak, row in zip(kernels, peaks, self.kernels):
+
+            start = self.offset - peak
+            row[start:start + len(kernel)] = kernel
+
+        self._fft = {}
+
+    def __len__(self):
+
+        return len(self.widths)
+
+    def correlate(self, adc_samples, method='auto'):
+        """
+        Filter output y[t] = sum_j x[t - offset + j] * kernel[j], the
+        samples outside of the waveform being 0.
+
+        :param adc_samples: array of shape (..., n_samples)
+        :param method: 'fft', 'direct' (sliding dot product) or 'auto' which
+        uses 'direct' for short kernels
+        :return: array of shape (n_widths, ..., n_samples)
+        """
+
+        adc_samples = np.asarray(adc_samples, dtype=np.float64)
+        n_samples = adc_samples.shape[-1]
+        length = self.kernels.shape[-1]
+
+        if method == 'auto':
+
+            method = 'direct' if length <= 64 else 'fft'
+
+        if method == 'direct':
+
+            padding = [(0, 0)] * (adc_samples.ndim - 1) + \
+                [(self.offset, length - 1 - self.offset)]
+            windows = sliding_window_view(np.pad(adc_samples, padding),
+                                          length, axis=-1)
+            output = windows @ self.kernels.T
+
+            return np.moveaxis(output, -1, 0)
+
+        if method != 'fft':
+
+            raise ValueError('Unknown method {}'.format(method))
+
+        n_fft, kernels_fft = self._kernels_fft(n_samples)
+        transform = np.fft.rfft(adc_samples, n=n_fft, axis=-1)
+        shape = (len(self), ) + (1, ) * (adc_samples.ndim - 1) + (-1, )
+        output = np.fft.irfft(transform[np.newaxis] *
+                              kernels_fft.reshape(shape), n=n_fft, axis=-1)
+        start = length - 1 - self.offset
+
+        return output[..., start:start + n_samples]
+
+    def _kernels_fft(self, n_samples):
+
+        if n_samples not in self._fft:
+
+            length = self.kernels.shape[-1]
+            n_fft = next_fast_len(n_samples + length - 1)
+            kernels_fft = np.fft.rfft(self.kernels[:, ::-1], n=n_fft,
+                                      axis=-1)
+            self._fft[n_samples] = n_fft, kernels_fft
+
+        return self._fft[n_samples]
+
+
 def find_pulse_with_max(events):
 
     for i, event in enumerate(events):
@@ -126,10 +387,10 @@ def find_pulse_gaussian_filter(events, threshold=2, **kwargs):
         c = gaussian_filter1d(c, sigma=sigma, **kwargs)
         pulse_mask = np.zeros(c.shape, dtype=np.bool)
 
-        pulse_mask[:, 1:-1] = (
-            (c[:, :-2] < c[:, 1:-1]) &
-            (c[:, 1:-1] > c[:, 2:]) &
-            (c[:, 1:-1] > threshold)
+        pulse_mask[..., 1:-1] = (
+            (c[..., :-2] < c[..., 1:-1]) &
+            (c[..., 1:-1] > c[..., 2:]) &
+            (c[..., 1:-1] > threshold)
         )
 
         event.data.pulse_mask = pulse_mask
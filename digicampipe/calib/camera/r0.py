@@ -7,8 +7,8 @@ def fill_trigger_patch(event_stream):
 
         for telescope_id in event.r0.tels_with_data:
 
-            data = event.r0.tel[telescope_id].adc_samples - event.r0.tel[telescope_id].baseline[:, np.newaxis].astype(int)
-            data = np.dot(event.inst.patch_matrix[telescope_id], data)
+            data = event.r0.tel[telescope_id].adc_samples - event.r0.tel[telescope_id].baseline[..., np.newaxis].astype(int)
+            data = np.matmul(event.inst.patch_matrix[telescope_id], data)
             event.r0.tel[telescope_id].trigger_input_traces = data
 
         yield event
@@ -21,7 +21,7 @@ def fill_trigger_input_7(event_stream):
         for telescope_id in event.r0.tels_with_data:
 
             trigger_in = event.r0.tel[telescope_id].trigger_input_traces
-            trigger_input_7 = np.dot(event.inst.cluster_matrix_7[telescope_id], trigger_in)
+            trigger_input_7 = np.matmul(event.inst.cluster_matrix_7[telescope_id], trigger_in)
             event.r0.tel[telescope_id].trigger_input_7 = trigger_input_7
 
         yield event
@@ -34,7 +34,7 @@ def fill_trigger_input_19(event_stream):
         for telescope_id in event.r0.tels_with_data:
 
             trigger_in = event.r0.tel[telescope_id].trigger_input_traces
-            trigger_input_19 = np.dot(event.inst.cluster_matrix_19[telescope_id], trigger_in)
+            trigger_input_19 = np.matmul(event.inst.cluster_matrix_19[telescope_id], trigger_in)
             event.r0.tel[telescope_id].trigger_input_19 = trigger_input_19
 
         yield event
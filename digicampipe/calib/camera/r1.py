@@ -1,11 +1,27 @@
 import numpy as np
 from digicampipe.utils import calib
-
-
-def calibrate_to_r1(event_stream, dark_baseline):
+from digicampipe.io.buffer import BufferPool
+
+
+def calibrate_to_r1(event_stream, dark_baseline, n_buffers=None,
+                    constants=None):
+    """
+    Subtract the baseline and compute the NSB and gain drop.
+    The r1 adc samples are new arrays for every event, or the buffers of a
+    `BufferPool` of `n_buffers` buffers if `n_buffers` is given.
+    The gain drop and NSB are only recomputed for the pixels whose baseline
+    moved, c.f. `calib.CalibrationConstants`, that can be shared with
+    `calibrate_to_dl1()`.
+    """
     if dark_baseline is not None:
         dark_baseline = dark_baseline['baseline']
 
+    if constants is None:
+        constants = calib.CalibrationConstants()
+
+    pool = None if n_buffers is None else BufferPool(n_buffers)
+    out = None
+
     for event in event_stream:
 
         for telescope_id in event.r0.tels_with_data:
@@ -17,20 +33,27 @@ def calibrate_to_r1(event_stream, dark_baseline):
             # Get the ADCs
             adc_samples = r0_camera.adc_samples
             baseline = r0_camera.baseline
-            adc_samples = adc_samples - baseline[:, np.newaxis].astype(np.int16)
-            r1_camera.adc_samples = adc_samples
+            baseline_int = baseline[..., np.newaxis].astype(np.int16)
+            dtype = np.result_type(adc_samples, baseline_int)
+
+            if pool is not None:
+
+                out = pool.get(adc_samples.shape, dtype)
+
+            r1_camera.adc_samples = np.subtract(adc_samples, baseline_int,
+                                                out=out, dtype=dtype)
             # Compute the gain drop and NSB
 
             if dark_baseline is None:
                 # compute NSB and Gain drop from STD
                 standard_deviation = r0_camera.standard_deviation
-                r1_camera.gain_drop = calib.compute_gain_drop(standard_deviation, 'std')
-                r1_camera.nsb = calib.compute_nsb_rate(standard_deviation, 'std')
+                r1_camera.gain_drop, r1_camera.nsb = \
+                    constants.gain_drop_and_nsb(standard_deviation, 'std')
             else:
                 # compute NSB and Gain drop from baseline shift
                 r0_camera.dark_baseline = dark_baseline
                 baseline_shift = baseline - r0_camera.dark_baseline
-                r1_camera.gain_drop = calib.compute_gain_drop(baseline_shift, 'mean')
-                r1_camera.nsb = calib.compute_nsb_rate(baseline_shift, 'mean')
+                r1_camera.gain_drop, r1_camera.nsb = \
+                    constants.gain_drop_and_nsb(baseline_shift, 'mean')
 
         yield event
@@ -1,101 +1,416 @@
 import numpy as np
 
+BASELINE_MODES = ['mean', 'median', 'clipped']
+
+
+class RunningBaseline:
+    """Baseline and standard deviation of the pixels over a sliding window
+    of events.
+
+    The mean and standard deviation of the samples of each event are kept in
+    a ring of `n_events` slots. In 'mean' mode the baseline is updated with
+    running sums, i.e. in O(n_pixels) per event whatever the window length.
+    The sums of the samples and of their squares are also kept, they give
+    the mean and standard deviation of all the samples of the window
+    (`pooled_mean` and `pooled_std`).
+
+    :param n_events: maximum number of events in the window
+    :param window_time: if given, events older than `window_time` (same
+    unit as the times given to `add()`) are removed from the window
+    :param mode: 'mean' of the event means, 'median' of the event means or
+    'clipped' mean of the event means within `n_sigma` standard deviations
+    of their median. The robust modes are computed over the whole window.
+    :param nan_aware: if True, NaN samples (e.g. masked pixels) are ignored
+    :param n_sigma: clipping threshold of the 'clipped' mode
+    """
+
+    def __init__(self, n_events, window_time=None, mode='mean',
+                 nan_aware=False, n_sigma=3):
+
+        if mode not in BASELINE_MODES:
+
+            raise ValueError('Unknown mode {}, use one of {}'.format(
+                mode, BASELINE_MODES))
+
+        self.n_events = n_events
+        self.window_time = window_time
+        self.mode = mode
+        self.nan_aware = nan_aware
+        self.n_sigma = n_sigma
+
+        self._means = None
+        self._stds = None
+        self._times = np.zeros(n_events)
+        self._first = 0
+        self._count = 0
+        self._n_added = 0
+        self._time_span_reached = False
+        self._baseline = None
+        self._std = None
+
+    def __len__(self):
+
+        return self._count
+
+    @property
+    def ready(self):
+        """True once the window is full"""
+
+        if self.window_time is not None and self._time_span_reached:
+
+            return self._count > 0
+
+        return self._count == self.n_events
+
+    def add(self, adc_samples, time=None):
+        """Add an event, `adc_samples` of shape (n_pixels, n_samples)"""
+
+        if self.nan_aware:
+
+            mean = np.nanmean(adc_samples, axis=-1)
+            std = np.nanstd(adc_samples, axis=-1)
+
+        else:
+
+            mean = np.mean(adc_samples, axis=-1)
+            std = np.std(adc_samples, axis=-1)
+
+        if self._means is None:
+
+            n_pixels = mean.shape[0]
+            self._means = np.zeros((self.n_events, n_pixels))
+            self._stds = np.zeros((self.n_events, n_pixels))
+            self._n_samples = np.zeros((self.n_events, n_pixels))
+            self._sample_sums = np.zeros((self.n_events, n_pixels))
+            self._square_sums = np.zeros((self.n_events, n_pixels))
+            self._sum = np.zeros(n_pixels)
+            self._sum_std = np.zeros(n_pixels)
+            self._valid = np.zeros(n_pixels, dtype=int)
+            self._sum_n_samples = np.zeros(n_pixels)
+            self._sum_samples = np.zeros(n_pixels)
+            self._sum_squares = np.zeros(n_pixels)
+            # the samples are summed relative to the first event to limit
+            # the rounding errors of the sums of squares
+            self._offset = np.nan_to_num(mean)
+
+        samples = adc_samples - self._offset[:, np.newaxis]
+
+        if self.nan_aware:
+
+            valid_samples = np.isfinite(samples)
+            samples = np.where(valid_samples, samples, 0)
+            n_samples = np.sum(valid_samples, axis=-1)
+
+        else:
+
+            n_samples = np.full(samples.shape[0], samples.shape[-1])
+
+        if self.window_time is not None and time is not None:
+
+            while self._count and \
+                    self._times[self._first] < time - self.window_time:
+
+                self._time_span_reached = True
+                self._remove_oldest()
+
+        if self._count == self.n_events:
+
+            self._remove_oldest()
+
+        last = (self._first + self._count) % self.n_events
+        self._means[last] = mean
+        self._stds[last] = std
+        self._n_samples[last] = n_samples
+        self._sample_sums[last] = np.sum(samples, axis=-1)
+        self._square_sums[last] = np.sum(samples**2, axis=-1)
+        self._times[last] = np.nan if time is None else time
+        self._count += 1
+        self._n_added += 1
+        self._baseline = None
+        self._std = None
+        self._add_to_sums(last, 1)
+
+        # limit the accumulation of rounding errors of the running sums
+        if self._n_added % self.n_events == 0:
+
+            self._recompute_sums()
+
+    @property
+    def baseline(self):
+        """Baseline of the pixels, NaN if no valid event.
+        It is computed once after each `add()`"""
+
+        if self._baseline is None:
+
+            self._baseline = self._compute_baseline()
+
+        return self._baseline
+
+    @property
+    def std(self):
+        """Mean of the standard deviations of the samples of the events"""
+
+        if self._std is None:
+
+            self._std = self._sum_std / self._valid_or_nan()
+
+        return self._std
+
+    @property
+    def pooled_mean(self):
+        """Mean of all the samples of the window, as `np.nanmean`"""
+
+        n_samples = np.where(self._sum_n_samples > 0, self._sum_n_samples,
+                             np.nan)
+
+        return self._offset + self._sum_samples / n_samples
+
+    @property
+    def pooled_std(self):
+        """Standard deviation of all the samples of the window, as
+        `np.nanstd`. Unlike `std` it includes the variations of the baseline
+        from one event to the other."""
+
+        n_samples = np.where(self._sum_n_samples > 0, self._sum_n_samples,
+                             np.nan)
+        mean = self._sum_samples / n_samples
+        variance = self._sum_squares / n_samples - mean**2
+
+        return np.sqrt(np.maximum(variance, 0))
+
+    def reject_last(self, pixels):
+        """Remove the pixels `pixels` (mask or indices) of the last event
+        added from the window, e.g. noisy pixels. Requires `nan_aware`."""
+
+        if not self.nan_aware:
+
+            raise ValueError('reject_last() requires nan_aware=True')
+
+        last = (self._first + self._count - 1) % self.n_events
+        self._add_to_sums(last, -1)
+        self._means[last, pixels] = np.nan
+        self._stds[last, pixels] = np.nan
+        self._n_samples[last, pixels] = 0
+        self._sample_sums[last, pixels] = 0
+        self._square_sums[last, pixels] = 0
+        self._add_to_sums(last, 1)
+        self._baseline = None
+        self._std = None
+
+    def _compute_baseline(self):
+
+        if self.mode == 'mean':
+
+            return self._sum / self._valid_or_nan()
+
+        means = self._window(self._means)
+
+        if self.mode == 'median':
+
+            return np.nanmedian(means, axis=0)
+
+        median = np.nanmedian(means, axis=0)
+        spread = np.nanstd(means, axis=0)
+        outliers = np.abs(means - median) > self.n_sigma * spread
+        means = np.where(outliers, np.nan, means)
+
+        return np.nanmean(means, axis=0)
+
+    def _valid_or_nan(self):
+
+        return np.where(self._valid > 0, self._valid, np.nan)
+
+    def _window(self, array):
+
+        rows = (self._first + np.arange(self._count)) % self.n_events
+
+        return array[rows]
+
+    def _add_to_sums(self, row, sign):
+
+        mean = self._means[row]
+        std = self._stds[row]
+
+        if self.nan_aware:
+
+            valid = np.isfinite(mean)
+            mean = np.where(valid, mean, 0)
+            std = np.where(valid, std, 0)
+            self._valid += sign * valid
+
+        else:
+
+            self._valid += sign
+
+        self._sum += sign * mean
+        self._sum_std += sign * std
+        self._sum_n_samples += sign * self._n_samples[row]
+        self._sum_samples += sign * self._sample_sums[row]
+        self._sum_squares += sign * self._square_sums[row]
+
+    def _remove_oldest(self):
+
+        self._add_to_sums(self._first, -1)
+        self._first = (self._first + 1) % self.n_events
+        self._count -= 1
+
+    def _recompute_sums(self):
+
+        self._sum[:] = 0
+        self._sum_std[:] = 0
+        self._valid[:] = 0
+        self._sum_n_samples[:] = 0
+        self._sum_samples[:] = 0
+        self._sum_squares[:] = 0
+
+        for row in (self._first + np.arange(self._count)) % self.n_events:
+
+            self._add_to_sums(row, 1)
+
+
+def fill_baseline_r0(event_stream, n_bins=10000, window_time=None,
+                     mode='mean', nan_aware=False):
+    """
+    Fill the baseline and its standard deviation from the random triggers
+    (camera_event_type 8) preceding the events, c.f. `RunningBaseline`.
+    They are set once the window is full.
+
+    :param event_stream: the event stream, or stream of blocks of events
+    :param n_bins: length of the window in samples
+    :param window_time: if given, length of the window in seconds
+    (local_camera_clock), `n_bins` then limits the number of events kept
+    :param mode: 'mean', 'median' or 'clipped', c.f. `RunningBaseline`
+    :param nan_aware: ignore NaN samples
+    """
+    baselines = {}
 
-def fill_baseline_r0(event_stream, n_bins=10000):
-    n_events = None
-    baselines = []
-    baselines_std = []
     for event in event_stream:
         for telescope_id in event.r0.tels_with_data:
             r0_camera = event.r0.tel[telescope_id]
             adc_samples = r0_camera.adc_samples
-            if n_events is None:
-                n_events = n_bins // adc_samples.shape[1]
-
-            if r0_camera.camera_event_type == 8:
-                baselines.append(adc_samples.mean(axis=1))
-                baselines = baselines[-n_events:]
-                baselines_std.append(adc_samples.std(axis=1))
-                baselines_std = baselines_std[-n_events:]
-
-            if len(baselines) == n_events:
-                r0_camera.baseline = np.mean(baselines, axis=0)
-                r0_camera.standard_deviation = np.mean(baselines_std, axis=0)
+
+            if telescope_id not in baselines:
+                n_events = max(n_bins // adc_samples.shape[-1], 1)
+                baselines[telescope_id] = RunningBaseline(
+                    n_events,
+                    window_time=None if window_time is None
+                    else window_time * 1e9,
+                    mode=mode,
+                    nan_aware=nan_aware,
+                )
+
+            running_baseline = baselines[telescope_id]
+
+            if adc_samples.ndim == 2:
+
+                _fill_baseline(r0_camera, running_baseline, adc_samples,
+                               r0_camera.camera_event_type,
+                               r0_camera.local_camera_clock)
+
+            else:
+
+                _fill_baseline_block(r0_camera, running_baseline)
+
         yield event
 
 
-def extract_baseline(event_stream, calib_container):
+def _fill_baseline(r0_camera, running_baseline, adc_samples, event_type,
+                   time):
+
+    if event_type == 8:
+        running_baseline.add(adc_samples, time=time)
+
+    if running_baseline.ready:
+        r0_camera.baseline = running_baseline.baseline
+        r0_camera.standard_deviation = running_baseline.std
+
+
+def _fill_baseline_block(r0_camera, running_baseline):
+
+    n_events, n_pixels = r0_camera.adc_samples.shape[:2]
+    baseline = np.full((n_events, n_pixels), np.nan)
+    std = np.full((n_events, n_pixels), np.nan)
+    current_baseline = running_baseline.baseline \
+        if running_baseline.ready else None
+    current_std = running_baseline.std if running_baseline.ready else None
+
+    for i in range(n_events):
+
+        if r0_camera.camera_event_type[i] == 8:
+
+            time = None if r0_camera.local_camera_clock is None \
+                else r0_camera.local_camera_clock[i]
+            running_baseline.add(r0_camera.adc_samples[i], time=time)
+
+            if running_baseline.ready:
+                current_baseline = running_baseline.baseline
+                current_std = running_baseline.std
+
+        if current_baseline is not None:
+            baseline[i] = current_baseline
+            std[i] = current_std
+
+    r0_camera.baseline = baseline
+    r0_camera.standard_deviation = std
+
+
+def extract_baseline(event_stream, calib_container, noise_threshold=50):
     """
     Extract the baseline from event flagged as random trigger (trigger_flag = 1)
+    The mean and standard deviation of the samples of the random triggers
+    preceding the event, over the last `calib_container.sample_to_consider`
+    samples, are stored in `calib_container.baseline` and
+    `calib_container.std_dev` (i.e. `np.nanmean` and `np.nanstd` of the
+    samples, the standard deviation includes the variations of the baseline
+    from one event to the other). They are set once 10 % of the window is
+    filled. A pixel of an event whose mean exceeds the means of both the
+    previous and the next random triggers by more than `noise_threshold`
+    LSB is removed from the window.
     :param event_stream: the event stream
     :param calib_container: the calibration container
+    :param noise_threshold: maximum jump of the pixel mean (LSB)
     :return:
     """
 
-    pixel_list = list(range(1296))
+    running_baseline = None
+    # means of the previous and previous-but-one random triggers
+    previous_means = []
 
     for event in event_stream:
 
         # Check that the event is random trigger
         if event.trig.trigger_flag != 1:
             yield event
+            continue
 
         for telid in event.r0.tels_with_data:
-            # Get the adcs
-            adcs = event.r0.tel[telid].adc_samples
-            # When the first event comes, add adcs.shape[-1] length to the number of samples
-            if calib_container.sample_to_consider == calib_container.samples_for_baseline.shape[-1]:
-                calib_container.samples_for_baseline = np.append(calib_container.samples_for_baseline,
-                                                                 np.zeros((1296, adcs.shape[-1]), dtype=int),axis=-1)
-
-            #print(calib_container.samples_for_baseline.shape)
-            # Was the container filled up to n_samples_for_baseline?
-            compute_full_baseline = True
-            if calib_container.counter < calib_container.samples_for_baseline.shape[-1] - 1:
-                compute_full_baseline = False
-
-            # Check the meaningfulness of previous event for baseline calculation and set to nan noisy pixels
-            if calib_container.counter - 2 * adcs.shape[-1] > 0 :
-                #print(calib_container.samples_for_baseline.shape,calib_container.counter, calib_container.counter + adcs.shape[-1])
-                prev_mean = np.mean(
-                    calib_container.samples_for_baseline[:,
-                    calib_container.counter - adcs.shape[-1]:calib_container.counter],
-                    axis=-1)
-                prevprev_mean = np.mean(calib_container.samples_for_baseline[:,
-                                        calib_container.counter - 2 * adcs.shape[-1]:calib_container.counter] -
-                                        adcs.shape[
-                                            -1],
-                                        axis=-1)
-                present_mean = np.mean(adcs, axis=-1)
-                calib_container.samples_for_baseline[prev_mean - np.minimum(present_mean, prevprev_mean) > 50][
-                calib_container.counter - adcs.shape[-1]:calib_container.counter] = np.nan
-            else:
-                yield event
-
-            # Insert new event
-            if compute_full_baseline:
-                # shift all adcs by one event
-                calib_container.samples_for_baseline[:, :-adcs.shape[-1]] = calib_container.samples_for_baseline[:,
-                                                                            adcs.shape[-1]:]
-                # Add the new event
-                calib_container.samples_for_baseline[:, -adcs.shape[-1]:] = adcs
-                # Compute the baseline and standard deviations
+            adcs = event.r0.tel[telid].adc_samples.astype(float)
+            n_samples = adcs.shape[-1]
+
+            if running_baseline is None:
+                n_events = calib_container.sample_to_consider // n_samples
+                running_baseline = RunningBaseline(max(n_events, 1),
+                                                   nan_aware=True)
+
+            means = np.nanmean(adcs, axis=-1)
+
+            if len(previous_means) == 2 and len(running_baseline):
+                previous, previous_but_one = previous_means
+                noisy = previous - np.minimum(means, previous_but_one) > \
+                    noise_threshold
+                running_baseline.reject_last(noisy)
+
+            previous_means = [means] + previous_means[:1]
+
+            # the window holds the events preceding the current one
+            n_filled = (len(running_baseline) + 1) * n_samples
+
+            if len(running_baseline) and \
+                    n_filled > 0.1 * calib_container.sample_to_consider:
                 calib_container.baseline_ready = True
-                calib_container.baseline = np.nanmean(calib_container.samples_for_baseline[:, :-adcs.shape[-1]],
-                                                      axis=-1)
-                calib_container.std_dev = np.nanstd(calib_container.samples_for_baseline[:, :-adcs.shape[-1]], axis=-1)
-                yield event
+                calib_container.baseline = running_baseline.pooled_mean
+                calib_container.std_dev = running_baseline.pooled_std
 
-            else:
-                # Fill it in the proper place
-                calib_container.samples_for_baseline[:,
-                calib_container.counter: calib_container.counter + adcs.shape[-1]] = adcs
-                # and increment the counter
-                calib_container.counter += adcs.shape[-1]
-                # Compute the baseline and standard deviations
-                if calib_container.counter>0.1*calib_container.sample_to_consider :
-                    calib_container.baseline_ready = True
-                    calib_container.baseline = np.nanmean(calib_container.samples_for_baseline[:, :calib_container.counter-adcs.shape[-1]],
-                                                          axis=-1)
-                    calib_container.std_dev = np.nanstd(calib_container.samples_for_baseline[:, :calib_container.counter-adcs.shape[-1]], axis=-1)
-                yield event
+            running_baseline.add(adcs)
+
+        yield event
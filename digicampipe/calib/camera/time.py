@@ -1,33 +1,32 @@
 import numpy as np
 import numba
 
+BIN_TIME = 4  # 4 ns between samples
+TIME_METHODS = ['max', 'leading_edge', 'cfd', 'charge_weighted', 'template']
 
-def compute_time_from_max(events):
-
-    bin_time = 4  # 4 ns between samples
 
-    for event in events:
+def compute_time_from_max(events):
 
-        adc_samples = event.data.adc_samples
-        reconstructed_time = np.argmax(adc_samples, axis=-1) * bin_time
+    return compute_time(events, method='max')
 
-        new_shape = reconstructed_time.shape + (1, )
-        reconstructed_time = reconstructed_time.reshape(new_shape)
-        event.data.reconstructed_time = reconstructed_time
 
-        yield event
+def compute_time_from_leading_edge(events, threshold=0.5):
 
+    return compute_time(events, method='leading_edge', threshold=threshold)
 
-def compute_time_from_leading_edge(events, threshold=0.5):
 
-    bin_time = 4 # 4 ns between samples
+def compute_time(events, method='leading_edge', **kwargs):
+    """
+    Fill `event.data.reconstructed_time` (in ns) with the pulse arrival time
+    estimated by `estimate_time()`.
+    Works on single events as well as on blocks of events.
+    """
 
     for event in events:
 
         adc_samples = event.data.adc_samples
-
-        times = estimate_time_from_leading_edge(adc_samples, threshold)
-        times = times * bin_time
+        times = estimate_time(adc_samples, method=method, **kwargs)
+        times = times * BIN_TIME
         new_shape = times.shape + (1, )
         times = times.reshape(new_shape)
         event.data.reconstructed_time = times
@@ -35,7 +34,68 @@ def compute_time_from_leading_edge(events, threshold=0.5):
         yield event
 
 
-@numba.jit
+def estimate_time(adc_samples, method='leading_edge', threshold=0.5,
+                  fraction=0.3, delay=2, half_width=3, template=None):
+    """
+    Estimate the pulse arrival time in the waveforms, in units of samples.
+    The input is not modified.
+
+    :param adc_samples: array of shape (..., n_samples), e.g.
+    (n_pixels, n_samples) or (n_events, n_pixels, n_samples)
+    :param method:
+        'max': sample of the maximum
+        'leading_edge': time the leading edge crosses `threshold` times the
+        pulse height (linear interpolation between samples)
+        'cfd': zero crossing of the constant fraction discriminator signal
+        y(t - delay) - fraction * y(t)
+        'charge_weighted': centroid of the samples within `half_width`
+        samples of the maximum
+        'template': shift of `template` maximising its correlation with the
+        waveform, refined by a parabolic interpolation
+    :param template: array of the template sampled every sample from its
+    time origin, only used by the 'template' method. Defaults to the
+    SST-1M pulse template.
+    :return: array of shape (...) of the arrival times, NaN when the time
+    could not be estimated
+    """
+
+    if method not in TIME_METHODS:
+
+        raise ValueError('Unknown method {}, use one of {}'.format(
+            method, TIME_METHODS))
+
+    adc_samples = np.asarray(adc_samples)
+    shape = adc_samples.shape[:-1]
+    waveforms = adc_samples.reshape(-1, adc_samples.shape[-1])
+
+    if method == 'max':
+
+        times = np.argmax(waveforms, axis=-1).astype(np.float64)
+
+    elif method == 'leading_edge':
+
+        times = _leading_edge(waveforms, threshold)
+
+    elif method == 'cfd':
+
+        times = _constant_fraction(waveforms, fraction, delay)
+
+    elif method == 'charge_weighted':
+
+        times = _charge_weighted(waveforms, half_width)
+
+    else:
+
+        if template is None:
+
+            template = sampled_template()
+
+        times = _template_correlation(waveforms,
+                                      np.asarray(template, dtype=np.float64))
+
+    return times.reshape(shape)
+
+
 def estimate_time_from_leading_edge(adc, thr=0.5):
     """
     estimate the pulse arrival time, defined as the time the leading edge
@@ -56,22 +116,144 @@ def estimate_time_from_leading_edge(adc, thr=0.5):
     return:
         arrival_time (1296) in units of time_slices
     """
-    n_pixel = adc.shape[0]
-    arrival_times = np.zeros(n_pixel, dtype='f4')
-
-    for pixel_id in range(n_pixel):
-        y = adc[pixel_id]
-        y -= y.min()
-        am = y.argmax()
-        y_ = y[:am+1]
-        lim = y_[-1] * thr
-        foo = np.where(y_ < lim)[0]
-        if len(foo):
-            start = foo[-1]
-            stop = start + 1
-            arrival_times[pixel_id] = start + (
-                (lim-y_[start]) / (y_[stop]-y_[start])
-            )
-        else:
-            arrival_times[pixel_id] = np.nan
-    return arrival_times
+
+    return estimate_time(adc, method='leading_edge', threshold=thr)
+
+
+estimate_arrival_time = estimate_time_from_leading_edge
+
+
+def sampled_template(n_samples=None):
+    """The SST-1M pulse template sampled every `BIN_TIME` ns"""
+
+    from digicampipe.utils.pulse_template import default_template
+
+    template = default_template()
+
+    if n_samples is None:
+
+        n_samples = int(template.time[-1] // BIN_TIME) + 1
+
+    return template(np.arange(n_samples) * BIN_TIME)
+
+
+@numba.njit(parallel=True)
+def _leading_edge(waveforms, threshold):
+
+    n_waveforms, n_samples = waveforms.shape
+    times = np.empty(n_waveforms)
+
+    for i in numba.prange(n_waveforms):
+
+        y = waveforms[i]
+        minimum = y.min()
+        maximum_position = y.argmax()
+        limit = (y[maximum_position] - minimum) * threshold
+        times[i] = np.nan
+
+        for start in range(maximum_position - 1, -1, -1):
+
+            if y[start] - minimum < limit:
+
+                y_start = y[start] - minimum
+                y_stop = y[start + 1] - minimum
+                times[i] = start + (limit - y_start) / (y_stop - y_start)
+                break
+
+    return times
+
+
+@numba.njit(parallel=True)
+def _constant_fraction(waveforms, fraction, delay):
+
+    n_waveforms, n_samples = waveforms.shape
+    times = np.empty(n_waveforms)
+
+    for i in numba.prange(n_waveforms):
+
+        y = waveforms[i]
+        minimum = y.min()
+        signal = np.zeros(n_samples)
+
+        for j in range(delay, n_samples):
+
+            signal[j] = (y[j - delay] - minimum) - \
+                fraction * (y[j] - minimum)
+
+        times[i] = np.nan
+
+        for j in range(signal.argmin(), n_samples - 1):
+
+            if signal[j] < 0 <= signal[j + 1]:
+
+                times[i] = j - signal[j] / (signal[j + 1] - signal[j])
+                break
+
+    return times
+
+
+@numba.njit(parallel=True)
+def _charge_weighted(waveforms, half_width):
+
+    n_waveforms, n_samples = waveforms.shape
+    times = np.empty(n_waveforms)
+
+    for i in numba.prange(n_waveforms):
+
+        y = waveforms[i]
+        minimum = y.min()
+        maximum_position = y.argmax()
+        start = max(maximum_position - half_width, 0)
+        stop = min(maximum_position + half_width + 1, n_samples)
+        charge = 0.
+        moment = 0.
+
+        for j in range(start, stop):
+
+            charge += y[j] - minimum
+            moment += j * (y[j] - minimum)
+
+        times[i] = moment / charge if charge > 0 else np.nan
+
+    return times
+
+
+@numba.njit(parallel=True)
+def _template_correlation(waveforms, template):
+
+    n_waveforms, n_samples = waveforms.shape
+    n_template = len(template)
+    n_shifts = n_samples + n_template - 1
+    times = np.empty(n_waveforms)
+
+    for i in numba.prange(n_waveforms):
+
+        y = waveforms[i]
+        minimum = y.min()
+        correlation = np.zeros(n_shifts)
+
+        # shift of the template origin: from -(n_template - 1) to n_samples
+        for k in range(n_shifts):
+
+            shift = k - n_template + 1
+
+            for j in range(max(shift, 0), min(shift + n_template, n_samples)):
+
+                correlation[k] += (y[j] - minimum) * template[j - shift]
+
+        best = correlation.argmax()
+        delta = 0.
+
+        if 0 < best < n_shifts - 1:
+
+            left = correlation[best - 1]
+            right = correlation[best + 1]
+            curvature = left - 2 * correlation[best] + right
+
+            if curvature < 0:
+
+                delta = 0.5 * (left - right) / curvature
+
+        times[i] = best - n_template + 1 + delta
+
+    return times
@@ -0,0 +1,238 @@
+"""
+Image cleaning on a sparse neighbour graph of the camera pixels.
+
+The neighbours are given as a scipy.sparse CSR adjacency matrix of shape
+(n_pixels, n_pixels), c.f. `neighbor_matrix_sparse()`. All the functions
+work on a single image of shape (n_pixels, ) as well as on a block of
+images of shape (..., n_pixels).
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+__all__ = ['neighbor_matrix_sparse', 'count_neighbors', 'tailcuts',
+           'dilate', 'time_constrained', 'label_islands', 'largest_island',
+           'on_border']
+
+_NEIGHBORS = {}
+
+
+def neighbor_matrix_sparse(geom):
+    """
+    CSR adjacency matrix of the pixels of `geom`, computed once per camera
+    geometry from its neighbour list.
+    """
+
+    key = id(geom)
+
+    if key not in _NEIGHBORS or _NEIGHBORS[key][0] is not geom:
+
+        neighbors = geom.neighbors
+        rows = np.repeat(np.arange(len(neighbors)),
+                         [len(pixels) for pixels in neighbors])
+        columns = np.concatenate([np.asarray(pixels, dtype=int)
+                                  for pixels in neighbors])
+        matrix = csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(neighbors), len(neighbors)))
+        _NEIGHBORS[key] = geom, matrix
+
+    return _NEIGHBORS[key][1]
+
+
+def count_neighbors(mask, neighbors):
+    """Number of neighbours of each pixel within `mask`"""
+
+    mask = np.asarray(mask)
+    n_pixels = mask.shape[-1]
+    flat = mask.reshape(-1, n_pixels).astype(np.int32)
+    count = neighbors.dot(flat.T).T
+
+    return count.reshape(mask.shape)
+
+
+def tailcuts(image, neighbors, picture_threshold, boundary_threshold,
+             keep_isolated_pixels=False, min_number_picture_neighbors=0):
+    """
+    Two level cleaning, as `ctapipe.image.cleaning.tailcuts_clean`: the
+    pixels above `picture_threshold` and the pixels above
+    `boundary_threshold` next to them are kept.
+
+    :param image: array of shape (..., n_pixels)
+    :param neighbors: CSR adjacency matrix of the pixels
+    :param keep_isolated_pixels: keep the picture pixels without any
+    boundary neighbour
+    :param min_number_picture_neighbors: minimum number of picture
+    neighbours of a picture pixel
+    :return: boolean mask of the same shape as `image`
+    """
+
+    above_picture = image >= picture_threshold
+
+    if keep_isolated_pixels or min_number_picture_neighbors == 0:
+
+        in_picture = above_picture
+
+    else:
+
+        in_picture = above_picture & (
+            count_neighbors(above_picture, neighbors) >=
+            min_number_picture_neighbors)
+
+    above_boundary = image >= boundary_threshold
+    with_picture_neighbors = count_neighbors(in_picture, neighbors) > 0
+
+    if keep_isolated_pixels:
+
+        return (above_boundary & with_picture_neighbors) | in_picture
+
+    with_boundary_neighbors = count_neighbors(above_boundary, neighbors) > 0
+
+    return (above_boundary & with_picture_neighbors) | \
+        (in_picture & with_boundary_neighbors)
+
+
+def dilate(mask, neighbors, image=None, threshold=None, n_iterations=None):
+    """
+    Grow `mask` with the neighbouring pixels, only the frontier (pixels
+    added by the previous step) is extended at each step.
+
+    :param mask: boolean array of shape (..., n_pixels)
+    :param neighbors: CSR adjacency matrix of the pixels
+    :param image: if given with `threshold`, only the pixels of `image`
+    above `threshold` can be added
+    :param n_iterations: number of steps, by default until no pixel is added
+    :return: the dilated mask (`mask` is not modified)
+    """
+
+    mask = np.array(mask, dtype=bool)
+    allowed = np.ones(mask.shape, dtype=bool) if image is None or \
+        threshold is None else image > threshold
+    frontier = mask
+    iteration = 0
+
+    while frontier.any() and (n_iterations is None or
+                              iteration < n_iterations):
+
+        frontier = (count_neighbors(frontier, neighbors) > 0) & allowed & \
+            ~mask
+        mask |= frontier
+        iteration += 1
+
+    return mask
+
+
+def time_constrained(mask, neighbors, time, max_time_difference,
+                     min_neighbors=1):
+    """
+    Keep the pixels of `mask` having at least `min_neighbors` neighbours in
+    `mask` whose time differs by at most `max_time_difference`.
+
+    :param mask: boolean array of shape (..., n_pixels)
+    :param neighbors: CSR adjacency matrix of the pixels
+    :param time: array of the same shape as `mask`
+    :return: boolean mask
+    """
+
+    mask = np.asarray(mask, dtype=bool)
+    n_pixels = mask.shape[-1]
+    flat_mask = mask.reshape(-1, n_pixels)
+    flat_time = np.asarray(time, dtype=np.float64).reshape(-1, n_pixels)
+    rows, columns = neighbors.nonzero()
+
+    coincident = flat_mask[:, rows] & flat_mask[:, columns] & (
+        np.abs(flat_time[:, rows] - flat_time[:, columns]) <=
+        max_time_difference)
+    images, edges = np.nonzero(coincident)
+    count = np.bincount(images * n_pixels + rows[edges],
+                        minlength=flat_mask.size)
+
+    return mask & (count.reshape(mask.shape) >= min_neighbors)
+
+
+def label_islands(mask, neighbors):
+    """
+    Connected groups of pixels (islands) of `mask`, all the images at once.
+
+    :param mask: boolean array of shape (..., n_pixels)
+    :param neighbors: CSR adjacency matrix of the pixels
+    :return: n_islands of shape (...) and the labels of the pixels, of the
+    same shape as `mask`: 0 outside of `mask`, 1 to n_islands within
+    """
+
+    mask = np.asarray(mask, dtype=bool)
+    n_pixels = mask.shape[-1]
+    flat_mask = mask.reshape(-1, n_pixels)
+    n_images = len(flat_mask)
+    n_nodes = flat_mask.size
+    rows, columns = neighbors.nonzero()
+
+    # a single graph of all the images, only the edges within mask are kept
+    images, edges = np.nonzero(flat_mask[:, rows] & flat_mask[:, columns])
+    graph = csr_matrix(
+        (np.ones(len(edges), dtype=np.int8),
+         (images * n_pixels + rows[edges],
+          images * n_pixels + columns[edges])),
+        shape=(n_nodes, n_nodes))
+    _, components = connected_components(graph, directed=False)
+
+    selected = np.flatnonzero(flat_mask)
+    unique, inverse = np.unique(components[selected], return_inverse=True)
+    component_image = np.zeros(len(unique), dtype=int)
+    component_image[inverse] = selected // n_pixels
+
+    # number the islands from 1 in each image
+    order = np.lexsort((unique, component_image))
+    rank = np.empty(len(unique), dtype=int)
+    rank[order] = np.arange(len(unique))
+    n_islands = np.bincount(component_image, minlength=n_images)
+    first = np.cumsum(n_islands) - n_islands
+
+    labels = np.zeros(n_nodes, dtype=int)
+    labels[selected] = rank[inverse] - first[component_image[inverse]] + 1
+
+    return n_islands.reshape(mask.shape[:-1]), labels.reshape(mask.shape)
+
+
+def largest_island(labels, image=None):
+    """
+    Mask of the largest island of each image, in number of pixels or in
+    total `image` if given.
+
+    :param labels: island labels, c.f. `label_islands()`
+    :param image: array of the same shape as `labels`
+    :return: boolean mask
+    """
+
+    labels = np.asarray(labels)
+    n_pixels = labels.shape[-1]
+    flat_labels = labels.reshape(-1, n_pixels)
+    n_images = len(flat_labels)
+    n_labels = flat_labels.max(initial=0) + 1
+    weights = None if image is None else \
+        np.asarray(image, dtype=np.float64).reshape(-1, n_pixels)[
+            flat_labels > 0]
+
+    images, pixels = np.nonzero(flat_labels)
+    size = np.bincount(images * n_labels + flat_labels[images, pixels],
+                       weights=weights, minlength=n_images * n_labels)
+    size = size.reshape(n_images, n_labels).astype(np.float64)
+    size[:, 0] = -np.inf
+    largest = np.argmax(size, axis=-1)
+
+    mask = (flat_labels == largest[:, np.newaxis]) & (flat_labels > 0)
+
+    return mask.reshape(labels.shape)
+
+
+def on_border(mask, neighbors, n_neighbors=6):
+    """
+    True for the images with a pixel of `mask` on the camera border, i.e.
+    with less than `n_neighbors` neighbours.
+
+    :return: boolean array of shape mask.shape[:-1]
+    """
+
+    border = np.diff(neighbors.indptr) < n_neighbors
+
+    return np.any(np.asarray(mask) & border, axis=-1)
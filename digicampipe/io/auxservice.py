@@ -1,16 +1,128 @@
-from datetime import timedelta
+from datetime import date as Date, timedelta
+import json
+import os
 import numpy as np
 from collections import OrderedDict, namedtuple
-import pandas as pd
 
-from functools import lru_cache
 from glob import glob
 from astropy import table
 from os import path
 
+NS_PER_DAY = 24 * 3600 * 10**9
+# nights start at noon (UTC)
+NIGHT_OFFSET_NS = 12 * 3600 * 10**9
+INTERPOLATION_MODES = ['previous', 'nearest', 'linear']
+
+
+class SlowDataCache:
+    ''' cache of the slow data of the nights, keyed by
+    (service name, basepath, night).
+
+    The merged tables (c.f. combine_tables) are kept in memory as time-sorted
+    read-only numpy columns, the least recently used nights are evicted
+    when the cache holds more than `max_bytes`.
+    If `cache_dir` is given, the columns are also written to
+    `cache_dir/<name>_<YYYYMMDD>.npz` so that later analyses of the same
+    night do not parse the fits files again. A cached file is re-created
+    when the fits files of the night change.
+    '''
+
+    def __init__(self, max_bytes=512 * 2**20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, service, date):
+        ''' (columns, meta) of the service at the night of date '''
+        key = (service.name, service.basepath, date)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        entry = self._load(service, date)
+
+        # the columns are shared by all the users of the cache
+        for column in entry[0].values():
+            column.setflags(write=False)
+
+        self._entries[key] = entry
+        self.nbytes += _columns_nbytes(entry[0])
+
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (columns, _) = self._entries.popitem(last=False)
+            self.nbytes -= _columns_nbytes(columns)
+
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _load(self, service, date):
+        paths = service.get_paths(date)
+        sources = np.array(
+            [(os.fsencode(p), os.stat(p).st_mtime) for p in paths],
+            dtype=[('path', 'S1024'), ('mtime', float)]
+        )
+        cache_path = None
+
+        if self.cache_dir is not None:
+            cache_path = path.join(
+                self.cache_dir,
+                '{}_{}.npz'.format(service.name, date.strftime('%Y%m%d'))
+            )
+
+            if path.exists(cache_path):
+                with np.load(cache_path) as f:
+                    if np.array_equal(f['__sources__'], sources):
+                        columns = OrderedDict(
+                            (name, f[name]) for name in f['__colnames__']
+                        )
+                        meta = json.loads(str(f['__meta__']))
+                        return columns, meta
+
+        combined_table = combine_tables(paths)
+        columns = table_to_columns(combined_table)
+        meta = combined_table.meta
+
+        if cache_path is not None and not any(
+                column.dtype.hasobject for column in columns.values()):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(
+                cache_path,
+                __sources__=sources,
+                __colnames__=np.array(list(columns)),
+                __meta__=json.dumps(meta, default=_to_json),
+                **columns
+            )
+
+        return columns, meta
+
+
+def _columns_nbytes(columns):
+    return sum(column.nbytes for column in columns.values())
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+# shared by all the AuxService by default
+SLOW_DATA_CACHE = SlowDataCache()
+
 
 class AuxService:
-    def __init__(self, name, basepath):
+    def __init__(self, name, basepath, cache=None):
         self.name = name
         self.basepath = basepath
         self.glob_expr = path.join(
@@ -19,6 +131,7 @@ class AuxService:
                 name=name,
             )
         )
+        self.cache = SLOW_DATA_CACHE if cache is None else cache
         self.namedtuple_klass = None
 
     def get_paths(self, date):
@@ -30,44 +143,173 @@ class AuxService:
             )
         )
 
-    # maxsize needs to be > number of Services
-    # lru cache for instance methods is shit...
-    @lru_cache(maxsize=20)
     def at_date(self, date):
         ''' fetch fits Table for named aux service at date.
-        If several files: append them in order.
-        takes some time, result will maybe be cached.
+        If several files: append them, the rows are sorted by "timestamp".
+        The table is a copy of the cached columns, c.f. SlowDataCache.
         '''
-        paths = self.get_paths(date)
-        combined_table = combine_tables(paths)
+        columns, meta = self.cache.get(self, date)
+        return table.Table(columns, meta=meta, copy=True)
 
-        # side effect!
-        # we've just read a new day, so we update the format of our
-        # return value
-        self.namedtuple_klass = namedtuple(
-            self.name+"Row",
-            combined_table.colnames
-        )
-        return combined_table
+    def columns_at_date(self, date):
+        ''' the table of the night as a dict of read-only numpy arrays,
+        sorted by "timestamp" (in ms).
+        '''
+        columns, _ = self.cache.get(self, date)
+        return columns
 
-    def at(self, event_timestamp_in_ns):
-        datetime = pd.to_datetime(event_timestamp_in_ns, unit='ns')
-        date = (datetime - timedelta(hours=12)).date()
-        table = self.at_date(date)
+    def at_many(self, timestamps_in_ns, mode='previous'):
+        ''' slow data at the event timestamps
+
+        Parameters
+        ----------
+        timestamps_in_ns: array-like
+            event timestamps (e.g. local_camera_clock) in ns
+        mode: str
+            'previous': last entry at or before the timestamp,
+            'nearest': entry closest in time,
+            'linear': linear interpolation of the numerical columns between
+            the entries around the timestamp, the other columns are taken
+            from the previous entry.
+
+        Returns
+        -------
+        dict of arrays, one per column of the table, with the timestamps
+        along the first axis
+        '''
+        timestamps_in_ns = np.asarray(timestamps_in_ns)
+        nights = night_of(timestamps_in_ns)
+        unique_nights = np.unique(nights)
+        result = None
+
+        for night in unique_nights:
+
+            columns = self.columns_at_date(night_to_date(night))
+
+            if len(unique_nights) == 1:
+
+                return lookup_columns(columns, timestamps_in_ns / 1e6, mode)
+
+            in_night = nights == night
+            values = lookup_columns(
+                columns, timestamps_in_ns[in_night] / 1e6, mode)
+
+            if result is None:
+
+                result = {
+                    name: np.zeros(
+                        timestamps_in_ns.shape + value.shape[1:],
+                        dtype=value.dtype
+                    )
+                    for name, value in values.items()
+                }
+
+            for name, value in values.items():
+
+                result[name][in_night] = value
+
+        return result
+
+    def at(self, event_timestamp_in_ns, mode='previous'):
+        ''' slow data at the event timestamp, as a namedtuple.
+        If several timestamps are given, the fields are arrays,
+        c.f. at_many()
+        '''
+        columns = self.at_many(np.atleast_1d(event_timestamp_in_ns), mode)
+
+        # the columns can change from one night to the other
+        if self.namedtuple_klass is None or \
+                self.namedtuple_klass._fields != tuple(columns):
+
+            self.namedtuple_klass = namedtuple(self.name + "Row", columns)
+
+        if np.ndim(event_timestamp_in_ns) > 0:
+
+            return self.namedtuple_klass(**columns)
 
-        event_timestamp_in_ms = event_timestamp_in_ns / 1e6
-        table_index = np.searchsorted(
-            table['timestamp'],
-            event_timestamp_in_ms
-        )
-        # this row is still a astropy.Table.Row thing
-        row = table[table_index - 1]
         return self.namedtuple_klass(**{
-            name: row[name]
-            for name in table.colnames
+            name: column[0]
+            for name, column in columns.items()
         })
 
 
+def night_of(timestamps_in_ns):
+    ''' number of the night (days since 1970-01-01, starting at noon UTC)
+    of timestamps in ns
+    '''
+    timestamps_in_ns = np.asarray(timestamps_in_ns)
+    return np.floor_divide(
+        timestamps_in_ns - NIGHT_OFFSET_NS, NS_PER_DAY
+    ).astype(np.int64)
+
+
+def night_to_date(night):
+    return Date(1970, 1, 1) + timedelta(days=int(night))
+
+
+def table_to_columns(t):
+    ''' astropy.table.Table to a dict of numpy arrays sorted by
+    "timestamp"
+    '''
+    order = np.argsort(np.asarray(t['timestamp']), kind='stable')
+    return OrderedDict(
+        (name, np.asarray(t[name])[order])
+        for name in t.colnames
+    )
+
+
+def lookup_columns(columns, timestamps_in_ms, mode='previous'):
+    ''' values of the time-sorted columns at the timestamps (in ms),
+    c.f. AuxService.at_many()
+    '''
+    if mode not in INTERPOLATION_MODES:
+        raise ValueError('Unknown mode {}, use one of {}'.format(
+            mode, INTERPOLATION_MODES))
+
+    times = columns['timestamp']
+    last = len(times) - 1
+    index = np.searchsorted(times, timestamps_in_ms, side='right')
+    previous = np.clip(index - 1, 0, last)
+
+    if mode == 'previous':
+
+        return OrderedDict(
+            (name, column[previous]) for name, column in columns.items()
+        )
+
+    following = np.clip(index, 0, last)
+    dt_previous = timestamps_in_ms - times[previous]
+    dt_following = times[following] - timestamps_in_ms
+
+    if mode == 'nearest':
+
+        rows = np.where(
+            np.abs(dt_following) < np.abs(dt_previous), following, previous
+        )
+        return OrderedDict(
+            (name, column[rows]) for name, column in columns.items()
+        )
+
+    interval = (times[following] - times[previous]).astype(float)
+    weight = np.divide(dt_previous, interval,
+                       out=np.zeros(len(interval)), where=interval != 0)
+    weight = np.clip(weight, 0, 1)
+    result = OrderedDict()
+
+    for name, column in columns.items():
+
+        value = column[previous]
+
+        if np.issubdtype(column.dtype, np.number):
+
+            w = weight.reshape(weight.shape + (1, ) * (column.ndim - 1))
+            value = value + w * (column[following].astype(float) - value)
+
+        result[name] = value
+
+    return result
+
+
 def read_table(path):
     ''' basically astropy.table.Table.read(path), but
     we need a "timestamp" column to syncronize with event times.
@@ -0,0 +1,134 @@
+"""
+Preallocated buffers for the arrays of the event stream.
+
+The event sources re-use the same `DataContainer` for every event. The
+arrays they hold are either fresh arrays (one allocation per event) or
+buffers taken from a `BufferPool`. A buffer of the pool is overwritten only
+after `n_buffers` further events, so an event (or an array of it) can be
+kept for `n_buffers - 1` events without copying it.
+
+Stages modifying arrays of the container in place declare it with
+`modifies()`, the declared arrays are copied out of their pool before such
+a stage sees them; every other stage writes its results in new arrays or in
+arrays of its own pool.
+"""
+from functools import wraps
+from weakref import WeakValueDictionary
+
+import numpy as np
+
+__all__ = ['BufferPool', 'modifies', 'is_pooled']
+
+# storage of the pools, by id
+_POOLED = WeakValueDictionary()
+
+
+class BufferPool:
+    """Ring of `n_buffers` preallocated arrays
+
+    The arrays are allocated at the first call of `get()` and reallocated
+    only if the requested shape or dtype changes.
+
+    :param n_buffers: number of buffers in the ring
+    """
+
+    def __init__(self, n_buffers):
+
+        if n_buffers < 1:
+
+            raise ValueError('n_buffers must be >= 1')
+
+        self.n_buffers = n_buffers
+        self._buffers = None
+        self._index = 0
+
+    def get(self, shape, dtype):
+        """Next buffer of the ring (its content is undefined)"""
+
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+
+        if self._buffers is None or self._buffers.shape[1:] != shape or \
+                self._buffers.dtype != dtype:
+
+            self._buffers = np.empty((self.n_buffers, ) + shape, dtype=dtype)
+            self._index = 0
+            _POOLED[id(self._buffers)] = self._buffers
+
+        buffer = self._buffers[self._index]
+        self._index = (self._index + 1) % self.n_buffers
+
+        return buffer
+
+    def copy(self, array):
+        """Copy `array` into the next buffer of the ring"""
+
+        array = np.asarray(array)
+        buffer = self.get(array.shape, array.dtype)
+        np.copyto(buffer, array)
+
+        return buffer
+
+
+def is_pooled(array):
+    """True if `array` is (a view of) a buffer of a `BufferPool`"""
+
+    while isinstance(array, np.ndarray):
+
+        if _POOLED.get(id(array)) is array:
+
+            return True
+
+        array = array.base
+
+    return False
+
+
+def modifies(*fields):
+    """Declare the container fields a stage modifies in place
+
+    The fields are available as `stage.modifies`, e.g.:
+
+        @modifies('r0.adc_samples')
+        def set_pixels_to_zero(event_stream, unwanted_pixels):
+            ...
+
+    A field 'level.name' is the array `event.level.tel[tel_id].name` of
+    every telescope. If it is a buffer of a pool (c.f. `is_pooled()`), e.g.
+    filled by an earlier stage with `n_buffers`, it is replaced by a copy
+    before the stage receives the event: the stage never writes into a
+    buffer it does not own, and the events kept by the caller are affected
+    by the stages placed after them only through arrays they own.
+    """
+    def decorator(stage):
+
+        @wraps(stage)
+        def wrapper(event_stream, *args, **kwargs):
+
+            return stage(_copy_pooled(event_stream, fields), *args, **kwargs)
+
+        wrapper.modifies = fields
+
+        return wrapper
+
+    return decorator
+
+
+def _copy_pooled(events, fields):
+
+    fields = [field.split('.') for field in fields]
+
+    for event in events:
+
+        for telescope_id in event.r0.tels_with_data:
+
+            for level, name in fields:
+
+                container = getattr(event, level).tel[telescope_id]
+                value = getattr(container, name)
+
+                if is_pooled(value):
+
+                    setattr(container, name, value.copy())
+
+        yield event
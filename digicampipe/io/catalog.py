@@ -0,0 +1,154 @@
+"""
+Columnar index of the event headers of a set of run files.
+
+The catalog holds, for every event, the file and row it is stored in
+together with its header (event number, clocks, event type and a trigger
+summary). It is written once by `digicam-catalog` and allows to select
+events, e.g. by type or time period, without decoding their waveforms,
+c.f. `event_stream(..., catalog=, selection=)`.
+"""
+from collections import OrderedDict
+import os
+import h5py
+import numpy as np
+
+__all__ = ['CATALOG_COLUMNS', 'catalog_from_events', 'save_catalog',
+           'load_catalog', 'select_rows']
+
+
+CATALOG_COLUMNS = OrderedDict([
+    ('file', np.int32),
+    ('row', np.int64),
+    ('camera_event_number', np.int64),
+    ('local_camera_clock', np.int64),
+    ('gps_time', np.int64),
+    ('camera_event_type', np.int64),
+    ('array_event_type', np.int64),
+    ('n_triggered_patches', np.int32),
+])
+
+
+def catalog_from_events(events, file_id=0):
+    """Header columns of a stream of events
+
+    Parameters
+    ----------
+    events: iterable of `DataContainer`, typically the events of one file
+    file_id: int
+        index of the file in the file list of the catalog
+
+    Returns
+    -------
+    dict of 1D arrays, one per column of `CATALOG_COLUMNS`.
+    Missing values (e.g. no clock in digicamtoy files) are set to -1
+    """
+
+    columns = {name: [] for name in CATALOG_COLUMNS}
+
+    for row, event in enumerate(events):
+
+        tel_id = event.r0.tels_with_data[0]
+        r0 = event.r0.tel[tel_id]
+
+        columns['file'].append(file_id)
+        columns['row'].append(row)
+
+        for name in ['camera_event_number', 'local_camera_clock',
+                     'gps_time', 'camera_event_type', 'array_event_type']:
+
+            value = r0[name]
+            columns[name].append(-1 if value is None else value)
+
+        trigger = r0.trigger_output_patch7
+
+        if trigger is None:
+
+            columns['n_triggered_patches'].append(-1)
+
+        else:
+
+            # patches triggered in at least one sample
+            trigger = np.asarray(trigger).reshape(len(trigger), -1)
+            columns['n_triggered_patches'].append(
+                np.count_nonzero(trigger.any(axis=-1)))
+
+    return {name: np.array(values, dtype=CATALOG_COLUMNS[name])
+            for name, values in columns.items()}
+
+
+def save_catalog(path, files, columns):
+    """Write the catalog to an HDF5 file
+
+    Parameters
+    ----------
+    path: str
+    files: list of str
+        paths of the run files, `columns['file']` indexes this list
+    columns: dict of 1D arrays, c.f. `catalog_from_events()`
+    """
+
+    with h5py.File(path, 'w') as f:
+
+        f.attrs['files'] = np.array([os.fsencode(file) for file in files])
+        group = f.create_group('events')
+
+        for name in CATALOG_COLUMNS:
+
+            group.create_dataset(name, data=columns[name],
+                                 compression='gzip', shuffle=True)
+
+
+def load_catalog(path):
+    """Read a catalog written by `save_catalog()`
+
+    Returns
+    -------
+    files: list of str
+    columns: dict of 1D arrays
+    """
+
+    with h5py.File(path, 'r') as f:
+
+        files = [os.fsdecode(file) for file in f.attrs['files']]
+        columns = {name: f['events'][name][()] for name in CATALOG_COLUMNS}
+
+    return files, columns
+
+
+def select_rows(files, columns, selection=None):
+    """Rows of each file satisfying `selection`
+
+    Parameters
+    ----------
+    files: list of str
+    columns: dict of 1D arrays
+    selection: function-like or None
+        predicate evaluated on the columns and returning a boolean mask,
+        e.g. `lambda c: c['camera_event_type'] == 8`.
+        If None, all the events are selected.
+
+    Returns
+    -------
+    OrderedDict mapping the path of the files to the sorted array of the
+    selected rows, files without selected events are left out
+    """
+
+    if selection is None:
+
+        mask = np.ones(len(columns['row']), dtype=bool)
+
+    else:
+
+        mask = np.asarray(selection(columns), dtype=bool)
+
+    rows = OrderedDict()
+
+    for file_id, file in enumerate(files):
+
+        selected = mask & (columns['file'] == file_id)
+
+        if selected.any():
+
+            rows[file] = np.sort(columns['row'][selected])
+
+    return rows
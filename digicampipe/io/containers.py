@@ -166,6 +166,8 @@ class R0CameraContainer(Container):
     trigger_input_7 = Field(ndarray, 'trigger input CLUSTER7')
     trigger_input_19 = Field(ndarray, 'trigger input CLUSTER19')
     num_samples = Field(int, "number of time samples for telescope")
+    pixel_id = Field(ndarray, 'ids of the pixels in adc_samples when only a '
+                              'subset of the pixels is read, else None')
 
 
 class R0Container(Container):
@@ -34,6 +34,9 @@ class CalibrationEventContainer(Container):
 
     reconstructed_time = Field(ndarray, 'reconstructed time '
                                         'for each adc sample')
+    pulses = Field(ndarray, 'sparse table of the reconstructed pulses, '
+                            'c.f. digicampipe.calib.camera.charge.'
+                            'PULSE_DTYPE')
 
     def plot(self, pixel_id):
 
@@ -41,10 +44,21 @@ class CalibrationEventContainer(Container):
         plt.title('pixel : {}'.format(pixel_id))
         plt.plot(self.adc_samples[pixel_id], label='raw')
         plt.plot(self.pulse_mask[pixel_id], label='peak position')
-        plt.plot(self.reconstructed_charge[pixel_id], label='charge',
-                 linestyle='None', marker='o')
-        plt.plot(self.reconstructed_amplitude[pixel_id], label='amplitude',
-                 linestyle='None', marker='o')
+
+        if self.reconstructed_charge is None and self.pulses is not None:
+
+            pulses = self.pulses[self.pulses['pixel'] == pixel_id]
+            plt.plot(pulses['sample'], pulses['charge'], label='charge',
+                     linestyle='None', marker='o')
+            plt.plot(pulses['sample'], pulses['amplitude'],
+                     label='amplitude', linestyle='None', marker='o')
+
+        else:
+
+            plt.plot(self.reconstructed_charge[pixel_id], label='charge',
+                     linestyle='None', marker='o')
+            plt.plot(self.reconstructed_amplitude[pixel_id],
+                     label='amplitude', linestyle='None', marker='o')
         plt.legend()
 
 
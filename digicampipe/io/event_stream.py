@@ -1,12 +1,35 @@
 from digicampipe.io import zfits, hdf5, hessio_digicam
-from .auxservice import AuxService
-from collections import namedtuple
+from digicampipe.io.catalog import load_catalog, select_rows
+from .auxservice import AuxService, SlowDataCache
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
+from itertools import chain
+from multiprocessing import Manager, Pool
+import heapq
+import os
+from digicampipe.io.containers import DataContainer
 from digicampipe.io.containers_calib import CalibrationContainer
+from digicampipe.io.pixels import pixel_index
 from tqdm import tqdm
 import numpy as np
 
 
-def event_stream(filelist, source=None, max_events=None, **kwargs):
+R0_BATCH_FIELDS = [
+    'adc_samples',
+    'digicam_baseline',
+    'baseline',
+    'standard_deviation',
+    'camera_event_number',
+    'local_camera_clock',
+    'gps_time',
+    'camera_event_type',
+    'array_event_type',
+]
+
+
+def event_stream(filelist, source=None, max_events=None, batch_size=None,
+                 n_workers=None, pipeline=None, catalog=None, selection=None,
+                 **kwargs):
     '''Iterable of events in the form of `DataContainer`.
 
     Parameters
@@ -19,10 +42,52 @@ def event_stream(filelist, source=None, max_events=None, **kwargs):
             * digicampipe.io.zfits.zfits_event_source
             * digicampipe.io.hdf5.digicamtoy_event_source
             * digicampipe.io.hessio_digicam.hessio_event_source
+    batch_size: int or None
+        If given, the events are grouped in blocks of `batch_size` events,
+        c.f. `batch_events()`
+    n_workers: int or None
+        If given, the files are processed in parallel by `n_workers`
+        processes, c.f. `parallel_event_stream()`
+    pipeline: function-like or None
+        per-file pipeline run by the workers when `n_workers` is given
+    catalog: str or None
+        path to a catalog of the event headers written by `digicam-catalog`.
+        If given, only the events selected by `selection` are yielded,
+        c.f. `catalog_event_stream()`
+    selection: function-like or None
+        predicate evaluated on the columns of the catalog
     kwargs: parameters for event_source
         Some event_sources need special parameters to work, c.f. their doc.
     '''
 
+    if n_workers is not None:
+
+        yield from parallel_event_stream(filelist, pipeline=pipeline,
+                                         n_workers=n_workers, source=source,
+                                         max_events=max_events,
+                                         batch_size=batch_size, **kwargs)
+        return
+
+    if catalog is not None:
+
+        events = catalog_event_stream(catalog, filelist=filelist,
+                                      selection=selection, source=source,
+                                      max_events=max_events, **kwargs)
+
+        if batch_size is not None:
+
+            events = batch_events(events, batch_size=batch_size)
+
+        yield from events
+        return
+
+    if batch_size is not None:
+
+        events = event_stream(filelist, source=source, max_events=max_events,
+                              **kwargs)
+        yield from batch_events(events, batch_size=batch_size)
+        return
+
     # If the caller gives us a path and not a list of paths,
     # we convert it to a list.
     # This is not clean but convenient.
@@ -50,30 +115,413 @@ def event_stream(filelist, source=None, max_events=None, **kwargs):
         for event in data_stream:
 
             if count >= max_events:
-                raise StopIteration
+                return
+
+            count += 1
+            yield event
+
+
+def catalog_event_stream(catalog, filelist=None, selection=None, source=None,
+                         max_events=None, **kwargs):
+    '''Events selected from the catalog of their headers.
+
+    The `selection` predicate is evaluated on the columns of the catalog
+    (c.f. `digicampipe.io.catalog`), e.g.
+    `lambda c: c['camera_event_type'] == 8`, without reading the events.
+    The sources cannot seek, so this is a filter after decoding: the events
+    of a file are still decoded up to its last selected row, and the rows
+    not selected are dropped. The reading is saved only for the files
+    without any selected event (they are not opened) and for the events
+    after the last selected row of a file. For zfits files the rows are
+    read with `ZFitsReader`, which does not copy the rows not selected into
+    the container.
+    `r0.event_id` is the row of the event in its file, as with
+    `event_stream()`.
+
+    Parameters
+    ----------
+    catalog : str
+        path to the catalog written by `digicam-catalog`
+    filelist : list-like of paths, a single path(string) or None
+        If given, only the events of these files are read. Otherwise the
+        files listed in the catalog are used.
+    selection : function-like or None
+        predicate returning a boolean mask, if None all events are selected
+    source : function-like or None, c.f. `event_stream()`
+    max_events : int or None
+        maximum number of events to read
+    kwargs: parameters for event_source
+    '''
+
+    files, columns = load_catalog(catalog)
+    rows = select_rows(files, columns, selection=selection)
+
+    if filelist is not None:
+
+        if isinstance(filelist, (str, bytes)):
+            filelist = [filelist]
+
+        paths = {os.path.abspath(file) for file in filelist}
+        rows = OrderedDict(
+            (file, file_rows) for file, file_rows in rows.items()
+            if os.path.abspath(file) in paths
+        )
+
+    if max_events is None:
+
+        max_events = np.inf
+
+    count = 0
+
+    for file, file_rows in rows.items():
+
+        file_source = source
+
+        if file_source is None:
+            file_source = guess_source_from_path(file)
+
+        if file_source is zfits.zfits_event_source:
+
+            reader = zfits.ZFitsReader(
+                file,
+                camera=kwargs.get('camera'),
+                camera_geometry=kwargs.get('camera_geometry'),
+                pixel_id=kwargs.get('pixel_id'),
+            )
+            events = reader.iter_rows(file_rows)
+
+        else:
+
+            events = _select_rows(file_source(url=file, **kwargs), file_rows)
+
+        for event in events:
+
+            if count >= max_events:
+                return
 
             count += 1
             yield event
 
 
+def _select_rows(events, rows):
+
+    rows = iter(rows)
+    next_row = next(rows, None)
+
+    for row, event in enumerate(events):
+
+        if next_row is None:
+            return
+
+        if row == next_row:
+
+            next_row = next(rows, None)
+            yield event
+
+
+def parallel_event_stream(filelist, pipeline=None, n_workers=None,
+                          source=None, max_events=None, sort_key=None,
+                          chunk_size=100, n_chunks=2, **kwargs):
+    '''Process the files of `filelist` in a pool of processes.
+
+    Each worker opens one file with `event_stream()` and runs
+    `pipeline(events)` on it, e.g. the r1 -> dl1 -> dl2 chain of
+    `pipeline_crab.py`. The results are streamed back to the parent process
+    in chunks of `chunk_size` results, file by file in the order of
+    `filelist`, or merged across files by `sort_key` (e.g. the event id) if
+    given.
+
+    Every worker holds at most `n_chunks` chunks waiting to be read, it
+    pauses until the parent process has read them. The memory used is
+    therefore bounded by about `n_workers * (n_chunks + 1) * chunk_size`
+    results, whether `pipeline` reduces the events or not. Once
+    `max_events` results are yielded (or the stream is closed) the workers
+    are stopped, even in the middle of a file.
+
+    The state of the stages (e.g. the baseline of `fill_baseline_r0`) does
+    not carry over from one file to the next.
+    Every object yielded by `pipeline` is copied and sent back to the parent
+    process, so the pipeline should preferably yield small objects
+    (e.g. dl2 parameters) or filter the events.
+
+    Parameters
+    ----------
+    filelist : list-like of paths, or a single path(string).
+    pipeline : function-like or None
+        function taking an event stream and returning an iterable.
+        It must be picklable, i.e. defined at the module level or a
+        `functools.partial` of such a function.
+        If None, the events themselves are returned.
+    n_workers : int or None
+        number of processes, if None `os.cpu_count()` is used
+    source : function-like or None, c.f. `event_stream()`
+    max_events : int or None
+        maximum number of results to yield
+    sort_key : function-like or None
+        If None, the results are ordered by file. Otherwise the results of
+        all the files are merged according to `sort_key(result)`, this
+        requires the results of each file to be sorted by `sort_key`. The
+        merge reads all the files at once, so there must be at most
+        `n_workers` files (a ValueError is raised otherwise).
+    chunk_size : int
+        number of results sent back at once
+    n_chunks : int
+        number of chunks a worker can send ahead of the parent process
+    kwargs: parameters for event_stream() and the event_source
+    '''
+
+    if isinstance(filelist, (str, bytes)):
+        filelist = [filelist]
+
+    if max_events is None:
+
+        max_events = np.inf
+
+    if n_workers is None:
+
+        n_workers = os.cpu_count()
+
+    if sort_key is not None and len(filelist) > n_workers:
+
+        # a file waiting for a free process would block the merge
+        raise ValueError('Merging {} files by sort_key needs as many '
+                         'workers, got n_workers={}'
+                         ''.format(len(filelist), n_workers))
+
+    # the pool is terminated before the manager, this stops the workers
+    # waiting for their chunks to be read
+    with Manager() as manager, Pool(n_workers) as pool:
+
+        results = []
+
+        for file in filelist:
+
+            queue = manager.Queue(maxsize=n_chunks)
+            # the tasks are started in the order of filelist, hence the
+            # file being read is always running or done
+            pool.apply_async(_process_file,
+                             (file, queue, pipeline, source, chunk_size,
+                              kwargs))
+            results.append(_read_chunks(queue))
+
+        if sort_key is None:
+
+            results = chain.from_iterable(results)
+
+        else:
+
+            results = heapq.merge(*results, key=sort_key)
+
+        for count, result in enumerate(results):
+
+            if count >= max_events:
+                return
+
+            yield result
+
+
+def _process_file(file, queue, pipeline, source, chunk_size, kwargs):
+
+    try:
+
+        events = event_stream(file, source=source, **kwargs)
+
+        if pipeline is not None:
+
+            events = pipeline(events)
+
+        chunk = []
+
+        for result in events:
+
+            # The event sources re-use the same container for every event
+            chunk.append(deepcopy(result))
+
+            if len(chunk) == chunk_size:
+
+                queue.put(chunk)
+                chunk = []
+
+        if chunk:
+
+            queue.put(chunk)
+
+    except Exception as exception:
+
+        queue.put(exception)
+
+        return
+
+    queue.put(None)
+
+
+def _read_chunks(queue):
+
+    while True:
+
+        chunk = queue.get()
+
+        if chunk is None:
+            return
+
+        if isinstance(chunk, Exception):
+            raise chunk
+
+        yield from chunk
+
+
+def batch_events(events, batch_size):
+    '''Group a stream of events into blocks of `batch_size` events.
+
+    The r0 fields listed in `R0_BATCH_FIELDS` are copied into contiguous
+    arrays with a leading event axis, e.g. `adc_samples` becomes
+    (n_events, n_pixels, n_samples) and `local_camera_clock` (n_events, ).
+    `r0.event_id` becomes the array of the event ids of the block.
+    The last block can be shorter than `batch_size`.
+
+    The stages in `digicampipe.calib.camera` (r0, r1, dl1) work on these
+    blocks. Filters deciding on single events (e.g. `filter_event_types`)
+    have to be applied before batching.
+
+    Parameters
+    ----------
+    events: iterable of `DataContainer`
+    batch_size: int
+        number of events per block
+    '''
+
+    batch = DataContainer()
+    index_in_batch = 0
+
+    for event in events:
+
+        if index_in_batch == 0:
+
+            event_ids = np.zeros(batch_size, dtype=int)
+            buffers = {}
+            batch.inst = event.inst
+            batch.r0.tels_with_data = event.r0.tels_with_data
+
+            for tel_id in event.r0.tels_with_data:
+
+                r0_camera = event.r0.tel[tel_id]
+                batch.r0.tel[tel_id].pixel_id = r0_camera.pixel_id
+                buffers[tel_id] = {}
+
+                for field in R0_BATCH_FIELDS:
+
+                    value = r0_camera[field]
+
+                    if value is None:
+                        continue
+
+                    value = np.asarray(value)
+                    buffers[tel_id][field] = np.zeros(
+                        (batch_size, ) + value.shape,
+                        dtype=value.dtype
+                    )
+
+        event_ids[index_in_batch] = event.r0.event_id
+
+        for tel_id, fields in buffers.items():
+
+            r0_camera = event.r0.tel[tel_id]
+
+            for field, buffer in fields.items():
+
+                buffer[index_in_batch] = r0_camera[field]
+
+        index_in_batch += 1
+
+        if index_in_batch == batch_size:
+
+            yield _fill_batch(batch, event_ids, buffers, index_in_batch)
+            index_in_batch = 0
+
+    if index_in_batch > 0:
+
+        yield _fill_batch(batch, event_ids, buffers, index_in_batch)
+
+
+def _fill_batch(batch, event_ids, buffers, n_events):
+
+    batch.r0.event_id = event_ids[:n_events]
+
+    for tel_id, fields in buffers.items():
+
+        r0_camera = batch.r0.tel[tel_id]
+
+        for field, buffer in fields.items():
+
+            r0_camera[field] = buffer[:n_events]
+
+    return batch
+
+
 def calibration_event_stream(path,
-                             pixel_id=[...],
-                             max_events=None):
+                             pixel_id=None,
+                             max_events=None,
+                             batch_size=None):
     """
     Event stream for the calibration of the camera based on the observation
     event_stream()
+
+    If `batch_size` is given, `container.data.adc_samples` is of shape
+    (n_events, n_pixels, n_samples) and `container.data.digicam_baseline` of
+    shape (n_events, n_pixels). The calibration stages operate on the last
+    axis and therefore work on such blocks as well.
+
+    The pixels of `pixel_id` (None for all the pixels) are selected by the
+    event sources (c.f. `PIXEL_SELECTION_SOURCES`) so that only these pixels
+    are read or copied. Contiguous selections, e.g. a single pixel or
+    `np.arange(1296)`, are views of the decoded event.
     """
 
     container = CalibrationContainer()
-    for event in event_stream(path, max_events=max_events):
+    kwargs = {}
+    first_file = path if isinstance(path, (str, bytes)) else path[0]
+
+    if guess_source_from_path(first_file) in PIXEL_SELECTION_SOURCES:
+
+        kwargs['pixel_id'] = pixel_id
+
+    for event in event_stream(path, max_events=max_events,
+                              batch_size=batch_size, **kwargs):
         r0_event = list(event.r0.tel.values())[0]
-        container.pixel_id = np.arange(r0_event.adc_samples.shape[0])[pixel_id]
-        container.data.adc_samples = r0_event.adc_samples[pixel_id]
-        container.data.digicam_baseline = r0_event.digicam_baseline[pixel_id]
+        adc_samples = r0_event.adc_samples
+        digicam_baseline = r0_event.digicam_baseline
+        n_pixels = event.inst.num_pixels[event.r0.tels_with_data[0]]
+
+        if r0_event.pixel_id is not None:
+
+            container.pixel_id = r0_event.pixel_id
+
+        else:
+
+            index, selected_pixels = pixel_index(pixel_id, n_pixels)
+
+            if index is not None:
+
+                adc_samples = adc_samples[..., index, :]
+                digicam_baseline = digicam_baseline[..., index]
+
+            container.pixel_id = np.arange(n_pixels) \
+                if selected_pixels is None else selected_pixels
+
+        container.data.adc_samples = adc_samples
+        container.data.digicam_baseline = digicam_baseline
 
         yield container
 
 
+# sources reading only the pixels given in `pixel_id`
+PIXEL_SELECTION_SOURCES = [
+    zfits.zfits_event_source,
+    hdf5.digicamtoy_event_source,
+    hessio_digicam.hessio_event_source,
+]
+
+
 def guess_source_from_path(path):
     if path.endswith('.fits.fz'):
         return zfits.zfits_event_source
@@ -92,10 +540,22 @@ def add_slow_data(
         'SafetyPLC',
         'DriveSystem',
     ],
-    basepath=None
+    basepath=None,
+    mode='previous',
+    cache_dir=None,
 ):
+    """Attach the slow control data at the time of the events to
+    `event.slow_data`.
+
+    For blocks of events (c.f. `batch_events()`) the fields of the slow
+    data are arrays with one entry per event.
+    `mode` is the interpolation mode, c.f. `AuxService.at_many()`
+    If `cache_dir` is given, the slow data of the nights are cached there,
+    c.f. `SlowDataCache`
+    """
+    cache = None if cache_dir is None else SlowDataCache(cache_dir=cache_dir)
     services = {
-        name: AuxService(name, basepath)
+        name: AuxService(name, basepath, cache=cache)
         for name in aux_services
     }
 
@@ -103,7 +563,7 @@ def add_slow_data(
 
     for event_id, event in enumerate(data_stream):
         event.slow_data = SlowDataContainer(**{
-            name: service.at(event.r0.tel[1].local_camera_clock)
+            name: service.at(event.r0.tel[1].local_camera_clock, mode=mode)
             for (name, service) in services.items()
         })
 
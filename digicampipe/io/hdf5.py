@@ -1,5 +1,7 @@
 from digicampipe.io.containers import DataContainer
 import digicampipe.utils as utils
+from digicampipe.io.buffer import BufferPool
+from digicampipe.io.pixels import pixel_index
 import h5py
 import numpy as np
 
@@ -10,7 +12,10 @@ def digicamtoy_event_source(
     url,
     camera=utils.DigiCam,
     max_events=None,
-    chunk_size=150,
+    chunk_size=None,
+    n_buffers=None,
+    pixel_id=None,
+    batch_size=None,
 ):
     """A generator that streams data from an HDF5 data file from DigicamToy
     Parameters
@@ -20,6 +25,23 @@ def digicamtoy_event_source(
     max_events : int, optional
         maximum number of events to read
     camera : utils.Camera() default: utils.DigiCam
+    chunk_size : int or None
+        number of events read at once. It is rounded up to a multiple of
+        the HDF5 chunk of the dataset, if None a single HDF5 chunk (or 150
+        events for contiguous datasets) is read at once.
+    n_buffers : int or None
+        if given, the adc samples of each event are copied in a ring of
+        `n_buffers` preallocated arrays (c.f. `BufferPool`), so that they
+        remain valid for the `n_buffers - 1` following events.
+        Otherwise they are views of the chunk currently read.
+    pixel_id : list-like, slice or None
+        if given only these pixels are read from the file and
+        `r0.tel[tel_id].pixel_id` holds their ids
+    batch_size : int or None
+        if given, blocks of `batch_size` events are read and yielded at
+        once, as with `event_stream.batch_events()`: `adc_samples` is of
+        shape (n_events, n_pixels, n_samples) and `r0.event_id`,
+        `camera_event_number` and `gps_time` are arrays
     """
 
     data = DataContainer()
@@ -33,40 +55,134 @@ def digicamtoy_event_source(
         max_events = n_events
 
     max_events = min(max_events, n_events)
+    chunk_size = _aligned_chunk_size(full_data_set, chunk_size)
+    pixel_slice, pixel_order, pixel_id = _pixel_selection(pixel_id, n_pixels)
+    n_pixels_read = n_pixels if pixel_id is None else len(pixel_id)
+
+    # DigicamToy does not provide a baseline
+    baseline = np.ones(n_pixels_read) * np.nan
+    pool = None if n_buffers is None else BufferPool(n_buffers)
+
+    data.r0.tels_with_data = [1, ]
+
+    for tel_id in data.r0.tels_with_data:
+
+        data.inst.num_channels[tel_id] = 1
+        data.inst.num_pixels[tel_id] = n_pixels
+        data.inst.geom[tel_id] = camera.geometry
+        data.inst.cluster_matrix_7[tel_id] = camera.cluster_7_matrix
+        data.inst.cluster_matrix_19[tel_id] = camera.cluster_19_matrix
+        data.inst.patch_matrix[tel_id] = camera.patch_matrix
+        data.inst.num_samples[tel_id] = n_samples
+
+        r0 = data.r0.tel[tel_id]
+        r0.pixel_id = pixel_id
+        r0.local_camera_clock = None
+        r0.camera_event_type = None
+        r0.array_event_type = None
+
+    if batch_size is not None:
+
+        baseline = np.ones((batch_size, n_pixels_read)) * np.nan
+
+        for start in range(0, max_events, batch_size):
+
+            end = min(start + batch_size, max_events)
+            adc_count = _read(full_data_set, start, end, pixel_slice,
+                              pixel_order)
+            event_id = np.arange(start, end)
+            data.r0.event_id = event_id
+
+            for tel_id in data.r0.tels_with_data:
+
+                r0 = data.r0.tel[tel_id]
+                r0.camera_event_number = event_id
+                r0.gps_time = event_id
+                r0.adc_samples = adc_count
+                r0.digicam_baseline = baseline[:end - start]
+
+            yield data
+
+        return
 
     for event_id in range(max_events):
 
         data.r0.event_id = event_id
-        data.r0.tels_with_data = [1, ]
 
         for tel_id in data.r0.tels_with_data:
 
-            if event_id == 0:
-
-                data.inst.num_channels[tel_id] = 1
-                data.inst.num_pixels[tel_id] = n_pixels
-                data.inst.geom[tel_id] = camera.geometry
-                data.inst.cluster_matrix_7[tel_id] = camera.cluster_7_matrix
-                data.inst.cluster_matrix_19[tel_id] = camera.cluster_19_matrix
-                data.inst.patch_matrix[tel_id] = camera.patch_matrix
-                data.inst.num_samples[tel_id] = n_samples
-
             if (event_id % chunk_size) == 0:
 
                 index_in_chunk = 0
-                chunk_start = (event_id // chunk_size) * chunk_size
-                chunk_end = chunk_start + chunk_size
-                chunk_end = min(chunk_end, n_events)
-                adc_count = full_data_set[chunk_start:chunk_end]
+                chunk_end = min(event_id + chunk_size, n_events)
+                adc_count = _read(full_data_set, event_id, chunk_end,
+                                  pixel_slice, pixel_order)
 
             data.r0.tel[tel_id].camera_event_number = event_id
-            data.r0.tel[tel_id].local_camera_clock = None
             data.r0.tel[tel_id].gps_time = event_id
-            data.r0.tel[tel_id].camera_event_type = None
-            data.r0.tel[tel_id].array_event_type = None
-            data.r0.tel[tel_id].adc_samples = adc_count[index_in_chunk]
-            baseline = np.ones(data.r0.tel[tel_id].adc_samples.shape[:-1]) * np.nan
+            adc_samples = adc_count[index_in_chunk]
+
+            if pool is not None:
+
+                adc_samples = pool.copy(adc_samples)
+
+            data.r0.tel[tel_id].adc_samples = adc_samples
             data.r0.tel[tel_id].digicam_baseline = baseline
             index_in_chunk += 1
 
         yield data
+
+
+def _aligned_chunk_size(data_set, chunk_size=None):
+
+    if data_set.chunks is None:
+
+        return 150 if chunk_size is None else chunk_size
+
+    events_per_chunk = data_set.chunks[0]
+
+    if chunk_size is None:
+
+        return events_per_chunk
+
+    n_chunks = -(-chunk_size // events_per_chunk)
+
+    return n_chunks * events_per_chunk
+
+
+def _pixel_selection(pixel_id, n_pixels):
+    """
+    Convert `pixel_id` in an hyperslab selection of the pixel axis:
+    a slice, or an increasing list of pixels followed by the permutation
+    restoring the order of `pixel_id`.
+    """
+
+    index, pixel_id = pixel_index(pixel_id, n_pixels)
+
+    if index is None:
+
+        return slice(None), None, None
+
+    if isinstance(index, slice):
+
+        return index, None, pixel_id
+
+    pixels, order = np.unique(pixel_id, return_inverse=True)
+    pixel_slice = [int(pixel) for pixel in pixels]
+
+    if len(pixels) == len(pixel_id) and np.all(pixels == pixel_id):
+
+        order = None
+
+    return pixel_slice, order, pixel_id
+
+
+def _read(data_set, start, end, pixel_slice, pixel_order):
+
+    adc_count = data_set[start:end, pixel_slice]
+
+    if pixel_order is not None:
+
+        adc_count = adc_count[:, pixel_order]
+
+    return adc_count
@@ -14,6 +14,7 @@ import digicampipe.utils as utils
 import numpy as np
 
 from digicampipe.io.containers import DataContainer
+from digicampipe.io.pixels import pixel_index
 from ctapipe.core import Provenance
 from ctapipe.instrument import TelescopeDescription, SubarrayDescription
 
@@ -75,7 +76,7 @@ def hessio_get_list_event_ids(url, max_events=None):
 
 def hessio_event_source(url, camera_geometry, camera, max_events=None,
                         allowed_tels=None, requested_event=None,
-                        use_event_id=False):
+                        use_event_id=False, pixel_id=None):
     """A generator that streams data from an EventIO/HESSIO MC data file
     (e.g. a standard CTA data file.)
 
@@ -91,10 +92,15 @@ def hessio_event_source(url, camera_geometry, camera, max_events=None,
         would be 1 telescope per file (whereas in current monte-carlo,
         they are all interleaved into one file)
     requested_event : int
-        Seek to a paricular event index
+        Only yield the event of this index. eventio files cannot be seeked,
+        the earlier events are read (but not copied into the container) and
+        the file is closed once the event is yielded.
     use_event_id : bool
         If True ,'requested_event' now seeks for a particular event id instead
         of index
+    pixel_id : list-like or None
+        if given, adc_samples and adc_sums only hold these pixels and
+        `r0.tel[tel_id].pixel_id` their ids
     """
 
     with open_hessio(url) as pyhessio_file:
@@ -199,6 +205,15 @@ def hessio_event_source(url, camera_geometry, camera, max_events=None,
                         pyhessio_file.get_adc_sum(tel_id)[..., None]
                 data.r0.tel[tel_id].adc_sums = \
                     pyhessio_file.get_adc_sum(tel_id)
+
+                index, data.r0.tel[tel_id].pixel_id = pixel_index(
+                    pixel_id, data.inst.num_pixels[tel_id])
+
+                if index is not None:
+                    data.r0.tel[tel_id].adc_samples = \
+                        data.r0.tel[tel_id].adc_samples[index]
+                    data.r0.tel[tel_id].adc_sums = \
+                        data.r0.tel[tel_id].adc_sums[..., index]
                 data.mc.tel[tel_id].reference_pulse_shape = \
                     pyhessio_file.get_ref_shapes(tel_id)
 
@@ -226,6 +241,10 @@ def hessio_event_source(url, camera_geometry, camera, max_events=None,
             yield data
             counter += 1
 
+            if requested_event is not None:
+                pyhessio_file.close_file()
+                return
+
             if max_events and counter >= max_events:
                 pyhessio_file.close_file()
                 return
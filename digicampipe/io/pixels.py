@@ -0,0 +1,46 @@
+import numpy as np
+
+__all__ = ['pixel_index']
+
+
+def pixel_index(pixel_id, n_pixels):
+    """
+    Index selecting the pixels `pixel_id` along the pixel axis.
+
+    Evenly spaced increasing pixels (e.g. `np.arange(1296)` or `[4, 5, 6]`)
+    are converted to a slice, so that the selected arrays are views and not
+    copies.
+
+    Parameters
+    ----------
+    pixel_id : int, list-like of int, boolean mask, slice, [...] or None
+        a single pixel id keeps the pixel axis
+    n_pixels : int
+
+    Returns
+    -------
+    index : slice or ndarray of int, None if all the pixels are selected
+    pixel_id : ndarray of the selected pixel ids, None if all the pixels are
+        selected
+    """
+
+    if pixel_id is None or pixel_id is Ellipsis or \
+            (isinstance(pixel_id, list) and pixel_id == [...]):
+
+        return None, None
+
+    pixel_id = np.atleast_1d(np.arange(n_pixels)[pixel_id])
+
+    if len(pixel_id) == n_pixels and np.all(pixel_id == np.arange(n_pixels)):
+
+        return None, None
+
+    step = pixel_id[1] - pixel_id[0] if len(pixel_id) > 1 else 1
+
+    if len(pixel_id) and step > 0 and np.all(np.diff(pixel_id) == step):
+
+        index = slice(int(pixel_id[0]), int(pixel_id[-1]) + 1, int(step))
+
+        return index, pixel_id
+
+    return pixel_id, pixel_id
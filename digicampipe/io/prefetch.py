@@ -0,0 +1,179 @@
+"""
+Read-ahead of an iterable in a background thread.
+
+It is used by the event sources to overlap the decompression of the next
+events with the processing of the current one.
+"""
+from collections import deque
+import threading
+import numpy as np
+
+__all__ = ['Prefetcher', 'nbytes']
+
+
+def nbytes(item):
+    """Memory used by the numpy arrays of `item`
+
+    :param item: a numpy array or an object holding numpy arrays as attributes
+    :return: number of bytes
+    """
+    if isinstance(item, np.ndarray):
+
+        return item.nbytes
+
+    attributes = getattr(item, '__dict__', {})
+
+    return sum(value.nbytes for value in attributes.values()
+               if isinstance(value, np.ndarray))
+
+
+class Prefetcher:
+    """Iterator reading ahead `iterable` in a producer thread.
+
+    The items are stored in a bounded queue holding at most `queue_size`
+    items and, if `max_bytes` is given, at most `max_bytes` bytes (one item
+    is always allowed, even if larger than `max_bytes`).
+
+    Counters:
+        n_items: number of items consumed
+        n_starved: number of times the consumer had to wait for the producer
+        n_blocked: number of times the producer had to wait for the consumer
+        max_queued_bytes: highest memory used by the queue
+
+    :param iterable: the iterable to read ahead
+    :param queue_size: maximum number of items read in advance
+    :param max_bytes: maximum memory of the items read in advance, or None
+    :param sizeof: function giving the memory used by an item
+    """
+
+    def __init__(self, iterable, queue_size=8, max_bytes=None, sizeof=nbytes):
+
+        if queue_size < 1:
+
+            raise ValueError('queue_size must be >= 1')
+
+        self.queue_size = queue_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.n_items = 0
+        self.n_starved = 0
+        self.n_blocked = 0
+        self.queued_bytes = 0
+        self.max_queued_bytes = 0
+
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._done = False
+        self._stopped = False
+        self._error = None
+        self._thread = threading.Thread(target=self._produce,
+                                        args=(iter(iterable), ),
+                                        daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self):
+
+        with self._condition:
+
+            if not self._items and not self._done:
+
+                self.n_starved += 1
+
+            while not self._items and not self._done:
+
+                self._condition.wait()
+
+            if self._items:
+
+                item, size = self._items.popleft()
+                self.queued_bytes -= size
+                self.n_items += 1
+                self._condition.notify_all()
+
+                return item
+
+            if self._error is not None:
+
+                error, self._error = self._error, None
+                raise error
+
+            raise StopIteration
+
+    def close(self):
+        """Stop the producer thread and drop the items read in advance"""
+
+        with self._condition:
+
+            self._stopped = True
+            self._items.clear()
+            self.queued_bytes = 0
+            self._condition.notify_all()
+
+    def stats(self):
+
+        return {
+            'n_items': self.n_items,
+            'n_starved': self.n_starved,
+            'n_blocked': self.n_blocked,
+            'max_queued_bytes': self.max_queued_bytes,
+        }
+
+    def _is_full(self, size):
+
+        if not self._items:
+
+            return False
+
+        if len(self._items) >= self.queue_size:
+
+            return True
+
+        if self.max_bytes is not None:
+
+            return self.queued_bytes + size > self.max_bytes
+
+        return False
+
+    def _produce(self, iterator):
+
+        try:
+
+            for item in iterator:
+
+                size = self.sizeof(item)
+
+                with self._condition:
+
+                    if self._is_full(size) and not self._stopped:
+
+                        self.n_blocked += 1
+
+                    while self._is_full(size) and not self._stopped:
+
+                        self._condition.wait()
+
+                    if self._stopped:
+
+                        return
+
+                    self._items.append((item, size))
+                    self.queued_bytes += size
+                    self.max_queued_bytes = max(self.max_queued_bytes,
+                                                self.queued_bytes)
+                    self._condition.notify_all()
+
+        except Exception as exception:
+
+            self._error = exception
+
+        finally:
+
+            with self._condition:
+
+                self._done = True
+                self._condition.notify_all()
@@ -4,15 +4,19 @@ Components to read ZFITS data.
 This requires the protozfits python library to be installed
 """
 import logging
+import os
 import warnings
+import numpy as np
 from tqdm import tqdm
 from digicampipe.io.containers import DataContainer
 import digicampipe.utils as utils
+from digicampipe.io.pixels import pixel_index
+from digicampipe.io.prefetch import Prefetcher
 from protozfits.digicam import File
 logger = logging.getLogger(__name__)
 
 
-__all__ = ['zfits_event_source']
+__all__ = ['zfits_event_source', 'ZFitsReader']
 
 
 def zfits_event_source(
@@ -22,6 +26,9 @@ def zfits_event_source(
     max_events=None,
     allowed_tels=None,
     expert_mode=None,
+    prefetch=None,
+    prefetch_max_bytes=None,
+    pixel_id=None,
 ):
     """A generator that streams data from an ZFITs data file
     Parameters
@@ -38,7 +45,58 @@ def zfits_event_source(
     camera : utils.Camera() or None, for DigiCam
     expert_mode : deprecated
     camera_geometry: soon to be deprecated
+    prefetch : int or None
+        number of events decoded in advance by a background thread.
+        The `Prefetcher` and its counters are available in
+        `data.meta['prefetch']`
+    prefetch_max_bytes : int or None
+        maximum memory used by the events decoded in advance
+    pixel_id : list-like or None
+        if given, the pixel arrays (adc_samples, baseline, flags) only hold
+        these pixels and `r0.tel[tel_id].pixel_id` their ids. Contiguous
+        selections are views of the decoded event.
     """
+    data = DataContainer()
+    camera_info = _camera_info(camera, camera_geometry, expert_mode)
+    loaded_telescopes = []
+
+    event_stream = File(url)
+
+    if max_events is None:
+
+        n_events = event_stream.numrows
+    else:
+
+        n_events = max_events
+
+    if prefetch is not None:
+
+        event_stream = Prefetcher(event_stream, queue_size=prefetch,
+                                  max_bytes=prefetch_max_bytes)
+        data.meta['prefetch'] = event_stream
+
+    try:
+
+        for event_counter, event in tqdm(enumerate(event_stream),
+                                         total=n_events, desc='Events',
+                                         leave=False):
+            if max_events is not None and event_counter > max_events:
+                break
+
+            _fill_container(data, event, event_counter, camera_info,
+                            loaded_telescopes, allowed_tels, pixel_id)
+
+            yield data
+
+    finally:
+
+        if prefetch is not None:
+
+            event_stream.close()
+
+
+def _camera_info(camera, camera_geometry, expert_mode=None):
+
     if camera is None:
         camera = utils.DigiCam
 
@@ -73,63 +131,249 @@ def zfits_event_source(
         patch_matrix = camera.patch_matrix
         cluster_7_matrix = camera.cluster_7_matrix
         cluster_19_matrix = camera.cluster_19_matrix
-    data = DataContainer()
 
-    loaded_telescopes = []
+    return {
+        'geometry': geometry,
+        'patch_matrix': patch_matrix,
+        'cluster_7_matrix': cluster_7_matrix,
+        'cluster_19_matrix': cluster_19_matrix,
+    }
 
-    event_stream = File(url)
 
-    if max_events is None:
+def _fill_container(data, event, event_id, camera_info, loaded_telescopes,
+                    allowed_tels=None, pixel_id=None):
 
-        n_events = event_stream.numrows
-    else:
+    data.r0.event_id = event_id
+    data.r0.tels_with_data = [event.telescope_id, ]
 
-        n_events = max_events
+    # remove forbidden telescopes
+    if allowed_tels:
+        data.r0.tels_with_data = [
+            list(filter(lambda x: x in data.r0.tels_with_data, sublist))
+            for sublist in allowed_tels
+        ]
+
+    for tel_id in data.r0.tels_with_data:
+
+        if tel_id not in loaded_telescopes:
+            data.inst.num_channels[tel_id] = event.num_channels
+            data.inst.num_pixels[tel_id] = event.n_pixels
+            data.inst.geom[tel_id] = camera_info['geometry']
+            data.inst.cluster_matrix_7[tel_id] = \
+                camera_info['cluster_7_matrix']
+            data.inst.cluster_matrix_19[tel_id] = \
+                camera_info['cluster_19_matrix']
+            data.inst.patch_matrix[tel_id] = camera_info['patch_matrix']
+            data.inst.num_samples[tel_id] = event.num_samples
+            loaded_telescopes.append(tel_id)
+
+        r0 = data.r0.tel[tel_id]
+        index, r0.pixel_id = pixel_index(pixel_id, event.n_pixels)
+        index = slice(None) if index is None else index
+
+        r0.camera_event_number = event.event_number
+        r0.pixel_flags = event.pixel_flags[index]
+        r0.local_camera_clock = event.local_time
+        r0.gps_time = event.central_event_gps_time
+        r0.camera_event_type = event.camera_event_type
+        r0.array_event_type = event.array_event_type
+        r0.adc_samples = event.adc_samples[index]
+
+        r0.trigger_input_traces = event.trigger_input_traces
+        r0.trigger_output_patch7 = event.trigger_output_patch7
+        r0.trigger_output_patch19 = event.trigger_output_patch19
+        r0.digicam_baseline = event.baseline[index]
+
+
+class ZFitsReader:
+    """Access by row or by event number to the events of a ZFITs data file
+
+        reader = ZFitsReader(url)
+        len(reader)
+        event = reader[10]
+        event = reader.get(event_number=1234)
+        for event in reader[10:20]:
+            ...
+        for event in reader.iter_rows([3, 7, 200]):
+            ...
+
+    As for `zfits_event_source`, the same `DataContainer` is filled and
+    returned for every event.
+
+    This is not random access: protozfits.digicam only reads a file
+    sequentially and decodes every event it reads, so reaching row N
+    decodes all the rows before it. The reader keeps the file open after
+    the last event read, hence rows requested in increasing order cost a
+    single pass over the file (the events skipped are decoded but not
+    copied into the container). Going backward re-opens the file and reads
+    it again from the start.
+    Note that protozfits reads one file at a time per process, so no other
+    zfits file should be read while the reader is in use.
+
+    The index of the file (camera event number, local clock and event type
+    of each row) maps event numbers to rows without reading the events. It
+    is built by a single pass over the file and cached next to it in
+    `url + '.index.npz'` (or in `index_path`).
+
+    Parameters
+    ----------
+    url : str
+        path to file to open
+    camera : utils.Camera() or None, for DigiCam
+    camera_geometry: soon to be deprecated
+    index_path : str or None
+        path of the index cache file, if False the index is not cached
+    pixel_id : list-like or None
+        pixels to select, c.f. `zfits_event_source`
+    """
+
+    def __init__(self, url, camera=None, camera_geometry=None,
+                 index_path=None, pixel_id=None):
+
+        self.url = url
+        self.pixel_id = pixel_id
+        self.index_path = url + '.index.npz' if index_path is None \
+            else index_path
+        self.data = DataContainer()
+        self._camera_info = _camera_info(camera, camera_geometry)
+        self._loaded_telescopes = []
+        self._index = None
+        self._open()
+
+    def __len__(self):
+
+        return self.n_events
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+
+            return self.iter_rows(range(*item.indices(self.n_events)))
+
+        row = int(item)
+
+        if row < 0:
+
+            row += self.n_events
+
+        if not 0 <= row < self.n_events:
+
+            raise IndexError('Row {} out of range for {} events'
+                             ''.format(item, self.n_events))
+
+        return self._read(row)
+
+    def get(self, event_number):
+        """Event with the given camera event number"""
+
+        return self[self.row_of(event_number)]
+
+    def row_of(self, event_number):
+        """Row of the event with the given camera event number"""
+
+        event_numbers = self.index['camera_event_number']
+        rows = np.flatnonzero(event_numbers == event_number)
+
+        if not len(rows):
+
+            raise KeyError('No event number {} in {}'
+                           ''.format(event_number, self.url))
+
+        return rows[0]
+
+    def iter_rows(self, rows):
+        """
+        Iterate over the events of the given rows, in the order given. Sort
+        the rows to read them in a single pass.
+        """
+
+        for row in rows:
+
+            yield self[row]
+
+    @property
+    def index(self):
+        """dict of the header columns of every row of the file"""
+
+        if self._index is None:
+
+            self._index = self._load_index()
+
+        return self._index
+
+    def _open(self):
+
+        self._file = File(self.url)
+        self.n_events = self._file.numrows
+        self._position = 0
+
+    def _next(self):
+
+        event = next(self._file)
+        self._position += 1
+
+        return event
+
+    def _read(self, row):
+
+        if row < self._position:
+
+            self._open()
+
+        while self._position < row:
+
+            self._next()
+
+        event = self._next()
+        _fill_container(self.data, event, row, self._camera_info,
+                        self._loaded_telescopes, pixel_id=self.pixel_id)
+
+        return self.data
+
+    def _load_index(self):
+
+        stat = os.stat(self.url)
+
+        if self.index_path and os.path.exists(self.index_path):
+
+            index = np.load(self.index_path)
+            index = {key: index[key] for key in index.files}
+
+            if index['file_size'] == stat.st_size and \
+                    index['file_mtime'] == stat.st_mtime:
+
+                return index
+
+        self._open()
+        index = {
+            'camera_event_number': np.zeros(self.n_events, dtype=np.int64),
+            'local_camera_clock': np.zeros(self.n_events, dtype=np.int64),
+            'camera_event_type': np.zeros(self.n_events, dtype=np.int64),
+        }
+
+        for row in range(self.n_events):
+
+            event = self._next()
+            index['camera_event_number'][row] = event.event_number
+            index['local_camera_clock'][row] = event.local_time
+            index['camera_event_type'][row] = event.camera_event_type
+
+        index['file_size'] = np.array(stat.st_size)
+        index['file_mtime'] = np.array(stat.st_mtime)
+
+        if self.index_path:
+
+            try:
+
+                np.savez(self.index_path, **index)
+
+            except OSError as exception:
+
+                logger.warning('Could not cache the index of {} in {}: {}'
+                               ''.format(self.url, self.index_path,
+                                         exception))
 
-    for event_counter, event in tqdm(enumerate(event_stream), total=n_events,
-                                     desc='Events', leave=False):
-        if max_events is not None and event_counter > max_events:
-            break
-
-        data.r0.event_id = event_counter
-        data.r0.tels_with_data = [event.telescope_id, ]
-
-        # remove forbidden telescopes
-        if allowed_tels:
-            data.r0.tels_with_data = [
-                list(filter(lambda x: x in data.r0.tels_with_data, sublist))
-                for sublist in allowed_tels
-            ]
-
-        for tel_id in data.r0.tels_with_data:
-
-            if tel_id not in loaded_telescopes:
-                data.inst.num_channels[tel_id] = event.num_channels
-                data.inst.num_pixels[tel_id] = event.n_pixels
-                data.inst.geom[tel_id] = geometry
-                data.inst.cluster_matrix_7[tel_id] = cluster_7_matrix
-                data.inst.cluster_matrix_19[tel_id] = cluster_19_matrix
-                data.inst.patch_matrix[tel_id] = patch_matrix
-                data.inst.num_samples[tel_id] = event.num_samples
-                loaded_telescopes.append(tel_id)
-
-            r0 = data.r0.tel[tel_id]
-            r0.camera_event_number = event.event_number
-            r0.pixel_flags = event.pixel_flags
-            r0.local_camera_clock = event.local_time
-            r0.gps_time = event.central_event_gps_time
-            r0.camera_event_type = event.camera_event_type
-            r0.array_event_type = event.array_event_type
-            r0.adc_samples = event.adc_samples
-
-            r0.trigger_input_traces = event.trigger_input_traces
-            r0.trigger_output_patch7 = event.trigger_output_patch7
-            r0.trigger_output_patch19 = event.trigger_output_patch19
-            r0.digicam_baseline = event.baseline
-
-        yield data
-
-    return
+        return index
 
 
 def count_number_events(file_list):
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Store the per pixel results of digicam-spe and digicam-fmpe (npz files) in
+a calibration database
+
+The constants can then be read with
+`digicampipe.utils.calibration_store.CalibrationStore.get()` or given to
+the dl1 stage with `CalibrationConstants.from_store()`.
+
+Usage:
+  calibration_store.py [options] <DATABASE> <INPUT>...
+
+Options:
+  -h --help                 Show this screen.
+  --camera=NAME             Camera name [default: DigiCam]
+  --valid_from=DATE         Start of the validity, ISO date in UTC
+                            (e.g. 2018-05-01T20:00:00) or unix seconds
+  --valid_to=DATE           End of the validity, by default until the next
+                            constants
+'''
+from datetime import datetime, timezone
+from docopt import docopt
+
+from digicampipe.utils.calibration_store import CalibrationStore
+
+
+def convert_date(date):
+
+    if date is None:
+
+        return None
+
+    try:
+
+        return float(date)
+
+    except ValueError:
+
+        date = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+
+        return date.replace(tzinfo=timezone.utc)
+
+
+def entry():
+
+    args = docopt(__doc__)
+    valid_from = convert_date(args['--valid_from'])
+    valid_to = convert_date(args['--valid_to'])
+
+    if valid_from is None:
+
+        raise ValueError('--valid_from is required')
+
+    with CalibrationStore(args['<DATABASE>']) as store:
+
+        for filename in args['<INPUT>']:
+
+            stored = store.ingest(filename, args['--camera'],
+                                  valid_from=valid_from, valid_to=valid_to)
+
+            for name, n_values in stored.items():
+
+                print('{}: {} values of {}'.format(filename, n_values, name))
+
+
+if __name__ == '__main__':
+
+    entry()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Build the catalog of the event headers of a set of run files
+
+The catalog can then be given to `event_stream(catalog=, selection=)` to
+decode only the selected events.
+
+Usage:
+  catalog.py [options] [--] <INPUT>...
+
+Options:
+  -h --help                 Show this screen.
+  -o FILE --output=FILE     Output catalog file (HDF5)
+                            [default: ./catalog.hdf5]
+  --max_events=N            Maximum number of events per file
+'''
+import os
+from docopt import docopt
+import numpy as np
+from tqdm import tqdm
+
+from digicampipe.io.catalog import CATALOG_COLUMNS, catalog_from_events, \
+    save_catalog
+from digicampipe.io.event_stream import event_stream
+from digicampipe.utils.docopt import convert_max_events_args
+
+
+def compute(files, output, max_events=None):
+
+    files = [os.path.abspath(file) for file in files]
+    columns = {name: [] for name in CATALOG_COLUMNS}
+
+    for file_id, file in tqdm(enumerate(files), total=len(files),
+                              desc='Files'):
+
+        events = event_stream(file, max_events=max_events)
+        file_columns = catalog_from_events(events, file_id=file_id)
+
+        for name, values in file_columns.items():
+
+            columns[name].append(values)
+
+    columns = {name: np.concatenate(values)
+               for name, values in columns.items()}
+    save_catalog(output, files, columns)
+
+    return files, columns
+
+
+def entry():
+
+    args = docopt(__doc__)
+    files = args['<INPUT>']
+    output = args['--output']
+    max_events = convert_max_events_args(args['--max_events'])
+
+    if os.path.exists(output):
+
+        raise IOError('The file {} already exists \n'.format(output))
+
+    files, columns = compute(files, output, max_events=max_events)
+    print('{} events of {} files written to {}'.format(
+        len(columns['row']), len(files), output))
+
+
+if __name__ == '__main__':
+
+    entry()
@@ -23,8 +23,18 @@ Options:
   --n_samples=N               Number of samples per waveform
   --bin_width=N               Bin width (in LSB) of the histogram
                               [default: 1]
+  --batch_fit                 Fit all the pixels at once with a vectorised
+                              least squares instead of Minuit
+  --n_workers=N               Number of processes fitting the pixels (the
+                              fits are resumed from
+                              OUTPUT/fmpe_results.checkpoint) or computing
+                              the shards [default: 1]
+  --shards                    Compute a histogram per input file and sum
+                              them, the files already computed are skipped.
+                              --max_events then applies to each file.
 '''
 import os
+from functools import partial
 from docopt import docopt
 from tqdm import tqdm
 
@@ -33,17 +43,21 @@ import matplotlib.pyplot as plt
 from iminuit import Minuit, describe
 from probfit import Chi2Regression
 
-from histogram.histogram import Histogram1D
 from digicampipe.utils.docopt import convert_max_events_args, \
     convert_pixel_args
 from digicampipe.scripts import timing
 from digicampipe.scripts import mpe
 from digicampipe.utils.exception import PeakNotFound
-from digicampipe.utils.pdf import fmpe_pdf_10
+from digicampipe.utils.pdf import fmpe_pdf_10, fmpe_pdf_batch, \
+    fmpe_parameter_names
+from digicampipe.utils.least_squares import fit_least_squares
+from digicampipe.utils.pixel_fit import fit_pixels
+from digicampipe.utils.hist1d import load_histogram, HistogramFile, \
+    compute_sharded
 
 
-def compute_data_bounds(x, y, y_err, estimated_gain, n_peaks=10,
-                        params=None):
+def compute_data_mask(x, y, estimated_gain, n_peaks=10, params=None):
+    """Mask of the bins of the histogram used in the fit"""
 
     mask = (y > 0) * (x < n_peaks * estimated_gain)
 
@@ -70,6 +84,15 @@ def compute_data_bounds(x, y, y_err, estimated_gain, n_peaks=10,
 
         mask *= (x <= max_bin) * (x >= min_bin)
 
+    return mask
+
+
+def compute_data_bounds(x, y, y_err, estimated_gain, n_peaks=10,
+                        params=None):
+
+    mask = compute_data_mask(x, y, estimated_gain, n_peaks=n_peaks,
+                             params=params)
+
     x = x[mask]
     y = y[mask]
     y_err = y_err[mask]
@@ -222,6 +245,125 @@ def fit_fmpe(x, y, y_err, init_params, limit_params):
     return m
 
 
+def fit_fmpe_pixel(x, y, y_err, estimated_gain, n_pe_peaks, min_dist,
+                   pixel_id=None, debug=False):
+    """
+    FMPE fit of the charge histogram of one pixel, c.f.
+    `digicampipe.utils.pixel_fit`
+
+    :return: dict of the fitted parameters, their errors, chi_2 and ndf
+    """
+
+    x, y, y_err = compute_data_bounds(x, y, y_err, estimated_gain,
+                                      n_pe_peaks)
+
+    params_init = compute_init_fmpe(x, y, y_err, snr=3, min_dist=min_dist,
+                                    n_pe_peaks=n_pe_peaks, debug=debug)
+
+    x, y, y_err = compute_data_bounds(x, y, y_err, estimated_gain,
+                                      n_pe_peaks, params=params_init)
+
+    params_limit = compute_limit_fmpe(params_init)
+
+    m = fit_fmpe(x, y, y_err, params_init, params_limit)
+
+    if debug:
+
+        plot_fmpe_fit(x, y, y_err, m, pixel_id)
+        plt.show()
+        plt.close()
+
+    result = {}
+
+    for key in ['gain', 'sigma_e', 'sigma_s', 'baseline']:
+
+        result[key] = m.values[key]
+        result[key + '_error'] = m.errors[key]
+
+    result['chi_2'] = m.fval
+    result['ndf'] = len(x) - len(m.list_of_vary_param())
+
+    return result
+
+
+def fit_fmpe_batch(x, y, y_err, estimated_gain, n_pe_peaks, min_dist,
+                   pixel_id=None):
+    """
+    FMPE fit of all the pixels at once with `fit_least_squares()`, starting
+    from `compute_init_fmpe()` within the limits of `compute_limit_fmpe()`
+    as `fit_fmpe()`.
+
+    :param x: bin centers of the histograms
+    :param y: histograms of shape (n_pixels, n_bins)
+    :param y_err: errors of `y`
+    :return: dict of the arrays of the parameters (and their errors) given
+    by `fmpe_parameter_names()`, 'chi_2' and 'ndf'. NaN for the pixels that
+    could not be fitted.
+    """
+
+    n_pixels = len(y)
+    pixel_id = np.arange(n_pixels) if pixel_id is None else pixel_id
+    names = fmpe_parameter_names(n_pe_peaks)
+    bin_width = np.mean(np.diff(x))
+
+    params = np.full((n_pixels, len(names)), np.nan)
+    lower = np.full(params.shape, -np.inf)
+    upper = np.full(params.shape, np.inf)
+    fixed = np.zeros(params.shape, dtype=bool)
+    errors = np.full(y.shape, np.inf)
+
+    for i, pixel in enumerate(pixel_id):
+
+        try:
+
+            x_fit, y_fit, y_err_fit = compute_data_bounds(
+                x, y[i], y_err[i], estimated_gain, n_pe_peaks)
+            params_init = compute_init_fmpe(x_fit, y_fit, y_err_fit, snr=3,
+                                            min_dist=min_dist,
+                                            n_pe_peaks=n_pe_peaks)
+
+        except Exception as exception:
+
+            print('Could not fit FMPE in pixel {}'.format(pixel))
+            print(exception)
+
+            continue
+
+        mask = compute_data_mask(x, y[i], estimated_gain, n_pe_peaks,
+                                 params=params_init)
+        errors[i, mask] = y_err[i, mask]
+        params_limit = compute_limit_fmpe(params_init)
+
+        for j, name in enumerate(names):
+
+            if name not in params_init:
+
+                params[i, j] = 0
+                fixed[i, j] = True
+
+                continue
+
+            params[i, j] = params_init[name]
+            lower[i, j], upper[i, j] = params_limit['limit_' + name]
+
+    def pdf(x, params, jacobian=False):
+
+        return fmpe_pdf_batch(x, params, bin_width, jacobian=jacobian)
+
+    params, params_errors, chi_2, ndf = fit_least_squares(
+        pdf, x, y, errors, params, lower=lower, upper=upper, fixed=fixed)
+
+    results = {'chi_2': chi_2, 'ndf': ndf.astype(float)}
+    results['ndf'][np.isnan(chi_2)] = np.nan
+
+    for j, name in enumerate(names):
+
+        results[name] = params[:, j]
+        results[name + '_error'] = params_errors[:, j]
+
+    return results
+
+
 def plot_fmpe_fit(x, y, y_err, fitter, pixel_id=None):
 
     if pixel_id is None:
@@ -292,125 +434,107 @@ def entry():
     shift = int(args['--shift'])
     bin_width = int(args['--bin_width'])
     n_samples = int(args['--n_samples'])  # TODO access this in a better way
+    n_workers = int(args['--n_workers'])
 
-    n_pixels = len(pixel_id)
-
-    charge_histo_filename = 'charge_histo_fmpe.pk'
-    amplitude_histo_filename = 'amplitude_histo_fmpe.pk'
-    timing_histo_filename = 'timing_histo_fmpe.pk'
+    charge_histo_filename = 'charge_histo_fmpe.h5'
+    amplitude_histo_filename = 'amplitude_histo_fmpe.h5'
+    timing_histo_filename = 'timing_histo_fmpe.h5'
 
     if args['--compute']:
 
-        timing_histo = Histogram1D.load(os.path.join(output_path,
-                                                     timing_histo_filename))
+        timing_histo = load_histogram(os.path.join(output_path,
+                                                   timing_histo_filename))
 
         pulse_indices = timing_histo.mode() // 4
 
-        mpe.compute(
+        if args['--shards']:
+
+            compute_sharded(
+                partial(mpe.compute_shard, pixel_id=pixel_id,
+                        max_events=max_events, pulse_indices=pulse_indices,
+                        integral_width=integral_width, shift=shift,
+                        bin_width=bin_width),
                 files,
-                pixel_id, max_events, pulse_indices, integral_width,
-                shift, bin_width, output_path,
-                charge_histo_filename=charge_histo_filename,
-                amplitude_histo_filename=amplitude_histo_filename,
-                save=True)
+                [os.path.join(output_path, charge_histo_filename),
+                 os.path.join(output_path, amplitude_histo_filename)],
+                n_workers=n_workers)
+
+        else:
+
+            mpe.compute(
+                    files,
+                    pixel_id, max_events, pulse_indices, integral_width,
+                    shift, bin_width, output_path,
+                    charge_histo_filename=charge_histo_filename,
+                    amplitude_histo_filename=amplitude_histo_filename,
+                    save=True)
 
     if args['--fit']:
 
-        charge_histo = Histogram1D.load(
-             os.path.join(output_path, charge_histo_filename))
-        # charge_histo = Histogram1D.load(
-        #   os.path.join(output_path, amplitude_histo_filename))
-
-        gain = np.zeros(n_pixels) * np.nan
-        sigma_e = np.zeros(n_pixels) * np.nan
-        sigma_s = np.zeros(n_pixels) * np.nan
-        baseline = np.zeros(n_pixels) * np.nan
-        gain_error = np.zeros(n_pixels) * np.nan
-        sigma_e_error = np.zeros(n_pixels) * np.nan
-        sigma_s_error = np.zeros(n_pixels) * np.nan
-        baseline_error = np.zeros(n_pixels) * np.nan
-        chi_2 = np.zeros(n_pixels) * np.nan
-        ndf = np.zeros(n_pixels) * np.nan
+        charge_histo_path = os.path.join(output_path, charge_histo_filename)
+        charge_histo_file = HistogramFile(charge_histo_path)
 
         n_pe_peaks = 10
         estimated_gain = 20
         min_dist = 5  # int(estimated_gain)
 
         results_filename = os.path.join(output_path, 'fmpe_results.npz')
+        checkpoint_filename = os.path.join(output_path,
+                                           'fmpe_results.checkpoint')
 
-        for i, pixel in tqdm(enumerate(pixel_id), total=n_pixels,
-                             desc='Pixel'):
-
-            x = charge_histo._bin_centers()
-            y = charge_histo.data[i]
-            y_err = charge_histo.errors()[i]
+        if args['--batch_fit']:
 
-            x, y, y_err = compute_data_bounds(x, y, y_err,
-                                              estimated_gain, n_pe_peaks)
-
-            try:
+            charge_histo = charge_histo_file.histogram()
+            fit = fit_fmpe_batch(charge_histo._bin_centers(),
+                                 charge_histo.data, charge_histo.errors(),
+                                 estimated_gain, n_pe_peaks, min_dist,
+                                 pixel_id=pixel_id)
 
-                params_init = compute_init_fmpe(x, y, y_err, snr=3,
-                                                min_dist=min_dist,
-                                                n_pe_peaks=n_pe_peaks,
-                                                debug=debug)
+        else:
 
-                x, y, y_err = compute_data_bounds(x, y, y_err,
-                                                  estimated_gain, n_pe_peaks,
-                                                  params=params_init)
+            arguments = []
 
-                params_limit = compute_limit_fmpe(params_init)
+            for i, pixel in enumerate(pixel_id):
 
-                m = fit_fmpe(x, y, y_err,
-                             params_init,
-                             params_limit)
+                charge_histo = charge_histo_file.histogram([i])
+                arguments.append((charge_histo._bin_centers(),
+                                  charge_histo.data[0],
+                                  charge_histo.errors()[0], estimated_gain,
+                                  n_pe_peaks, min_dist, pixel, debug))
 
-                gain[i] = m.values['gain']
-                gain_error[i] = m.errors['gain']
-                sigma_e[i] = m.values['sigma_e']
-                sigma_e_error[i] = m.errors['sigma_e']
-                sigma_s[i] = m.values['sigma_s']
-                sigma_s_error[i] = m.errors['sigma_s']
-                baseline[i] = m.values['baseline']
-                baseline_error[i] = m.errors['baseline']
-                chi_2[i] = m.fval
-                ndf[i] = len(x) - len(m.list_of_vary_param())
+            fits = fit_pixels(fit_fmpe_pixel, pixel_id, arguments,
+                              n_workers=n_workers,
+                              checkpoint=checkpoint_filename,
+                              key=os.path.getmtime(charge_histo_file.path))
+            names = ['gain', 'sigma_e', 'sigma_s', 'baseline']
+            names += [name + '_error' for name in names] + ['chi_2', 'ndf']
+            fit = {name: np.array([np.nan if result is None else result[name]
+                                   for result in fits.values()])
+                   for name in names}
 
-                fig = plot_fmpe_fit(x, y, y_err, m, pixel)
-
-                # fig.savefig(os.path.join(output_path, 'figures/') +
-                #             'fmpe_pixel_{}'.format(pixel))
-
-                if debug:
-
-                    plt.show()
-
-                plt.close()
-
-            except Exception as exception:
-
-                print('Could not fit FMPE in pixel {}'.format(pixel))
-                print(exception)
+        charge_histo_file.close()
 
         np.savez(results_filename,
-                 gain=gain, sigma_e=sigma_e,
-                 sigma_s=sigma_s, baseline=baseline,
-                 gain_error=gain_error, sigma_e_error=sigma_e_error,
-                 sigma_s_error=sigma_s_error, baseline_error=baseline_error,
-                 chi_2=chi_2, ndf=ndf,
+                 gain=fit['gain'], sigma_e=fit['sigma_e'],
+                 sigma_s=fit['sigma_s'], baseline=fit['baseline'],
+                 gain_error=fit['gain_error'],
+                 sigma_e_error=fit['sigma_e_error'],
+                 sigma_s_error=fit['sigma_s_error'],
+                 baseline_error=fit['baseline_error'],
+                 chi_2=fit['chi_2'], ndf=fit['ndf'],
                  pixel_id=pixel_id,
                  )
 
     if args['--save_figures']:
 
         amplitude_histo_path = os.path.join(output_path,
-                                            'amplitude_histo_fmpe.pk')
-        charge_histo_path = os.path.join(output_path, 'charge_histo_fmpe.pk')
-        timing_histo_path = os.path.join(output_path, 'timing_histo_fmpe.pk')
+                                            amplitude_histo_filename)
+        charge_histo_path = os.path.join(output_path, charge_histo_filename)
+        timing_histo_path = os.path.join(output_path, timing_histo_filename)
 
-        charge_histo = Histogram1D.load(charge_histo_path)
-        amplitude_histo = Histogram1D.load(amplitude_histo_path)
-        timing_histo = Histogram1D.load(timing_histo_path)
+        charge_histo_file = HistogramFile(charge_histo_path)
+        amplitude_histo_file = HistogramFile(amplitude_histo_path)
+        timing_histo_file = HistogramFile(timing_histo_path)
 
         figure_path = os.path.join(output_path, 'figures/')
 
@@ -428,12 +552,12 @@ def entry():
 
             try:
 
-                charge_histo.draw(index=(i,), axis=axis_1, log=True,
-                                  legend=False)
-                amplitude_histo.draw(index=(i,), axis=axis_2, log=True,
-                                     legend=False)
-                timing_histo.draw(index=(i,), axis=axis_3, log=True,
-                                  legend=False)
+                charge_histo_file.histogram([i]).draw(
+                    index=(0, ), axis=axis_1, log=True, legend=False)
+                amplitude_histo_file.histogram([i]).draw(
+                    index=(0, ), axis=axis_2, log=True, legend=False)
+                timing_histo_file.histogram([i]).draw(
+                    index=(0, ), axis=axis_3, log=True, legend=False)
                 figure_1.savefig(figure_path +
                                  'charge_fmpe_pixel_{}'.format(pixel))
                 figure_2.savefig(figure_path +
@@ -451,22 +575,24 @@ def entry():
             axis_2.clear()
             axis_3.clear()
 
+        charge_histo_file.close()
+        amplitude_histo_file.close()
+        timing_histo_file.close()
+
     if args['--display']:
 
         amplitude_histo_path = os.path.join(output_path,
-                                            'amplitude_histo_fmpe.pk')
-        charge_histo_path = os.path.join(output_path,
-                                         'charge_histo_fmpe.pk')
-        timing_histo_path = os.path.join(output_path,
-                                         'timing_histo_fmpe.pk')
+                                            amplitude_histo_filename)
+        charge_histo_path = os.path.join(output_path, charge_histo_filename)
+        timing_histo_path = os.path.join(output_path, timing_histo_filename)
 
-        charge_histo = Histogram1D.load(charge_histo_path)
+        charge_histo = load_histogram(charge_histo_path, index=[0])
         charge_histo.draw(index=(0,), log=False, legend=False)
 
-        amplitude_histo = Histogram1D.load(amplitude_histo_path)
+        amplitude_histo = load_histogram(amplitude_histo_path, index=[0])
         amplitude_histo.draw(index=(0,), log=False, legend=False)
 
-        timing_histo = Histogram1D.load(timing_histo_path)
+        timing_histo = load_histogram(timing_histo_path, index=[0])
         timing_histo.draw(index=(0,), log=False, legend=False)
         plt.show()
 
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+'''
+Sum histogram files of the same bins, e.g. the shards computed by
+digicam-raw, digicam-timing or digicam-fmpe with --shards on several
+machines
+
+Usage:
+  merge_histograms.py [options] <OUTPUT> <SHARD>...
+
+Options:
+  -h --help                 Show this screen.
+  -u --update               Add the shards to the histogram of OUTPUT, the
+                            shards already summed in it are skipped
+'''
+import os
+from docopt import docopt
+
+from digicampipe.utils.hist1d import merge_histogram_files
+
+
+def entry():
+
+    args = docopt(__doc__)
+    output = args['<OUTPUT>']
+    update = args['--update']
+
+    if os.path.exists(output) and not update:
+
+        raise IOError('The file {} already exists, use --update to add the '
+                      'shards to it'.format(output))
+
+    merged = merge_histogram_files(output, args['<SHARD>'], update=update)
+
+    for shard in args['<SHARD>']:
+
+        status = 'added' if shard in merged else 'already summed'
+        print('{}: {}'.format(shard, status))
+
+
+if __name__ == '__main__':
+
+    entry()
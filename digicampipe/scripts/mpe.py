@@ -37,7 +37,9 @@ from histogram.histogram import Histogram1D
 from digicampipe.calib.camera.baseline import fill_digicam_baseline, \
     subtract_baseline
 from digicampipe.calib.camera.peak import fill_pulse_indices
-from digicampipe.calib.camera.charge import compute_charge, compute_amplitude
+from digicampipe.calib.camera.charge import compute_pulses
+from digicampipe.utils.hist1d import fill_sparse, save_histogram, \
+    load_histogram
 from digicampipe.utils.docopt import convert_max_events_args, \
     convert_pixel_args, convert_dac_level
 from digicampipe.scripts import timing
@@ -55,8 +57,8 @@ def plot_event(events, pixel_id):
 
 def compute(files, pixel_id, max_events, pulse_indices, integral_width,
             shift, bin_width, output_path,
-            charge_histo_filename='charge_histo.pk',
-            amplitude_histo_filename='amplitude_histo.pk',
+            charge_histo_filename='charge_histo.h5',
+            amplitude_histo_filename='amplitude_histo.h5',
             save=True):
 
     amplitude_histo_path = os.path.join(output_path, amplitude_histo_filename)
@@ -79,8 +81,7 @@ def compute(files, pixel_id, max_events, pulse_indices, integral_width,
     events = subtract_baseline(events)
     # events = find_pulse_with_max(events)
     events = fill_pulse_indices(events, pulse_indices)
-    events = compute_charge(events, integral_width, shift)
-    events = compute_amplitude(events)
+    events = compute_pulses(events, integral_width, shift)
 
     charge_histo = Histogram1D(
         data_shape=(n_pixels,),
@@ -99,17 +100,29 @@ def compute(files, pixel_id, max_events, pulse_indices, integral_width,
     )
 
     for event in events:
-        charge_histo.fill(event.data.reconstructed_charge)
-        amplitude_histo.fill(event.data.reconstructed_amplitude)
+        pulses = event.data.pulses
+        fill_sparse(charge_histo, pulses['pixel'], pulses['charge'])
+        fill_sparse(amplitude_histo, pulses['pixel'], pulses['amplitude'])
 
     if save:
 
-        charge_histo.save(charge_histo_path)
-        amplitude_histo.save(amplitude_histo_path)
+        save_histogram(charge_histo, charge_histo_path)
+        save_histogram(amplitude_histo, amplitude_histo_path)
 
     return amplitude_histo, charge_histo
 
 
+def compute_shard(file, charge_shard, amplitude_shard, pixel_id, max_events,
+                  pulse_indices, integral_width, shift, bin_width):
+    """Histograms of the single file `file`, of `max_events` at most"""
+
+    compute([file], pixel_id, max_events, pulse_indices, integral_width,
+            shift, bin_width, os.path.dirname(charge_shard),
+            charge_histo_filename=os.path.basename(charge_shard),
+            amplitude_histo_filename=os.path.basename(amplitude_shard),
+            save=True)
+
+
 def entry():
 
     args = docopt(__doc__)
@@ -148,11 +161,11 @@ def entry():
                                         total=n_ac_levels, desc='DAC level',
                                         leave=False):
 
-            timing_histo_filename = 'timing_histo_ac_level_{}.pk' \
+            timing_histo_filename = 'timing_histo_ac_level_{}.h5' \
                                     ''.format(ac_level)
-            charge_histo_filename = 'charge_histo_ac_level_{}.pk' \
+            charge_histo_filename = 'charge_histo_ac_level_{}.h5' \
                                     ''.format(ac_level)
-            amplitude_histo_filename = 'amplitude_histo_ac_level_{}.pk' \
+            amplitude_histo_filename = 'amplitude_histo_ac_level_{}.h5' \
                                        ''.format(ac_level)
 
             timing_histo = timing.compute(file, max_events, pixel_id,
@@ -192,13 +205,13 @@ def entry():
 
     if args['--display']:
 
-        amplitude_histo_path = os.path.join(output_path, 'amplitude_histo.pk')
-        charge_histo_path = os.path.join(output_path, 'charge_histo.pk')
+        amplitude_histo_path = os.path.join(output_path, 'amplitude_histo.h5')
+        charge_histo_path = os.path.join(output_path, 'charge_histo.h5')
 
-        charge_histo = Histogram1D.load(charge_histo_path)
+        charge_histo = load_histogram(charge_histo_path, index=[0])
         charge_histo.draw(index=(0,), log=False, legend=False)
 
-        amplitude_histo = Histogram1D.load(amplitude_histo_path)
+        amplitude_histo = load_histogram(amplitude_histo_path, index=[0])
         amplitude_histo.draw(index=(0,), log=False, legend=False)
         plt.show()
 
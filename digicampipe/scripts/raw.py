@@ -15,8 +15,14 @@ Options:
   -v --debug                  Enter the debug mode.
   -p --pixel=<PIXEL>          Give a list of pixel IDs.
   --save_figures              Save the plots to the OUTPUT folder
+  --shards                    Compute a histogram per input file and sum
+                              them, the files already computed are skipped.
+                              --max_events then applies to each file.
+  --n_workers=N               Number of processes computing the shards
+                              [default: 1]
 '''
 import os
+from functools import partial
 from docopt import docopt
 from tqdm import tqdm
 import numpy as np
@@ -26,9 +32,11 @@ from histogram.histogram import Histogram1D
 from digicampipe.io.event_stream import calibration_event_stream
 from digicampipe.utils.docopt import convert_max_events_args,\
     convert_pixel_args
+from digicampipe.utils.hist1d import save_histogram, load_histogram, \
+    HistogramFile, compute_sharded
 
 
-def compute(files, max_events, pixel_id, output_path, filename='raw_histo.pk'):
+def compute(files, max_events, pixel_id, output_path, filename='raw_histo.h5'):
 
     filename = os.path.join(output_path, filename)
 
@@ -49,11 +57,18 @@ def compute(files, max_events, pixel_id, output_path, filename='raw_histo.pk'):
     for event in events:
         raw_histo.fill(event.data.adc_samples)
 
-    raw_histo.save(filename)
+    save_histogram(raw_histo, filename)
 
     return raw_histo
 
 
+def compute_shard(file, shard, max_events, pixel_id):
+    """Histograms of the single file `file`, of `max_events` at most"""
+
+    compute([file], max_events, pixel_id, os.path.dirname(shard),
+            os.path.basename(shard))
+
+
 def entry():
 
     args = docopt(__doc__)
@@ -63,7 +78,7 @@ def entry():
     max_events = convert_max_events_args(args['--max_events'])
     pixel_id = convert_pixel_args(args['--pixel'])
     output_path = args['OUTPUT']
-    raw_histo_filename = 'raw_histo.pk'
+    raw_histo_filename = 'raw_histo.h5'
 
     if not os.path.exists(output_path):
 
@@ -71,12 +86,23 @@ def entry():
 
     if args['--compute']:
 
-        compute(files, max_events, pixel_id, output_path, raw_histo_filename)
+        if args['--shards']:
+
+            compute_sharded(
+                partial(compute_shard, max_events=max_events,
+                        pixel_id=pixel_id),
+                files, [os.path.join(output_path, raw_histo_filename)],
+                n_workers=int(args['--n_workers']))
+
+        else:
+
+            compute(files, max_events, pixel_id, output_path,
+                    raw_histo_filename)
 
     if args['--save_figures']:
 
         histo_path = os.path.join(output_path, raw_histo_filename)
-        raw_histo = Histogram1D.load(histo_path)
+        histo_file = HistogramFile(histo_path)
 
         path = os.path.join(output_path, 'figures/', 'raw_histo/')
 
@@ -91,7 +117,8 @@ def entry():
 
             try:
 
-                raw_histo.draw(index=(i,), axis=axis, log=True, legend=False)
+                histo_file.histogram([i]).draw(index=(0, ), axis=axis,
+                                               log=True, legend=False)
                 figure.savefig(figure_path.format(pixel))
 
             except Exception as e:
@@ -102,10 +129,12 @@ def entry():
 
             axis.remove()
 
+        histo_file.close()
+
     if args['--display']:
 
         path = os.path.join(output_path, raw_histo_filename)
-        raw_histo = Histogram1D.load(path)
+        raw_histo = load_histogram(path, index=[0])
         raw_histo.draw(index=(0, ), log=True, legend=False)
         plt.show()
 
@@ -23,9 +23,27 @@ Options:
                               [default: 2.0].
   --save_figures              Save the plots to the OUTPUT folder
   --n_samples=N               Number of samples per waveform
+  --template_fit              Reconstruct the amplitude by fitting the pulse
+                              template instead of taking the pulse maximum
+  --n_workers=N               Number of processes of the fit [default: 1].
+                              The fitted pixels are saved in
+                              OUTPUT/fit_results.checkpoint, a new fit only
+                              fits the missing or failed pixels and the
+                              pixels whose fit inputs changed.
+  --single_pass               Compute all the histograms (and the timing
+                              histogram) in one pass over the data
+  --n_baseline_events=N       Events of the raw histogram giving the baseline
+                              in --single_pass mode [default: 1000]
+  --batch_size=N              Events per block in --single_pass mode
+                              [default: 100]
+  --n_threads=N               Threads finding the pulses in --single_pass
+                              mode [default: 1]
 
 '''
+import copy
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from docopt import docopt
 from tqdm import tqdm
 
@@ -48,8 +66,14 @@ from digicampipe.io.containers_calib import SPEResultContainer
 from histogram.histogram import Histogram1D
 from digicampipe.calib.camera.baseline import fill_baseline, subtract_baseline
 from digicampipe.calib.camera.peak import find_pulse_with_max, \
-    find_pulse_wavelets, find_pulse_correlate, find_pulse_fast
-from digicampipe.calib.camera.charge import compute_charge, compute_amplitude
+    find_pulse_wavelets, find_pulse_correlate, find_pulse_fast, \
+    wavelets_pulse_mask
+from digicampipe.calib.camera.charge import compute_pulses, \
+    pulses_from_samples
+from digicampipe.utils.hist1d import fill_sparse, save_histogram, \
+    load_histogram, HistogramFile
+from digicampipe.utils.pulse_template import default_template
+from digicampipe.utils.pixel_fit import fit_pixels
 from digicampipe.scripts import raw
 
 
@@ -272,6 +296,16 @@ def fit_spe(x, y, y_err, sigma_e, snr=4, debug=False):
     return m.values, m.errors, params_init, param_bounds
 
 
+def fit_spe_pixel(x, y, y_err, sigma_e, snr=4, debug=False):
+    """`fit_spe()` of one pixel, c.f. `digicampipe.utils.pixel_fit`"""
+
+    params, params_err, params_init, params_bound = fit_spe(
+        x, y, y_err, sigma_e=sigma_e, snr=snr, debug=debug)
+
+    return {'param': dict(params), 'param_errors': dict(params_err),
+            'init': params_init, 'bound': params_bound}
+
+
 def save_container(container, filename, group_name, table_name):
 
     with HDF5TableWriter(filename, mode='a', group_name=group_name) as h5:
@@ -299,6 +333,158 @@ def plot_event(events, pixel_id):
         yield event
 
 
+def _pixels_first(adc_samples):
+    """Samples of shape (n_pixels, n) of a single event or of a block"""
+
+    if adc_samples.ndim == 2:
+
+        return adc_samples
+
+    return np.moveaxis(adc_samples, 0, -2).reshape(
+        adc_samples.shape[-2], -1)
+
+
+def fill_baseline_from_raw(events, raw_histo, n_baseline_events):
+    """
+    Fill `raw_histo` with the samples of all the events and
+    `event.data.baseline` with the mode of `raw_histo` after the first
+    `n_baseline_events` events. These events are held back as copies of
+    their containers (the event streams reuse the same container) until the
+    baseline is known.
+    """
+
+    buffer = []
+    n_buffered = 0
+    baseline = None
+
+    def flush():
+
+        for held_event in buffer:
+
+            held_event.data.baseline = baseline
+
+            yield held_event
+
+        buffer.clear()
+
+    for event in events:
+
+        adc_samples = event.data.adc_samples
+        raw_histo.fill(_pixels_first(adc_samples))
+
+        if baseline is not None:
+
+            event.data.baseline = baseline
+
+            yield event
+
+            continue
+
+        buffer.append(copy.deepcopy(event))
+        n_buffered += 1 if adc_samples.ndim == 2 else len(adc_samples)
+
+        if n_buffered >= n_baseline_events:
+
+            baseline = raw_histo.mode()
+
+            yield from flush()
+
+    if buffer:
+
+        baseline = raw_histo.mode()
+
+        yield from flush()
+
+
+def _find_spe_pulses(adc_samples, integral_width, shift, template,
+                     pixel_id):
+    """Pulses of the max and of the wavelets pulse finders"""
+
+    arg_max = np.argmax(adc_samples, axis=-1)
+    max_mask = np.arange(adc_samples.shape[-1]) == arg_max[..., np.newaxis]
+    max_pulses = pulses_from_samples(adc_samples, max_mask, integral_width,
+                                     shift=shift)
+
+    pulse_mask = wavelets_pulse_mask(adc_samples, threshold_sigma=2,
+                                     widths=[4, 5, 6])
+    pulses = pulses_from_samples(adc_samples, pulse_mask, integral_width,
+                                 shift=shift, template=template,
+                                 pixel_id=pixel_id)
+
+    return max_pulses, pulses
+
+
+def compute_single_pass(files, pixel_id, max_events, integral_width, shift,
+                        n_samples, template=None, n_baseline_events=1000,
+                        batch_size=100, n_threads=1):
+    """
+    Raw, max, charge, amplitude and timing histograms in one pass over the
+    data. The events are read and baseline subtracted once, c.f.
+    `fill_baseline_from_raw()`, the pulses of the max and of the wavelets
+    pulse finders are then found on `n_threads` threads.
+
+    :return: dict of the `Histogram1D` by name: 'raw', 'max', 'charge',
+    'amplitude' and 'timing'
+    """
+
+    n_pixels = len(pixel_id)
+    histograms = {
+        'raw': Histogram1D(data_shape=(n_pixels, ),
+                           bin_edges=np.arange(0, 4095, 1),
+                           axis_name='[LSB]'),
+        'max': Histogram1D(data_shape=(n_pixels, ),
+                           bin_edges=np.arange(-4095 * integral_width,
+                                               4095 * integral_width),
+                           axis_name='[LSB]'),
+        'charge': Histogram1D(data_shape=(n_pixels, ),
+                              bin_edges=np.arange(-4095 * integral_width,
+                                                  4095 * integral_width)),
+        'amplitude': Histogram1D(data_shape=(n_pixels, ),
+                                 bin_edges=np.arange(-4095, 4095, 1)),
+        'timing': Histogram1D(data_shape=(n_pixels, ),
+                              bin_edges=np.arange(0, n_samples * 4, 1),
+                              axis_name='reconstructed time [ns]'),
+    }
+
+    events = calibration_event_stream(files, pixel_id=pixel_id,
+                                      max_events=max_events,
+                                      batch_size=batch_size)
+    events = fill_baseline_from_raw(events, histograms['raw'],
+                                    n_baseline_events)
+    events = subtract_baseline(events)
+
+    def fill(max_pulses, pulses):
+
+        fill_sparse(histograms['max'], max_pulses['pixel'],
+                    max_pulses['charge'])
+        fill_sparse(histograms['timing'], max_pulses['pixel'],
+                    max_pulses['time'])
+        fill_sparse(histograms['charge'], pulses['pixel'], pulses['charge'])
+        fill_sparse(histograms['amplitude'], pulses['pixel'],
+                    pulses['amplitude'])
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+
+        pending = deque()
+
+        for event in events:
+
+            # subtract_baseline() writes every event in a new array
+            pending.append(executor.submit(
+                _find_spe_pulses, event.data.adc_samples, integral_width,
+                shift, template, event.pixel_id))
+
+            if len(pending) > n_threads:
+
+                fill(*pending.popleft().result())
+
+        while pending:
+
+            fill(*pending.popleft().result())
+
+    return histograms
+
+
 def entry():
 
     args = docopt(__doc__)
@@ -315,11 +501,13 @@ def entry():
     pixel_id = convert_pixel_args(args['--pixel'])
     n_pixels = len(pixel_id)
 
-    raw_histo_filename = 'raw_histo.pk'
-    amplitude_histo_filename = output_path + 'amplitude_histo.pk'
-    charge_histo_filename = output_path + 'charge_histo.pk'
-    max_histo_filename = output_path + 'max_histo.pk'
+    raw_histo_filename = 'raw_histo.h5'
+    amplitude_histo_filename = output_path + 'amplitude_histo.h5'
+    charge_histo_filename = output_path + 'charge_histo.h5'
+    max_histo_filename = output_path + 'max_histo.h5'
+    timing_histo_filename = output_path + 'timing_histo.h5'
     results_filename = output_path + 'fit_results.h5'
+    checkpoint_filename = output_path + 'fit_results.checkpoint'
     dark_count_rate_filename = output_path + 'dark_count_rate.npz'
     crosstalk_filename = output_path + 'crosstalk.npz'
     electronic_noise_filename = output_path + 'electronic_noise.npz'
@@ -327,10 +515,34 @@ def entry():
     integral_width = int(args['--integral_width'])
     shift = int(args['--shift'])
     pulse_finder_threshold = float(args['--pulse_finder_threshold'])
+    n_workers = int(args['--n_workers'])
 
     n_samples = int(args['--n_samples'])  # TODO access this in a better way !
 
-    if args['--compute']:
+    if args['--compute'] and args['--single_pass']:
+
+        raw_histo_path = os.path.join(output_path, raw_histo_filename)
+
+        if os.path.exists(raw_histo_path):
+
+            raise IOError('The file {} already exists \n'.
+                          format(raw_histo_path))
+
+        template = default_template() if args['--template_fit'] else None
+        histograms = compute_single_pass(
+            files, pixel_id, max_events, integral_width, shift, n_samples,
+            template=template,
+            n_baseline_events=int(args['--n_baseline_events']),
+            batch_size=int(args['--batch_size']),
+            n_threads=int(args['--n_threads']))
+
+        save_histogram(histograms['raw'], raw_histo_path)
+        save_histogram(histograms['max'], max_histo_filename)
+        save_histogram(histograms['charge'], charge_histo_filename)
+        save_histogram(histograms['amplitude'], amplitude_histo_filename)
+        save_histogram(histograms['timing'], timing_histo_filename)
+
+    elif args['--compute']:
 
         raw_histo = raw.compute(files, max_events=max_events,
                                 pixel_id=pixel_id, output_path=output_path,
@@ -345,7 +557,7 @@ def entry():
         events = fill_baseline(events, baseline)
         events = subtract_baseline(events)
         events = find_pulse_with_max(events)
-        events = compute_charge(events, integral_width, shift)
+        events = compute_pulses(events, integral_width, shift)
 
         max_histo = Histogram1D(
                             data_shape=(n_pixels,),
@@ -356,9 +568,10 @@ def entry():
 
         for event in events:
 
-            max_histo.fill(event.data.reconstructed_charge)
+            pulses = event.data.pulses
+            fill_sparse(max_histo, pulses['pixel'], pulses['charge'])
 
-        max_histo.save(max_histo_filename)
+        save_histogram(max_histo, max_histo_filename)
 
         events = calibration_event_stream(files,
                                           max_events=max_events,
@@ -377,13 +590,13 @@ def entry():
         events = find_pulse_wavelets(events, widths=[4, 5, 6],
                                      threshold_sigma=2)
 
-        events = compute_charge(
+        template = default_template() if args['--template_fit'] else None
+        events = compute_pulses(
             events,
             integral_width=integral_width,
-            shift=shift
+            shift=shift,
+            template=template,
         )
-        events = compute_amplitude(events)
-        # events = fit_template(events)
 
         if debug:
             events = plot_event(events, 0)
@@ -399,17 +612,17 @@ def entry():
 
         for event in events:
 
-            spe_charge.fill(event.data.reconstructed_charge)
-            spe_amplitude.fill(event.data.reconstructed_amplitude)
+            pulses = event.data.pulses
+            fill_sparse(spe_charge, pulses['pixel'], pulses['charge'])
+            fill_sparse(spe_amplitude, pulses['pixel'], pulses['amplitude'])
 
-        spe_charge.save(charge_histo_filename)
-        spe_amplitude.save(amplitude_histo_filename)
+        save_histogram(spe_charge, charge_histo_filename)
+        save_histogram(spe_amplitude, amplitude_histo_filename)
 
     if args['--fit']:
 
-        spe_charge = Histogram1D.load(charge_histo_filename)
-        spe_amplitude = Histogram1D.load(amplitude_histo_filename)
-        max_histo = Histogram1D.load(max_histo_filename)
+        spe_charge_file = HistogramFile(charge_histo_filename)
+        max_histo_file = HistogramFile(max_histo_filename)
 
         dark_count_rate = np.zeros(n_pixels) * np.nan
         electronic_noise = np.zeros(n_pixels) * np.nan
@@ -417,8 +630,9 @@ def entry():
         for i, pixel in tqdm(enumerate(pixel_id), total=n_pixels,
                              desc='Pixel'):
 
+            max_histo = max_histo_file.histogram([i])
             x = max_histo._bin_centers()
-            y = max_histo.data[i]
+            y = max_histo.data[0]
 
             n_entries = np.sum(y)
 
@@ -450,7 +664,6 @@ def entry():
         np.savez(dark_count_rate_filename, dcr=dark_count_rate)
         np.savez(electronic_noise_filename, electronic_noise)
 
-        spe = spe_charge
         name = 'charge'
         crosstalk = np.zeros(n_pixels) * np.nan
 
@@ -458,67 +671,73 @@ def entry():
 
         table_name = 'analysis_' + name
 
-        with HDF5TableWriter(results_filename, table_name, mode='w') as h5:
+        arguments = []
 
-            for i, pixel in tqdm(enumerate(pixel_id), total=n_pixels,
-                                 desc='Pixel'):
+        for i, pixel in enumerate(pixel_id):
 
-                try:
+            spe = spe_charge_file.histogram([i])
+            sigma_e = electronic_noise[i]
+            sigma_e = sigma_e if not np.isnan(sigma_e) else None
+            arguments.append((spe._bin_centers(), spe.data[0],
+                              spe.errors(index=0), sigma_e, 3, debug))
 
-                    x = spe._bin_centers()
-                    y = spe.data[i]
-                    y_err = spe.errors(index=i)
-                    sigma_e = electronic_noise[i]
-                    sigma_e = sigma_e if not np.isnan(sigma_e) else None
+        fits = fit_pixels(fit_spe_pixel, pixel_id, arguments,
+                          n_workers=n_workers,
+                          checkpoint=checkpoint_filename,
+                          key=os.path.getmtime(spe_charge_file.path))
+        spe_charge_file.close()
+        max_histo_file.close()
 
-                    params, params_err, params_init, params_bound = \
-                        fit_spe(x, y, y_err, sigma_e=sigma_e,
-                                snr=3, debug=debug)
+        with HDF5TableWriter(results_filename, table_name, mode='w') as h5:
 
-                    for key, val in params.items():
+            for pixel, fit in fits.items():
 
-                        setattr(results.init, key, params_init[key])
-                        setattr(results.param, key, params[key])
-                        setattr(results.param_errors, key, params_err[key])
+                if fit is None:
 
-                    for key, val in results.items():
-                        results[key]['pixel_id'] = pixel
+                    continue
 
-                    for key, val in results.items():
+                params = fit['param']
 
-                        h5.write('spe_' + key, val)
+                for key, val in params.items():
 
-                    n_entries = params['a_1']
-                    n_entries += params['a_2']
-                    n_entries += params['a_3']
-                    n_entries += params['a_4']
-                    crosstalk[pixel] = (n_entries - params['a_1']) / n_entries
+                    setattr(results.init, key, fit['init'][key])
+                    setattr(results.param, key, params[key])
+                    setattr(results.param_errors, key,
+                            fit['param_errors'][key])
 
-                except Exception as e:
+                for key, val in results.items():
+                    results[key]['pixel_id'] = pixel
 
-                    print('Could not fit for pixel_id : {}'.format(pixel))
-                    print(e)
+                for key, val in results.items():
+
+                    h5.write('spe_' + key, val)
+
+                n_entries = params['a_1']
+                n_entries += params['a_2']
+                n_entries += params['a_3']
+                n_entries += params['a_4']
+                crosstalk[pixel] = (n_entries - params['a_1']) / n_entries
 
             np.savez(crosstalk_filename, crosstalk)
 
     if args['--save_figures']:
 
-        spe_charge = Histogram1D.load(charge_histo_filename)
-        spe_amplitude = Histogram1D.load(amplitude_histo_filename)
-        raw_histo = Histogram1D.load(os.path.join(output_path,
-                                                  raw_histo_filename))
-        max_histo = Histogram1D.load(max_histo_filename)
+        histogram_files = [
+            HistogramFile(charge_histo_filename),
+            HistogramFile(amplitude_histo_filename),
+            HistogramFile(os.path.join(output_path, raw_histo_filename)),
+            HistogramFile(max_histo_filename),
+        ]
 
         figure_directory = output_path + 'figures/'
 
         if not os.path.exists(figure_directory):
             os.makedirs(figure_directory)
 
-        histograms = [spe_charge, spe_amplitude, raw_histo, max_histo]
         names = ['histogram_charge/', 'histogram_amplitude/', 'histogram_raw/',
                  'histo_max/']
 
-        for i, histo in enumerate(histograms):
+        for i, histo_file in enumerate(histogram_files):
 
             figure = plt.figure()
             histogram_figure_directory = figure_directory + names[i]
@@ -533,7 +752,8 @@ def entry():
 
                 try:
 
-                    histo.draw(index=(j,), axis=axis, log=True, legend=False)
+                    histo_file.histogram([j]).draw(index=(0, ), axis=axis,
+                                                   log=True, legend=False)
                     figure.savefig(figure_path)
 
                 except Exception as e:
@@ -544,13 +764,16 @@ def entry():
 
                 axis.remove()
 
+            histo_file.close()
+
     if args['--display']:
 
-        spe_charge = Histogram1D.load(charge_histo_filename)
-        spe_amplitude = Histogram1D.load(amplitude_histo_filename)
-        raw_histo = Histogram1D.load(os.path.join(output_path,
-                                                  raw_histo_filename))
-        max_histo = Histogram1D.load(max_histo_filename)
+        spe_charge = load_histogram(charge_histo_filename, index=[0])
+        spe_amplitude = load_histogram(amplitude_histo_filename, index=[0])
+        raw_histo = load_histogram(os.path.join(output_path,
+                                                raw_histo_filename),
+                                   index=[0])
+        max_histo = load_histogram(max_histo_filename, index=[0])
 
         spe_charge.draw(index=(0, ), log=True, legend=False)
         spe_amplitude.draw(index=(0, ), log=True, legend=False)
@@ -16,8 +16,17 @@ Options:
   -p --pixel=<PIXEL>          Give a list of pixel IDs.
   --save_figures              Save the plots to the OUTPUT folder
   --n_samples=N               Number of samples per waveform
+  --time_method=METHOD        Arrival time estimator: max, leading_edge, cfd,
+                              charge_weighted or template
+                              [default: leading_edge]
+  --shards                    Compute a histogram per input file and sum
+                              them, the files already computed are skipped.
+                              --max_events then applies to each file.
+  --n_workers=N               Number of processes computing the shards
+                              [default: 1]
 '''
 import os
+from functools import partial
 from docopt import docopt
 from tqdm import tqdm
 import numpy as np
@@ -27,12 +36,14 @@ from histogram.histogram import Histogram1D
 from digicampipe.io.event_stream import calibration_event_stream
 from digicampipe.utils.docopt import convert_max_events_args,\
     convert_pixel_args
+from digicampipe.utils.hist1d import save_histogram, load_histogram, \
+    HistogramFile, compute_sharded
 from digicampipe.calib.camera.time import compute_time_from_max, \
-    compute_time_from_leading_edge
+    compute_time
 
 
 def compute(files, max_events, pixel_id, output_path, n_samples,
-            filename='timing_histo.pk', save=True,
+            filename='timing_histo.h5', save=True,
             time_method=compute_time_from_max):
 
     filename = os.path.join(output_path, filename)
@@ -59,11 +70,18 @@ def compute(files, max_events, pixel_id, output_path, n_samples,
 
     if save:
 
-        timing_histo.save(filename)
+        save_histogram(timing_histo, filename)
 
     return timing_histo
 
 
+def compute_shard(file, shard, max_events, pixel_id, n_samples, time_method):
+    """Histograms of the single file `file`, of `max_events` at most"""
+
+    compute([file], max_events, pixel_id, os.path.dirname(shard), n_samples,
+            os.path.basename(shard), save=True, time_method=time_method)
+
+
 def entry():
 
     args = docopt(__doc__)
@@ -73,8 +91,9 @@ def entry():
     max_events = convert_max_events_args(args['--max_events'])
     pixel_id = convert_pixel_args(args['--pixel'])
     n_samples = int(args['--n_samples'])
+    time_method = partial(compute_time, method=args['--time_method'])
     output_path = args['OUTPUT']
-    timing_histo_filename = 'timing_histo.pk'
+    timing_histo_filename = 'timing_histo.h5'
 
     if not os.path.exists(output_path):
 
@@ -82,14 +101,25 @@ def entry():
 
     if args['--compute']:
 
-        compute(files, max_events, pixel_id, output_path, n_samples,
-                timing_histo_filename, save=True,
-                time_method=compute_time_from_leading_edge)
+        if args['--shards']:
+
+            compute_sharded(
+                partial(compute_shard, max_events=max_events,
+                        pixel_id=pixel_id, n_samples=n_samples,
+                        time_method=time_method),
+                files, [os.path.join(output_path, timing_histo_filename)],
+                n_workers=int(args['--n_workers']))
+
+        else:
+
+            compute(files, max_events, pixel_id, output_path, n_samples,
+                    timing_histo_filename, save=True,
+                    time_method=time_method)
 
     if args['--save_figures']:
 
         histo_path = os.path.join(output_path, timing_histo_filename)
-        raw_histo = Histogram1D.load(histo_path)
+        histo_file = HistogramFile(histo_path)
 
         path = os.path.join(output_path, 'figures/', 'timing_histo/')
 
@@ -104,7 +134,8 @@ def entry():
 
             try:
 
-                raw_histo.draw(index=(i,), axis=axis, log=True, legend=False)
+                histo_file.histogram([i]).draw(index=(0, ), axis=axis,
+                                               log=True, legend=False)
                 figure.savefig(figure_path.format(pixel))
 
             except Exception as e:
@@ -115,10 +146,12 @@ def entry():
 
             axis.remove()
 
+        histo_file.close()
+
     if args['--display']:
 
         path = os.path.join(output_path, timing_histo_filename)
-        raw_histo = Histogram1D.load(path)
+        raw_histo = load_histogram(path, index=[0])
         raw_histo.draw(index=(0, ), log=True, legend=False)
 
         plt.show()
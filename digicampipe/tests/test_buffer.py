@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from digicampipe.io.buffer import BufferPool, modifies, is_pooled
+
+
+def test_buffer_pool_ring():
+
+    n_buffers = 3
+    pool = BufferPool(n_buffers)
+    buffers = [pool.copy(np.full(10, i)) for i in range(n_buffers)]
+
+    for i, buffer in enumerate(buffers):
+
+        assert (buffer == i).all()
+
+    # the ring is full, the oldest buffer is given back
+    buffer = pool.get((10, ), buffers[0].dtype)
+
+    assert np.shares_memory(buffer, buffers[0])
+    assert not np.shares_memory(buffer, buffers[1])
+
+
+def test_buffer_pool_reallocates():
+
+    pool = BufferPool(2)
+    buffer = pool.get((5, ), np.float32)
+
+    assert buffer.shape == (5, )
+    assert buffer.dtype == np.float32
+
+    buffer = pool.get((4, 3), np.uint16)
+
+    assert buffer.shape == (4, 3)
+    assert buffer.dtype == np.uint16
+
+
+def test_modifies():
+
+    @modifies('r0.adc_samples')
+    def stage(events):
+
+        yield from events
+
+    assert stage.modifies == ('r0.adc_samples', )
+
+
+def test_modifies_copies_pooled_buffers():
+
+    @modifies('r0.adc_samples')
+    def set_to_zero(events):
+
+        for event in events:
+
+            event.r0.tel[1].adc_samples[:] = 0
+
+            yield event
+
+    pool = BufferPool(2)
+    buffers = [pool.copy(np.full((3, 4), i + 1)) for i in range(2)]
+    owned = np.ones((3, 4))
+    events = [SimpleNamespace(r0=SimpleNamespace(
+        tels_with_data=[1], tel={1: SimpleNamespace(adc_samples=samples)}))
+        for samples in buffers + [owned]]
+
+    assert all(is_pooled(buffer) for buffer in buffers)
+    assert is_pooled(buffers[0][1:])
+    assert not is_pooled(owned)
+
+    for event in set_to_zero(events):
+
+        assert (event.r0.tel[1].adc_samples == 0).all()
+
+    # the pool is left untouched, the arrays owned by the event are not
+    # copied
+    assert (buffers[0] == 1).all() and (buffers[1] == 2).all()
+    assert events[2].r0.tel[1].adc_samples is owned
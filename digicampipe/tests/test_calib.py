@@ -0,0 +1,90 @@
+import numpy as np
+
+from digicampipe.utils import calib
+
+
+def test_calibration_constants_tolerance():
+
+    constants = calib.CalibrationConstants(tolerance=0.05)
+    random_state = np.random.RandomState(0)
+    baseline_shift = random_state.uniform(0, 50, size=1296)
+
+    gain_drop, nsb_rate = constants.gain_drop_and_nsb(baseline_shift)
+
+    np.testing.assert_allclose(
+        gain_drop, calib.compute_gain_drop(baseline_shift, 'mean'))
+    np.testing.assert_allclose(
+        nsb_rate, calib.compute_nsb_rate(baseline_shift, 'mean'))
+
+    new_baseline_shift = baseline_shift + 0.01
+    new_baseline_shift[:10] += 1
+    new_gain_drop, new_nsb_rate = constants.gain_drop_and_nsb(
+        new_baseline_shift)
+
+    # only the pixels that moved beyond the tolerance are recomputed
+    np.testing.assert_allclose(
+        new_gain_drop[:10],
+        calib.compute_gain_drop(new_baseline_shift[:10], 'mean'))
+    np.testing.assert_array_equal(new_gain_drop[10:], gain_drop[10:])
+    np.testing.assert_array_equal(new_nsb_rate[10:], nsb_rate[10:])
+
+
+def test_calibration_constants_blocks():
+
+    constants = calib.CalibrationConstants(tolerance=0)
+    std = np.random.RandomState(0).uniform(1, 10, size=(3, 1296))
+
+    gain_drop, nsb_rate = constants.gain_drop_and_nsb(std, 'std')
+
+    assert gain_drop.shape == std.shape
+    np.testing.assert_allclose(gain_drop, calib.compute_gain_drop(std, 'std'))
+    np.testing.assert_allclose(nsb_rate, calib.compute_nsb_rate(std, 'std'))
+
+
+def test_calibration_constants_blocks_tolerance():
+
+    constants = calib.CalibrationConstants(tolerance=0.05)
+    baseline_shift = np.random.RandomState(1).uniform(0, 50, size=1296)
+    gain_drop, _ = constants.gain_drop_and_nsb(baseline_shift)
+
+    block = np.tile(baseline_shift, (4, 1)) + 0.01
+    block[2, :10] += 1
+    block[3, 20:30] = np.nan
+    block_gain_drop, _ = constants.gain_drop_and_nsb(block)
+
+    np.testing.assert_array_equal(block_gain_drop[:2], [gain_drop] * 2)
+    np.testing.assert_allclose(
+        block_gain_drop[2, :10],
+        calib.compute_gain_drop(block[2, :10], 'mean'))
+    np.testing.assert_array_equal(block_gain_drop[2, 10:], gain_drop[10:])
+    np.testing.assert_allclose(
+        block_gain_drop[3, 20:30],
+        calib.compute_gain_drop(block[3, 20:30], 'mean'))
+
+    # the cache follows the last event of the block
+    new_gain_drop, _ = constants.gain_drop_and_nsb(block[3])
+
+    np.testing.assert_array_equal(new_gain_drop[:20], gain_drop[:20])
+
+
+def test_calibration_constants_timing_mask():
+
+    options = {'mask': None, 'mask_edges': None, 'peak': None,
+               'window_start': 3, 'window_width': 7,
+               'threshold_saturation': np.inf, 'n_samples': 50,
+               'timing_width': 6, 'central_sample': 11}
+
+    constants = calib.CalibrationConstants(time_integration_options=options)
+
+    assert constants.time_integration_options['mask'] is not None
+    assert constants.time_integration_options['mask_edges'] is not None
+    assert constants.gains.shape == (1296, )
+    # the options of the caller are not modified
+    assert options['mask'] is None
+
+    # options attached to constants created without them, as done by
+    # calibrate_to_dl1() with the constants of calibrate_to_r1()
+    constants = calib.CalibrationConstants()
+    constants.time_integration_options = options
+
+    assert constants.time_integration_options['peak'] is not None
@@ -42,3 +42,51 @@ def test_calibration_event_stream():
         assert (values[i][1] == event.digicam_baseline).all()
 
         assert len(values[i][2]) == event.adc_samples.shape[0]
+
+
+def test_calibration_event_stream_pixel_id():
+
+    import numpy as np
+
+    max_events = 10
+    pixel_id = [10, 2, 600]
+    calib_stream = calibration_event_stream(example_file_path,
+                                            pixel_id=pixel_id,
+                                            max_events=max_events)
+    values = []
+
+    for event_calib in calib_stream:
+
+        values.append([
+            event_calib.pixel_id.copy(),
+            event_calib.data.adc_samples.copy(),
+            event_calib.data.digicam_baseline.copy(),
+            ])
+
+    assert len(values) == max_events
+
+    # protozfits reads a single file at a time
+    del calib_stream
+
+    obs_stream = event_stream(example_file_path, max_events=max_events)
+
+    for i, event in enumerate(obs_stream):
+
+        r0 = list(event.r0.tel.values())[0]
+
+        assert (values[i][0] == pixel_id).all()
+        assert (values[i][1] == r0.adc_samples[pixel_id]).all()
+        assert (values[i][2] == r0.digicam_baseline[pixel_id]).all()
+
+    del obs_stream
+
+    # contiguous pixels are not copied
+    calib_stream = calibration_event_stream(example_file_path,
+                                            pixel_id=np.arange(100, 200),
+                                            max_events=1)
+
+    for event_calib in calib_stream:
+
+        adc_samples = event_calib.data.adc_samples
+        assert adc_samples.shape[0] == 100
+        assert adc_samples.base is not None
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+from digicampipe.utils.calibration_store import CalibrationStore
+from digicampipe.utils.calib import CalibrationConstants
+
+
+def test_ingest_and_get(tmpdir):
+
+    fmpe_file = os.path.join(str(tmpdir), 'fmpe_results.npz')
+    crosstalk_file = os.path.join(str(tmpdir), 'crosstalk.npz')
+    np.savez(fmpe_file, gain=np.array([20., 21., np.nan]),
+             gain_error=np.array([0.1, 0.2, 0.3]), sigma_e=np.ones(3),
+             pixel_id=np.array([5, 6, 7]))
+    np.savez(crosstalk_file, np.full(1296, 0.08))
+
+    with CalibrationStore(os.path.join(str(tmpdir), 'db.sqlite')) as store:
+
+        assert store.ingest(fmpe_file, 'DigiCam', valid_from=100) == \
+            {'gain': 2, 'sigma_e': 3}
+        assert store.ingest(crosstalk_file, 'DigiCam', valid_from=100) == \
+            {'crosstalk': 1296}
+        store.insert('DigiCam', 'gain', [5], [30.], valid_from=200,
+                     valid_to=300)
+
+        gain, gain_error = store.get('DigiCam', 'gain', 250, errors=True)
+
+        np.testing.assert_array_equal(gain[4:8], [np.nan, 30, 21, np.nan])
+        np.testing.assert_array_equal(gain_error[4:8],
+                                      [np.nan, np.nan, 0.2, np.nan])
+        np.testing.assert_array_equal(
+            store.get('DigiCam', 'gain', 300)[4:8], [np.nan, 20, 21, np.nan])
+        assert np.isnan(store.get('DigiCam', 'gain', 50)).all()
+        assert (store.get('DigiCam', 'crosstalk', 1000) == 0.08).all()
+        assert np.isnan(store.get('Other', 'crosstalk', 1000)).all()
+        assert store.names('DigiCam') == ['crosstalk', 'gain', 'sigma_e']
+
+        constants = CalibrationConstants.from_store(store, 'DigiCam', 300)
+
+        assert constants.gains[5] == 20
+        assert constants.gains[0] == 23
+
+
+def test_naive_datetime_is_utc():
+
+    from datetime import datetime, timedelta, timezone
+
+    from digicampipe.scripts.calibration_store import convert_date
+
+    naive = datetime(2018, 5, 1, 20)
+    aware = datetime(2018, 5, 1, 22, tzinfo=timezone(timedelta(hours=2)))
+    timestamp = 1525204800.
+
+    with CalibrationStore() as store:
+
+        store.insert('DigiCam', 'gain', [0], [20.], valid_from=naive)
+        store.insert('DigiCam', 'gain', [1], [21.], valid_from=aware)
+
+        gain = store.get('DigiCam', 'gain', timestamp, n_pixels=2)
+        np.testing.assert_array_equal(gain, [20, 21])
+        assert np.isnan(store.get('DigiCam', 'gain', timestamp - 1,
+                                  n_pixels=2)).all()
+        np.testing.assert_array_equal(
+            store.get('DigiCam', 'gain', naive, n_pixels=2), [20, 21])
+
+    assert convert_date('2018-05-01T20:00:00').timestamp() == timestamp
+    assert convert_date('1525204800') == timestamp
+    assert convert_date(None) is None
@@ -0,0 +1,61 @@
+import numpy as np
+
+from digicampipe.io.catalog import CATALOG_COLUMNS, save_catalog, \
+    load_catalog, select_rows
+
+
+def make_columns(n_events_per_file):
+
+    columns = {name: [] for name in CATALOG_COLUMNS}
+
+    for file_id, n_events in enumerate(n_events_per_file):
+
+        columns['file'].append(np.full(n_events, file_id))
+        columns['row'].append(np.arange(n_events))
+
+    columns['file'] = np.concatenate(columns['file'])
+    columns['row'] = np.concatenate(columns['row'])
+    n_events = len(columns['row'])
+
+    for name in CATALOG_COLUMNS:
+
+        if name not in ['file', 'row']:
+
+            columns[name] = np.arange(n_events)
+
+    columns['camera_event_type'] = np.arange(n_events) % 2 * 8
+
+    return columns
+
+
+def test_catalog_save_and_load(tmpdir):
+
+    path = str(tmpdir.join('catalog.hdf5'))
+    files = ['/data/run_000.fits.fz', '/data/run_001.fits.fz']
+    columns = make_columns([10, 5])
+
+    save_catalog(path, files, columns)
+    loaded_files, loaded_columns = load_catalog(path)
+
+    assert loaded_files == files
+
+    for name in CATALOG_COLUMNS:
+
+        np.testing.assert_array_equal(loaded_columns[name], columns[name])
+
+
+def test_select_rows():
+
+    files = ['a.fits.fz', 'b.fits.fz', 'c.fits.fz']
+    columns = make_columns([10, 4, 1])
+
+    rows = select_rows(files, columns)
+    assert list(rows.keys()) == files
+    np.testing.assert_array_equal(rows['b.fits.fz'], np.arange(4))
+
+    rows = select_rows(files, columns,
+                       selection=lambda c: c['camera_event_type'] == 8)
+    # the single event of c is the 15th event and has type 0
+    assert list(rows.keys()) == ['a.fits.fz', 'b.fits.fz']
+    np.testing.assert_array_equal(rows['a.fits.fz'], [1, 3, 5, 7, 9])
+    np.testing.assert_array_equal(rows['b.fits.fz'], [1, 3])
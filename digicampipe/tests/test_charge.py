@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from digicampipe.calib.camera.charge import fit_pulse_template, \
+    compute_charge, compute_amplitude, compute_pulses
+from digicampipe.utils.pulse_template import PulseTemplate
+
+TIME = np.linspace(0, 60, num=121)
+SHAPE = np.exp(-0.5 * ((TIME - 12) / 5.) ** 2)
+
+
+def make_waveforms(template, shape, seed=0):
+
+    random_state = np.random.RandomState(seed)
+    times = random_state.uniform(40, 120, size=shape)
+    amplitudes = random_state.uniform(10, 100, size=shape)
+    t = np.arange(50) * 4
+    pixel_id = np.broadcast_to(np.arange(shape[-1]), shape)[..., np.newaxis]
+    pixel_id = None if template.n_pixels is None else pixel_id
+    waveforms = amplitudes[..., np.newaxis] * template(
+        t - times[..., np.newaxis], pixel_id=pixel_id) + 10
+    waveforms += random_state.normal(0, 0.5, size=waveforms.shape)
+    pulse_mask = np.zeros(waveforms.shape, dtype=bool)
+    index = np.indices(shape)
+    pulse_mask[tuple(index) + (np.argmax(waveforms, axis=-1), )] = True
+
+    return times, amplitudes, waveforms, pulse_mask
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_fit_pulse_template(use_numba):
+
+    template = PulseTemplate(TIME, SHAPE)
+    times, amplitudes, waveforms, pulse_mask = make_waveforms(template,
+                                                              (3, 200))
+    pulse_positions = np.nonzero(pulse_mask)
+
+    amplitude, time, baseline, chi2 = fit_pulse_template(
+        waveforms, pulse_positions, template=template, use_numba=use_numba)
+
+    np.testing.assert_allclose(amplitude, amplitudes.ravel(), atol=1.5)
+    np.testing.assert_allclose(time, times.ravel(), atol=1)
+    np.testing.assert_allclose(baseline, 10, atol=1)
+    assert np.all(chi2 < 50)
+
+
+def test_fit_pulse_template_per_pixel():
+
+    shapes = np.array([SHAPE, np.exp(-0.5 * ((TIME - 12) / 8.) ** 2)])
+    template = PulseTemplate(TIME, shapes)
+    times, amplitudes, waveforms, pulse_mask = make_waveforms(template,
+                                                              (100, 2))
+    pulse_positions = np.nonzero(pulse_mask)
+
+    fast = fit_pulse_template(waveforms, pulse_positions, template=template)
+    slow = fit_pulse_template(waveforms, pulse_positions, template=template,
+                              use_numba=False)
+
+    for a, b in zip(fast, slow):
+
+        np.testing.assert_allclose(a, b, rtol=1e-6, atol=1e-6)
+
+    np.testing.assert_allclose(fast[0], amplitudes.ravel(), atol=1.5)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_fit_pulse_template_pixel_subset(use_numba):
+
+    pixel_id = np.array([100, 200])
+    widths = np.full(300, 5.)
+    widths[pixel_id] = [3., 8.]
+    shapes = np.exp(-0.5 * ((TIME - 12) / widths[:, np.newaxis]) ** 2)
+    template = PulseTemplate(TIME, shapes)
+    subset = PulseTemplate(TIME, shapes[pixel_id])
+    times, amplitudes, waveforms, pulse_mask = make_waveforms(subset,
+                                                              (100, 2))
+    pulse_positions = np.nonzero(pulse_mask)
+
+    expected = fit_pulse_template(waveforms, pulse_positions,
+                                  template=subset, use_numba=use_numba)
+    result = fit_pulse_template(waveforms, pulse_positions,
+                                template=template, use_numba=use_numba,
+                                pixel_id=pixel_id)
+
+    for a, b in zip(result, expected):
+
+        np.testing.assert_allclose(a, b, rtol=1e-6, atol=1e-6)
+
+    np.testing.assert_allclose(result[0], amplitudes.ravel(), atol=2)
+    # the rows 0 and 1 of the template have a different width
+    rows = fit_pulse_template(waveforms, pulse_positions, template=template,
+                              use_numba=use_numba)
+    assert not np.allclose(rows[3], expected[3])
+
+    events = compute_pulses([SimpleNamespace(
+        data=SimpleNamespace(adc_samples=waveforms[0],
+                             pulse_mask=pulse_mask[0]),
+        pixel_id=pixel_id)], 7, template=template)
+    pulses = next(events).data.pulses
+
+    np.testing.assert_array_equal(pulses['pixel'], [0, 1])
+    np.testing.assert_allclose(pulses['amplitude'], expected[0][:2],
+                               rtol=1e-6)
+
+
+def make_events(shape, edges, n_events=3, seed=0):
+
+    random_state = np.random.RandomState(seed)
+
+    for _ in range(n_events):
+
+        adc_samples = random_state.normal(0, 10, size=shape + (50, ))
+        pulse_mask = random_state.uniform(size=adc_samples.shape) < 0.1
+        # with a shift, the pulses at the edges are wrapped around
+        pulse_mask[..., :4] = False
+        pulse_mask[..., -4:] = False
+        pulse_mask[..., 0] = edges
+        pulse_mask[..., -1] = edges
+        data = SimpleNamespace(adc_samples=adc_samples,
+                               pulse_mask=pulse_mask)
+
+        yield SimpleNamespace(data=data)
+
+
+@pytest.mark.parametrize('shape', [(20, ), (4, 20)])
+@pytest.mark.parametrize('shift', [0, 2, -3])
+def test_compute_pulses_as_dense(shape, shift):
+
+    edges = shift == 0
+    dense = compute_amplitude(compute_charge(make_events(shape, edges), 7,
+                                             shift))
+    sparse = compute_pulses(make_events(shape, edges), 7, shift)
+
+    for expected, event in zip(dense, sparse):
+
+        pulses = event.data.pulses
+        mask = expected.data.pulse_mask
+        index = (pulses['pixel'], pulses['sample']) if mask.ndim == 2 else \
+            (pulses['event'], pulses['pixel'], pulses['sample'])
+
+        assert len(pulses) == np.count_nonzero(mask)
+        assert mask[index].all()
+        np.testing.assert_allclose(
+            pulses['charge'], expected.data.reconstructed_charge[index])
+        np.testing.assert_allclose(
+            pulses['amplitude'], expected.data.reconstructed_amplitude[index])
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from digicampipe.image import cleaning
+
+
+def make_geometry(n_rows=20, n_columns=20):
+
+    row, column = np.meshgrid(np.arange(n_rows), np.arange(n_columns),
+                              indexing='ij')
+    x = (column + 0.5 * (row % 2)).ravel()
+    y = (row * np.sqrt(3) / 2).ravel()
+    points = np.column_stack([x, y])
+    neighbors = cKDTree(points).query_ball_point(points, r=1.1)
+    neighbors = [[j for j in pixels if j != i]
+                 for i, pixels in enumerate(neighbors)]
+
+    return SimpleNamespace(neighbors=neighbors, pix_x=x, pix_y=y)
+
+
+def make_images(n_pixels, n_images=10, seed=0):
+
+    random_state = np.random.RandomState(seed)
+
+    return random_state.exponential(3, size=(n_images, n_pixels))
+
+
+def dense_tailcuts(image, neighbor_matrix, picture, boundary):
+
+    above_picture = image >= picture
+    above_boundary = image >= boundary
+    with_picture = (above_picture & neighbor_matrix).any(axis=1)
+    with_boundary = (above_boundary & neighbor_matrix).any(axis=1)
+
+    return (above_boundary & with_picture) | (above_picture & with_boundary)
+
+
+def recursive_dilation(image, mask, neighbor_matrix, threshold):
+
+    mask = mask.copy()
+    pixel_id = np.arange(len(mask))
+    recursion = True
+
+    while recursion:
+        recursion = False
+        for i in pixel_id[mask]:
+            for j in pixel_id[neighbor_matrix[i] & (~mask)]:
+                if image[j] > threshold:
+                    mask[j] = True
+                    recursion = True
+
+    return mask
+
+
+def test_cleaning_as_loops():
+
+    geom = make_geometry()
+    neighbors = cleaning.neighbor_matrix_sparse(geom)
+    neighbor_matrix = neighbors.toarray() > 0
+    images = make_images(len(geom.neighbors))
+
+    assert cleaning.neighbor_matrix_sparse(geom) is neighbors
+
+    masks = cleaning.tailcuts(images, neighbors, 7, 4)
+    dilated = cleaning.dilate(masks, neighbors, image=images, threshold=4)
+    border = cleaning.on_border(dilated, neighbors)
+
+    for image, mask, dilated_mask, on_border in zip(images, masks, dilated,
+                                                    border):
+
+        expected = dense_tailcuts(image, neighbor_matrix, 7, 4)
+        np.testing.assert_array_equal(mask, expected)
+        expected = recursive_dilation(image, expected, neighbor_matrix, 4)
+        np.testing.assert_array_equal(dilated_mask, expected)
+        n_neighbors = np.sum(neighbor_matrix[expected], axis=-1)
+        assert on_border == np.any(n_neighbors < 6)
+
+
+def test_islands():
+
+    geom = make_geometry(10, 10)
+    neighbors = cleaning.neighbor_matrix_sparse(geom)
+    mask = np.zeros((2, 100), dtype=bool)
+    # two islands in the first image, one in the second
+    mask[0, [0, 1, 2]] = True
+    mask[0, [55, 56]] = True
+    mask[1, [33]] = True
+    image = np.ones(mask.shape)
+    image[0, 55] = 10
+
+    n_islands, labels = cleaning.label_islands(mask, neighbors)
+
+    np.testing.assert_array_equal(n_islands, [2, 1])
+    assert (labels[~mask] == 0).all()
+    assert len(set(labels[0, [0, 1, 2]])) == 1
+    assert set(labels[0, [0, 1, 2, 55, 56]]) == {1, 2}
+    assert labels[1, 33] == 1
+
+    largest = cleaning.largest_island(labels)
+    np.testing.assert_array_equal(np.nonzero(largest[0])[0], [0, 1, 2])
+    largest = cleaning.largest_island(labels, image=image)
+    np.testing.assert_array_equal(np.nonzero(largest[0])[0], [55, 56])
+    np.testing.assert_array_equal(np.nonzero(largest[1])[0], [33])
+
+
+def test_time_constrained():
+
+    geom = make_geometry(10, 10)
+    neighbors = cleaning.neighbor_matrix_sparse(geom)
+    mask = np.zeros(100, dtype=bool)
+    mask[[0, 1, 2]] = True
+    time = np.zeros(100)
+    time[2] = 20
+
+    cleaned = cleaning.time_constrained(mask, neighbors, time,
+                                        max_time_difference=5)
+
+    np.testing.assert_array_equal(np.nonzero(cleaned)[0], [0, 1])
@@ -52,3 +52,40 @@ def test_tel_with_data():
     for event in event_stream(example_file_path):
 
         assert TEL_WITH_DATA in event.r0.tels_with_data
+
+
+def test_pixel_id():
+
+    pixel_id = [10, 3, 4, 5]
+    events = digicamtoy_event_source(example_file_path, max_events=10)
+    expected = [event.r0.tel[TEL_WITH_DATA].adc_samples[pixel_id]
+                for event in events]
+    events = digicamtoy_event_source(example_file_path, max_events=10,
+                                     pixel_id=pixel_id)
+
+    for i, event in enumerate(events):
+
+        r0 = event.r0.tel[TEL_WITH_DATA]
+        assert (r0.pixel_id == pixel_id).all()
+        assert (r0.adc_samples == expected[i]).all()
+
+
+def test_batch_size():
+
+    events = digicamtoy_event_source(example_file_path, max_events=10)
+    expected = [event.r0.tel[TEL_WITH_DATA].adc_samples.copy()
+                for event in events]
+    events = digicamtoy_event_source(example_file_path, max_events=10,
+                                     batch_size=4)
+    n_events = 0
+
+    for event in events:
+
+        adc_samples = event.r0.tel[TEL_WITH_DATA].adc_samples
+
+        for i, event_id in enumerate(event.r0.event_id):
+
+            assert (adc_samples[i] == expected[event_id]).all()
+            n_events += 1
+
+    assert n_events == 10
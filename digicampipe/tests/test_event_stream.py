@@ -1,6 +1,7 @@
 from digicampipe.io.event_stream import event_stream
 import pkg_resources
 import os
+import pytest
 
 from cts_core.camera import Camera
 from digicampipe.utils import geometry
@@ -52,3 +53,81 @@ def test_event_source_speed_100_events(benchmark):
             pass
 
         assert i == 99
+
+
+def test_event_stream_batch_size():
+
+    batch_size = 30
+    adc_samples = []
+    local_camera_clock = []
+
+    for event in event_stream(example_file_path):
+
+        r0_camera = list(event.r0.tel.values())[0]
+        adc_samples.append(r0_camera.adc_samples.copy())
+        local_camera_clock.append(r0_camera.local_camera_clock)
+
+    n_events = len(adc_samples)
+    n_batches = 0
+
+    for batch in event_stream(example_file_path, batch_size=batch_size):
+
+        r0_camera = list(batch.r0.tel.values())[0]
+        start = n_batches * batch_size
+        end = min(start + batch_size, n_events)
+
+        assert r0_camera.adc_samples.shape[0] == end - start
+        assert (r0_camera.adc_samples == adc_samples[start:end]).all()
+        assert (r0_camera.local_camera_clock ==
+                local_camera_clock[start:end]).all()
+
+        n_batches += 1
+
+    assert n_batches == -(-n_events // batch_size)
+
+
+def _camera_event_numbers(events):
+
+    for event in events:
+
+        yield list(event.r0.tel.values())[0].camera_event_number
+
+
+def test_event_stream_n_workers():
+
+    files = [example_file_path] * 3
+    serial = list(_camera_event_numbers(event_stream(files)))
+    parallel = list(event_stream(files, n_workers=2,
+                                 pipeline=_camera_event_numbers))
+
+    assert parallel == serial
+
+    merged = list(event_stream(files, n_workers=3,
+                               pipeline=_camera_event_numbers,
+                               sort_key=lambda number: number))
+
+    assert merged == sorted(serial)
+
+    # the merge needs a worker per file
+    with pytest.raises(ValueError):
+
+        list(event_stream(files, n_workers=2, pipeline=_camera_event_numbers,
+                          sort_key=lambda number: number))
+
+
+def test_event_stream_n_workers_chunks():
+
+    files = [example_file_path] * 3
+    serial = list(_camera_event_numbers(event_stream(files)))
+    parallel = list(event_stream(files, n_workers=2,
+                                 pipeline=_camera_event_numbers,
+                                 chunk_size=3, n_chunks=1))
+
+    assert parallel == serial
+
+    # the workers are stopped before the end of the files
+    first = list(event_stream(files, n_workers=2,
+                              pipeline=_camera_event_numbers,
+                              chunk_size=3, max_events=5))
+
+    assert first == serial[:5]
@@ -1,6 +1,12 @@
+import os
+
 from histogram.histogram import Histogram1D
 from digicampipe.io.containers_calib import CalibrationHistogramContainer
+from digicampipe.utils.hist1d import fill_sparse, save_histogram, \
+    load_histogram, HistogramFile, merge_histogram_files, compute_sharded, \
+    shard_filename
 import numpy as np
+import pytest
 
 
 def test_container_to_histogram():
@@ -27,3 +33,233 @@ def test_container_to_histogram():
         else:
 
             assert (val == getattr(histo, key)), '{} not equal'.format(key)
+
+
+def test_fill_sparse_as_dense():
+
+    random_state = np.random.RandomState(0)
+    bins = np.arange(-10, 11)
+    dense = Histogram1D(bin_edges=bins, data_shape=(5, ))
+    sparse = Histogram1D(bin_edges=bins, data_shape=(5, ))
+
+    for i in range(10):
+
+        values = np.full((5, 30), np.nan)
+        mask = random_state.uniform(size=values.shape) < 0.3
+        values[mask] = random_state.normal(0, 6, size=mask.sum())
+        dense.fill(values)
+        pixel, _ = np.nonzero(mask)
+        fill_sparse(sparse, pixel, values[mask])
+
+    np.testing.assert_array_equal(sparse.data, dense.data)
+    np.testing.assert_array_equal(sparse.underflow, dense.underflow)
+    np.testing.assert_array_equal(sparse.overflow, dense.overflow)
+
+
+def _random_histogram(random_state, data_shape=(20, )):
+
+    histo = Histogram1D(bin_edges=np.arange(-1000, 1000),
+                        data_shape=data_shape, axis_name='[LSB]')
+    values = random_state.normal(0, 300, size=data_shape + (500, ))
+    histo.fill(values)
+
+    return histo
+
+
+def test_save_load_histogram(tmpdir):
+
+    random_state = np.random.RandomState(0)
+    histo = _random_histogram(random_state)
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    save_histogram(histo, filename)
+    loaded = load_histogram(filename)
+
+    for name in ['bins', 'data', 'underflow', 'overflow', 'max', 'min']:
+
+        np.testing.assert_array_equal(getattr(loaded, name),
+                                      getattr(histo, name))
+
+    assert loaded.data.dtype == histo.data.dtype
+    assert loaded.axis_name == histo.axis_name
+    # only the non empty bins are stored
+    assert os.path.getsize(filename) < histo.data.nbytes / 4
+
+
+def test_histogram_file_pixels(tmpdir):
+
+    random_state = np.random.RandomState(1)
+    histo = _random_histogram(random_state)
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    save_histogram(histo, filename)
+    index = [3, 0, 17]
+
+    with HistogramFile(filename) as histo_file:
+
+        assert len(histo_file) == 20
+        np.testing.assert_array_equal(histo_file.counts(5), histo.data[5])
+        subset = histo_file.histogram(index)
+
+    np.testing.assert_array_equal(subset.data, histo.data[index])
+    np.testing.assert_array_equal(subset.overflow, histo.overflow[index])
+    np.testing.assert_array_equal(subset.mode(), histo.mode()[index])
+
+
+def test_load_pickled_histogram(tmpdir):
+
+    random_state = np.random.RandomState(2)
+    histo = _random_histogram(random_state)
+    histo.save(os.path.join(str(tmpdir), 'histo.pk'))
+
+    # the '.h5' file does not exist, the '.pk' file is read instead
+    loaded = load_histogram(os.path.join(str(tmpdir), 'histo.h5'), index=[4])
+
+    np.testing.assert_array_equal(loaded.data[0], histo.data[4])
+
+
+def _sum_histograms(histograms):
+
+    total = _random_histogram(np.random.RandomState(0))
+    total.data[:] = 0
+    total.underflow[:] = 0
+    total.overflow[:] = 0
+
+    for histo in histograms:
+
+        total.data += histo.data
+        total.underflow += histo.underflow
+        total.overflow += histo.overflow
+
+    return total
+
+
+def test_merge_histogram_files(tmpdir):
+
+    histograms = [_random_histogram(np.random.RandomState(i))
+                  for i in range(3)]
+    shards = [os.path.join(str(tmpdir), 'histo_{}.h5'.format(i))
+              for i in range(3)]
+
+    for histo, shard in zip(histograms, shards):
+
+        save_histogram(histo, shard)
+
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    merged = merge_histogram_files(filename, shards)
+    loaded = load_histogram(filename)
+    expected = _sum_histograms(histograms)
+
+    assert merged == shards
+    np.testing.assert_array_equal(loaded.data, expected.data)
+    np.testing.assert_array_equal(loaded.underflow, expected.underflow)
+    np.testing.assert_array_equal(loaded.overflow, expected.overflow)
+    np.testing.assert_array_equal(
+        loaded.max, np.max([histo.max for histo in histograms], axis=0))
+    np.testing.assert_array_equal(
+        loaded.min, np.min([histo.min for histo in histograms], axis=0))
+
+
+def test_merge_histogram_files_bins(tmpdir):
+
+    histo = _random_histogram(np.random.RandomState(0))
+    other = Histogram1D(bin_edges=np.arange(-1000, 1000, 2),
+                        data_shape=(20, ))
+    shards = [os.path.join(str(tmpdir), 'histo_{}.h5'.format(i))
+              for i in range(2)]
+    save_histogram(histo, shards[0])
+    save_histogram(other, shards[1])
+
+    with pytest.raises(ValueError):
+
+        merge_histogram_files(os.path.join(str(tmpdir), 'histo.h5'), shards)
+
+
+def test_merge_histogram_files_update(tmpdir):
+
+    histograms = [_random_histogram(np.random.RandomState(i))
+                  for i in range(3)]
+    shards = [os.path.join(str(tmpdir), 'histo_{}.h5'.format(i))
+              for i in range(3)]
+
+    for histo, shard in zip(histograms, shards):
+
+        save_histogram(histo, shard)
+
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    merge_histogram_files(filename, shards[:2])
+    # the shards already summed are skipped
+    merged = merge_histogram_files(filename, shards, update=True)
+
+    assert merged == shards[2:]
+    np.testing.assert_array_equal(load_histogram(filename).data,
+                                  _sum_histograms(histograms).data)
+
+    # a merged file is a shard of a larger merge
+    other = os.path.join(str(tmpdir), 'other.h5')
+    save_histogram(histograms[0], other)
+    total = os.path.join(str(tmpdir), 'total.h5')
+    merge_histogram_files(total, [filename, other])
+
+    assert merge_histogram_files(total, [shards[1]], update=True) == []
+
+    # a shard partly summed cannot be added
+    another = os.path.join(str(tmpdir), 'another.h5')
+    save_histogram(histograms[1], another)
+    partly = os.path.join(str(tmpdir), 'partly.h5')
+    merge_histogram_files(partly, [shards[2], another])
+
+    with pytest.raises(ValueError):
+
+        merge_histogram_files(total, [partly], update=True)
+
+
+def _compute_toy_shard(source, shard):
+
+    seed = int(os.path.basename(source).split('.')[0].split('_')[1])
+    save_histogram(_random_histogram(np.random.RandomState(seed)), shard)
+
+
+def test_compute_sharded(tmpdir):
+
+    sources = [os.path.join('run', 'file_{}.fits.fz'.format(i))
+               for i in range(4)]
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    shards = compute_sharded(_compute_toy_shard, sources[:3], [filename])
+
+    assert shards == [[shard_filename(filename, source)
+                       for source in sources[:3]]]
+    assert all(os.path.exists(shard) for shard in shards[0])
+
+    # a new input file is added to the histogram
+    compute_sharded(_compute_toy_shard, sources, [filename], n_workers=2)
+    expected = _sum_histograms([_random_histogram(np.random.RandomState(i))
+                                for i in range(4)])
+
+    np.testing.assert_array_equal(load_histogram(filename).data,
+                                  expected.data)
+
+
+def test_shard_filename():
+
+    shard = shard_filename(os.path.join('output', 'raw_histo.h5'),
+                           os.path.join('night_1', 'run_1.fits.fz'))
+
+    assert shard.startswith(os.path.join('output', 'raw_histo.run_1.fits.fz.'))
+    assert shard.endswith('.h5')
+    # input files of the same name in other directories
+    assert shard != shard_filename(os.path.join('output', 'raw_histo.h5'),
+                                   os.path.join('night_2', 'run_1.fits.fz'))
+
+
+def test_compute_sharded_unsharded_output(tmpdir):
+
+    filename = os.path.join(str(tmpdir), 'histo.h5')
+    # computed without shards, it may already count the input files
+    save_histogram(_random_histogram(np.random.RandomState(0)), filename)
+
+    with pytest.raises(ValueError):
+
+        compute_sharded(_compute_toy_shard, ['file_0.fits.fz'], [filename])
+
+    np.testing.assert_array_equal(
+        load_histogram(filename).data,
+        _random_histogram(np.random.RandomState(0)).data)
@@ -0,0 +1,84 @@
+import numpy as np
+
+from digicampipe.utils.pdf import fmpe_pdf_10, fmpe_pdf_batch, \
+    fmpe_parameter_names
+from digicampipe.utils.least_squares import fit_least_squares
+
+X = np.arange(-10, 120, 1.)
+
+
+def _params(n_pixels, n_peaks=6, seed=0):
+
+    random_state = np.random.RandomState(seed)
+    params = np.zeros((n_pixels, 4 + n_peaks))
+    params[:, 0] = random_state.uniform(-1, 1, size=n_pixels)
+    params[:, 1] = random_state.uniform(18, 22, size=n_pixels)
+    params[:, 2] = random_state.uniform(1.5, 2.5, size=n_pixels)
+    params[:, 3] = random_state.uniform(0.5, 1, size=n_pixels)
+    params[:, 4:] = 5000 * np.exp(-np.arange(n_peaks) / 2)
+
+    return params
+
+
+def test_fmpe_pdf_batch():
+
+    params = _params(3, n_peaks=10)
+    pdf = fmpe_pdf_batch(X, params, bin_width=1)
+
+    for i in range(len(params)):
+
+        kwargs = dict(zip(fmpe_parameter_names(10), params[i]))
+        np.testing.assert_allclose(pdf[i], fmpe_pdf_10(X, bin_width=1,
+                                                       **kwargs))
+
+
+def test_fmpe_pdf_batch_jacobian():
+
+    params = _params(3)
+    _, jacobian = fmpe_pdf_batch(X, params, bin_width=1, jacobian=True)
+    step = 1e-6
+
+    for i in range(params.shape[-1]):
+
+        delta = np.zeros(params.shape)
+        delta[:, i] = step
+        derivative = fmpe_pdf_batch(X, params + delta, bin_width=1) - \
+            fmpe_pdf_batch(X, params - delta, bin_width=1)
+        derivative /= 2 * step
+
+        np.testing.assert_allclose(jacobian[..., i], derivative, rtol=1e-4,
+                                   atol=1e-6)
+
+
+def test_fit_least_squares_fmpe():
+
+    true_params = _params(50)
+    random_state = np.random.RandomState(1)
+    y = random_state.poisson(fmpe_pdf_batch(X, true_params, bin_width=1))
+    y_err = np.sqrt(y)
+    init_params = true_params * random_state.uniform(0.95, 1.05,
+                                                     true_params.shape)
+    init_params[:, 0] = true_params[:, 0] + 0.3
+    init_params[:, 1] = true_params[:, 1] * 1.01
+    init_params[10] = np.nan
+
+    def pdf(x, params, jacobian=False):
+
+        return fmpe_pdf_batch(x, params, bin_width=1, jacobian=jacobian)
+
+    fixed = np.zeros(true_params.shape, dtype=bool)
+    fixed[:, -1] = True
+    init_params[:, -1] = true_params[:, -1]
+    params, errors, chi_2, ndf = fit_least_squares(pdf, X, y, y_err,
+                                                   init_params, fixed=fixed)
+
+    assert np.isnan(chi_2[10]) and np.isnan(errors[10]).all()
+    assert (np.delete(errors, 10, axis=0)[:, -1] == 0).all()
+
+    params, errors, chi_2, ndf = [np.delete(a, 10, axis=0) for a in
+                                  (params, errors, chi_2, ndf)]
+    true_params = np.delete(true_params, 10, axis=0)
+    pull = (params - true_params)[:, :4] / errors[:, :4]
+
+    assert (np.abs(pull) < 5).all()
+    assert np.abs(np.median(chi_2 / ndf) - 1) < 0.2
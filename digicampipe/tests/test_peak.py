@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks_cwt
+
+from digicampipe.calib.camera.peak import find_peaks_cwt_mask, TemplateBank
+from digicampipe.utils.pulse_template import default_template
+
+
+def make_waveforms(n_waveforms=200, n_samples=50, seed=0):
+
+    random_state = np.random.RandomState(seed)
+    t = np.arange(n_samples)
+    waveforms = random_state.normal(0, 2, size=(n_waveforms, n_samples))
+
+    for waveform in waveforms:
+
+        for _ in range(random_state.randint(0, 4)):
+
+            time = random_state.uniform(0, n_samples)
+            amplitude = random_state.uniform(5, 40)
+            waveform += amplitude * np.exp(-0.5 * ((t - time) / 2.5) ** 2)
+
+    return waveforms
+
+
+def test_find_peaks_cwt_mask_as_scipy():
+
+    widths = [4, 5, 6]
+    waveforms = make_waveforms()
+    expected = np.zeros(waveforms.shape, dtype=bool)
+
+    for i, waveform in enumerate(waveforms):
+
+        expected[i, find_peaks_cwt(waveform, widths)] = True
+
+    mask = find_peaks_cwt_mask(waveforms, widths)
+
+    assert mask.shape == waveforms.shape
+    # the ridges are linked slightly differently than in scipy
+    assert np.sum(mask != expected) <= 0.01 * np.sum(expected)
+
+
+def test_find_peaks_cwt_mask_blocks():
+
+    widths = [4, 5, 6]
+    waveforms = make_waveforms().reshape(4, 50, -1)
+    mask = find_peaks_cwt_mask(waveforms, widths)
+
+    for waveform, expected in zip(waveforms, mask):
+
+        assert (find_peaks_cwt_mask(waveform, widths) == expected).all()
+
+
+@pytest.mark.parametrize('widths', [(1., ), (0.8, 1., 1.5)])
+def test_template_bank(widths):
+
+    bank = TemplateBank(widths=widths)
+    waveforms = make_waveforms().reshape(4, 50, -1)
+    fft = bank.correlate(waveforms, method='fft')
+    direct = bank.correlate(waveforms, method='direct')
+
+    assert fft.shape == (len(widths), ) + waveforms.shape
+    np.testing.assert_allclose(fft, direct, atol=1e-10)
+
+    length = bank.kernels.shape[-1]
+    padded = np.concatenate([np.zeros(bank.offset), waveforms[1, 2],
+                             np.zeros(length - 1 - bank.offset)])
+
+    for kernel, output in zip(bank.kernels, direct):
+
+        expected = [np.dot(padded[t:t + length], kernel)
+                    for t in range(waveforms.shape[-1])]
+        np.testing.assert_allclose(output[1, 2], expected, atol=1e-10)
+
+
+def test_template_bank_peaks_at_pulse_maximum():
+
+    template = default_template()
+    bank = TemplateBank()
+    t = np.arange(50) * 4
+    waveform = template(t - 80)
+
+    output = bank.correlate(waveform)[0]
+
+    assert np.argmax(output) == np.argmax(waveform)
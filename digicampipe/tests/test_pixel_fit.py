@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+from digicampipe.utils.pixel_fit import fit_pixels, FitCheckpoint, \
+    code_digest
+
+
+_calls = []
+
+
+def _fit_line(x, y):
+
+    _calls.append(y[1] - y[0])
+
+    if np.all(y == 0):
+
+        raise ValueError('Empty histogram')
+
+    slope, intercept = np.polyfit(x, y, deg=1)
+
+    return {'slope': slope, 'intercept': intercept, 'x': x}
+
+
+def _arguments(n_pixels):
+
+    x = np.arange(10.)
+
+    return [(x, (i + 1) * x + i) for i in range(n_pixels)]
+
+
+def test_fit_pixels():
+
+    pixel_id = np.arange(5) * 2
+    arguments = _arguments(len(pixel_id))
+    arguments[3] = (arguments[3][0], np.zeros(10))
+
+    results = fit_pixels(_fit_line, pixel_id, arguments)
+
+    assert list(results.keys()) == list(pixel_id)
+    assert results[6] is None
+
+    for i, pixel in enumerate(pixel_id):
+
+        if pixel != 6:
+
+            assert np.isclose(results[pixel]['slope'], i + 1)
+            assert np.isclose(results[pixel]['intercept'], i)
+
+
+def test_fit_pixels_workers(tmpdir):
+
+    pixel_id = np.arange(20)
+    arguments = _arguments(len(pixel_id))
+    checkpoint = os.path.join(str(tmpdir), 'fit.checkpoint')
+
+    results = fit_pixels(_fit_line, pixel_id, arguments, n_workers=2,
+                         checkpoint=checkpoint)
+    expected = fit_pixels(_fit_line, pixel_id, arguments)
+
+    for pixel in pixel_id:
+
+        assert np.isclose(results[pixel]['slope'], expected[pixel]['slope'])
+        assert results[pixel]['x'] == list(range(10))
+
+
+def test_fit_pixels_resume(tmpdir):
+
+    pixel_id = np.arange(6)
+    arguments = _arguments(len(pixel_id))
+    checkpoint = os.path.join(str(tmpdir), 'fit.checkpoint')
+
+    failing = list(arguments)
+    failing[2] = (failing[2][0], np.zeros(10))
+    results = fit_pixels(_fit_line, pixel_id[:4], failing[:4],
+                         checkpoint=checkpoint, key=1)
+
+    assert results[2] is None
+    assert FitCheckpoint(checkpoint, key=(1, code_digest(_fit_line))
+                         ).errors.keys() == {2}
+
+    _calls.clear()
+    results = fit_pixels(_fit_line, pixel_id, arguments,
+                         checkpoint=checkpoint, key=1)
+
+    # only the failed and the missing pixels are fitted again
+    assert _calls == [3, 5, 6]
+    assert all(results[pixel] is not None for pixel in pixel_id)
+    assert FitCheckpoint(checkpoint, key=(1, code_digest(_fit_line))).errors \
+        == {}
+
+    # the pixels whose arguments changed are fitted again
+    _calls.clear()
+    changed = list(arguments)
+    changed[4] = (changed[4][0], changed[4][1] * 2)
+    results = fit_pixels(_fit_line, pixel_id, changed, checkpoint=checkpoint,
+                         key=1)
+
+    assert _calls == [10]
+    assert np.isclose(results[4]['slope'], 10)
+
+    # another key discards the checkpoint
+    _calls.clear()
+    fit_pixels(_fit_line, pixel_id, arguments, checkpoint=checkpoint, key=2)
+
+    assert len(_calls) == len(pixel_id)
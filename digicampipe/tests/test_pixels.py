@@ -0,0 +1,33 @@
+import numpy as np
+
+from digicampipe.io.pixels import pixel_index
+
+
+def test_pixel_index_all():
+
+    assert pixel_index(None, 10) == (None, None)
+    assert pixel_index([...], 10) == (None, None)
+    assert pixel_index(np.arange(10), 10) == (None, None)
+
+
+def test_pixel_index_slice():
+
+    index, pixel_id = pixel_index([4, 6, 8], 10)
+
+    assert index == slice(4, 9, 2)
+    np.testing.assert_array_equal(pixel_id, [4, 6, 8])
+
+    index, pixel_id = pixel_index([7, 2, 3], 10)
+
+    np.testing.assert_array_equal(index, [7, 2, 3])
+    np.testing.assert_array_equal(pixel_id, [7, 2, 3])
+
+
+def test_pixel_index_scalar():
+
+    index, pixel_id = pixel_index(np.int64(3), 10)
+    samples = np.arange(10 * 4).reshape(10, 4)
+
+    # the pixel axis is kept
+    assert samples[index].shape == (1, 4)
+    np.testing.assert_array_equal(pixel_id, [3])
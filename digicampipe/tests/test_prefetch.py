@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from digicampipe.io.prefetch import Prefetcher
+
+
+def test_prefetcher_keeps_order():
+
+    items = list(range(100))
+    prefetcher = Prefetcher(items, queue_size=3)
+
+    assert list(prefetcher) == items
+    assert prefetcher.n_items == len(items)
+
+
+def test_prefetcher_max_bytes():
+
+    arrays = [np.zeros(1000) for _ in range(20)]
+    max_bytes = 3 * arrays[0].nbytes
+    prefetcher = Prefetcher(arrays, queue_size=10, max_bytes=max_bytes)
+
+    for _ in prefetcher:
+
+        pass
+
+    assert prefetcher.max_queued_bytes <= max_bytes
+
+
+def test_prefetcher_forwards_exception():
+
+    def generator():
+
+        yield 1
+        raise IOError('corrupted file')
+
+    prefetcher = Prefetcher(generator())
+
+    assert next(prefetcher) == 1
+
+    with pytest.raises(IOError):
+
+        next(prefetcher)
+
+
+def test_prefetcher_close():
+
+    prefetcher = Prefetcher(iter(range(1000)), queue_size=2)
+    next(prefetcher)
+    prefetcher.close()
+    prefetcher._thread.join(timeout=1)
+
+    assert not prefetcher._thread.is_alive()
@@ -0,0 +1,58 @@
+import numpy as np
+import h5py
+from scipy.interpolate import interp1d
+
+from digicampipe.utils.utils import TEMPLATE
+from digicampipe.utils.pulse_template import PulseTemplate, default_template
+
+
+def test_pulse_template_as_file():
+
+    time, amplitude = np.loadtxt(TEMPLATE, unpack=True, skiprows=1)
+    expected = interp1d(time, amplitude, kind='cubic', bounds_error=False,
+                        fill_value=0., assume_sorted=True)
+    template = default_template()
+    t = np.linspace(-10, 120, num=1000)
+
+    assert default_template() is template
+    np.testing.assert_allclose(template(t), expected(t), atol=1e-4)
+    np.testing.assert_allclose(template(t, kind='cubic'), expected(t),
+                               atol=1e-10)
+
+    derivative = (expected(t + 1e-4) - expected(t - 1e-4)) / 2e-4
+    inside = (t > time[0] + 0.5) & (t < time[-1] - 0.5)
+    np.testing.assert_allclose(template.derivative(t)[inside],
+                               derivative[inside], atol=1e-3)
+
+
+def test_pulse_template_per_pixel(tmpdir):
+
+    # histograms as written by digicam-template
+    n_pixels = 3
+    extent = [-10, 40, -0.2, 1.5]
+    time_bins = np.linspace(-10, 40, num=102)
+    amplitude_bins = np.linspace(-0.2, 1.5, num=102)
+    time = 0.5 * (time_bins[1:] + time_bins[:-1])
+    shape = np.exp(-0.5 * (time / 5) ** 2)
+    histo = np.zeros((n_pixels, 101, 101))
+
+    for pixel in range(n_pixels):
+
+        amplitude = shape * (pixel + 1) / n_pixels
+        bins = np.digitize(amplitude, amplitude_bins) - 1
+        histo[pixel, np.arange(101), bins] = 10
+
+    path = str(tmpdir.join('template.h5'))
+
+    with h5py.File(path, 'w') as f:
+
+        dataset = f.create_dataset('adc_count_histo', data=histo)
+        dataset.attrs['extent'] = extent
+
+    template = PulseTemplate.from_histogram(path)
+
+    assert template.n_pixels == n_pixels
+
+    values = template(np.zeros(n_pixels), pixel_id=np.arange(n_pixels))
+    np.testing.assert_allclose(values, 1, atol=0.05)
+    assert template(100, pixel_id=0) == 0
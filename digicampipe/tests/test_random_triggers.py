@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from digicampipe.calib.camera.random_triggers import RunningBaseline, \
+    extract_baseline
+
+
+def window_means(adc_samples, n_events):
+
+    means = [samples.mean(axis=-1) for samples in adc_samples[-n_events:]]
+
+    return np.mean(means, axis=0)
+
+
+def test_running_baseline_mean():
+
+    n_events = 7
+    adc_samples = np.random.normal(300, 5, size=(30, 4, 50))
+    running_baseline = RunningBaseline(n_events)
+
+    for i, samples in enumerate(adc_samples):
+
+        running_baseline.add(samples)
+        assert running_baseline.ready == (i + 1 >= n_events)
+        expected = window_means(adc_samples[:i + 1], n_events)
+        np.testing.assert_allclose(running_baseline.baseline, expected)
+
+    expected_std = np.mean(adc_samples[-n_events:].std(axis=-1), axis=0)
+    np.testing.assert_allclose(running_baseline.std, expected_std)
+
+
+def test_running_baseline_robust():
+
+    adc_samples = np.random.normal(300, 1, size=(21, 4, 50))
+    adc_samples[5] += 1000
+    means = adc_samples.mean(axis=-1)
+
+    median = RunningBaseline(21, mode='median')
+    clipped = RunningBaseline(21, mode='clipped')
+
+    for samples in adc_samples:
+
+        median.add(samples)
+        clipped.add(samples)
+
+    np.testing.assert_allclose(median.baseline, np.median(means, axis=0))
+    np.testing.assert_allclose(clipped.baseline,
+                               np.delete(means, 5, axis=0).mean(axis=0))
+
+    with pytest.raises(ValueError):
+
+        RunningBaseline(10, mode='unknown')
+
+
+def test_running_baseline_nan_and_time():
+
+    adc_samples = np.random.normal(300, 5, size=(10, 3, 50))
+    adc_samples[2:, 0] = np.nan
+    running_baseline = RunningBaseline(100, window_time=3.5,
+                                       nan_aware=True)
+
+    for time, samples in enumerate(adc_samples):
+
+        running_baseline.add(samples, time=time)
+
+    assert len(running_baseline) == 4
+    assert running_baseline.ready
+    means = adc_samples[-4:].mean(axis=-1)
+    assert np.isnan(running_baseline.baseline[0])
+    np.testing.assert_allclose(running_baseline.baseline[1:],
+                               means[:, 1:].mean(axis=0))
+
+
+def test_running_baseline_pooled():
+
+    n_events = 5
+    adc_samples = np.random.normal(300, 5, size=(12, 4, 50))
+    adc_samples += np.random.normal(0, 3, size=(12, 4, 1))
+    adc_samples[3, 1, :10] = np.nan
+    running_baseline = RunningBaseline(n_events, nan_aware=True)
+
+    for i, samples in enumerate(adc_samples):
+
+        running_baseline.add(samples)
+        window = np.concatenate(adc_samples[max(i + 1 - n_events, 0):i + 1],
+                                axis=-1)
+        np.testing.assert_allclose(running_baseline.pooled_mean,
+                                   np.nanmean(window, axis=-1))
+        np.testing.assert_allclose(running_baseline.pooled_std,
+                                   np.nanstd(window, axis=-1))
+
+    running_baseline.reject_last([2])
+    window = np.concatenate(adc_samples[-n_events:-1], axis=-1)
+    np.testing.assert_allclose(running_baseline.pooled_std[2],
+                               np.std(window[2]))
+
+    with pytest.raises(ValueError):
+
+        RunningBaseline(n_events).reject_last([0])
+
+
+def _random_trigger_events(adc_samples):
+
+    for samples in adc_samples:
+
+        yield SimpleNamespace(
+            trig=SimpleNamespace(trigger_flag=1),
+            r0=SimpleNamespace(tels_with_data=[1],
+                               tel={1: SimpleNamespace(adc_samples=samples)}),
+        )
+
+
+def test_extract_baseline():
+
+    n_samples, n_events = 50, 4
+    adc_samples = np.random.normal(300, 5, size=(12, 3, n_samples))
+    adc_samples += np.random.normal(0, 3, size=(12, 3, 1))
+    adc_samples = adc_samples.astype(int)
+    calib_container = SimpleNamespace(sample_to_consider=n_events * n_samples,
+                                      baseline_ready=False, baseline=None,
+                                      std_dev=None)
+    events = extract_baseline(_random_trigger_events(adc_samples),
+                              calib_container)
+
+    for i, event in enumerate(events):
+
+        # nanmean and nanstd of the samples of the previous events
+        assert calib_container.baseline_ready == (i > 0)
+
+        if i == 0:
+
+            continue
+
+        window = np.concatenate(adc_samples[max(i - n_events, 0):i], axis=-1)
+        np.testing.assert_allclose(calib_container.baseline,
+                                   np.nanmean(window, axis=-1))
+        np.testing.assert_allclose(calib_container.std_dev,
+                                   np.nanstd(window, axis=-1))
+
+
+def test_extract_baseline_noisy_pixel():
+
+    n_samples, n_events = 50, 10
+    adc_samples = np.random.normal(300, 1, size=(8, 3, n_samples))
+    adc_samples[4, 0] += 1000
+    calib_container = SimpleNamespace(sample_to_consider=n_events * n_samples,
+                                      baseline_ready=False, baseline=None,
+                                      std_dev=None)
+    events = extract_baseline(_random_trigger_events(adc_samples),
+                              calib_container)
+
+    for _ in events:
+
+        pass
+
+    window = np.concatenate(adc_samples[:-1], axis=-1)
+    without_spike = np.concatenate(np.delete(adc_samples[:-1], 4, axis=0),
+                                   axis=-1)
+    np.testing.assert_allclose(calib_container.baseline[0],
+                               without_spike[0].mean())
+    np.testing.assert_allclose(calib_container.baseline[1:],
+                               window[1:].mean(axis=-1))
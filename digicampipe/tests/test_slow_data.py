@@ -48,3 +48,80 @@ def test_add_slow_data():
     ts_data = np.array(ts_data)
     diff = ts_data - ts_slow
     assert (diff <= 1.1).all()
+
+
+def test_aux_service_at_many():
+    from digicampipe.io.auxservice import AuxService
+
+    service = AuxService('DriveSystem', aux_basepath)
+    clocks = np.array([
+        event.r0.tel[1].local_camera_clock
+        for event in event_stream(example_file_path, max_events=10)
+    ])
+
+    previous = service.at_many(clocks, mode='previous')
+    nearest = service.at_many(clocks, mode='nearest')
+    linear = service.at_many(clocks, mode='linear')
+
+    assert (previous['timestamp'] <= clocks * 1e-6).all()
+    assert (np.abs(nearest['timestamp'] - clocks * 1e-6) <=
+            np.abs(previous['timestamp'] - clocks * 1e-6)).all()
+    assert len(linear['current_track_step_pos_el']) == len(clocks)
+
+    for i, clock in enumerate(clocks[:3]):
+
+        row = service.at(clock)
+        assert row.timestamp == previous['timestamp'][i]
+
+
+def test_slow_data_cache(tmpdir):
+    from datetime import date
+    from digicampipe.io.auxservice import AuxService, SlowDataCache
+
+    night = date(2017, 10, 30)
+    cache = SlowDataCache(cache_dir=str(tmpdir))
+    service = AuxService('DriveSystem', aux_basepath, cache=cache)
+    expected = service.at_date(night)
+
+    assert len(cache) == 1
+    assert tmpdir.join('DriveSystem_20171030.npz').check()
+
+    # a new cache reads the night from the npz file
+    service = AuxService('DriveSystem', aux_basepath,
+                         cache=SlowDataCache(cache_dir=str(tmpdir)))
+    result = service.at_date(night)
+
+    assert result.colnames == expected.colnames
+
+    for name in expected.colnames:
+        assert np.array_equal(result[name], expected[name])
+
+    # the cached columns cannot be modified through the tables
+    result['timestamp'][0] = -1
+
+    assert service.at_date(night)['timestamp'][0] == expected['timestamp'][0]
+    assert not service.columns_at_date(night)['timestamp'].flags.writeable
+
+    # at most one night when the cache is full
+    cache = SlowDataCache(max_bytes=1)
+    for name in ['DriveSystem', 'SafetyPLC']:
+        AuxService(name, aux_basepath, cache=cache).at_date(night)
+
+    assert len(cache) == 1
+
+
+def test_lookup_columns_equal_timestamp():
+    from digicampipe.io.auxservice import lookup_columns
+
+    columns = {
+        'timestamp': np.array([10., 20., 30.]),
+        'value': np.array([1., 2., 3.]),
+    }
+    timestamps_in_ms = np.array([20., 19.5, 25., 30.])
+
+    previous = lookup_columns(columns, timestamps_in_ms, mode='previous')
+    linear = lookup_columns(columns, timestamps_in_ms, mode='linear')
+
+    # an entry at the timestamp of the event is taken, not the one before
+    np.testing.assert_array_equal(previous['value'], [2., 1., 2., 3.])
+    np.testing.assert_allclose(linear['value'], [2., 1.95, 2.5, 3.])
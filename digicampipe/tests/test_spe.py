@@ -1,3 +1,5 @@
+from functools import partial
+
 import numpy as np
 import pytest
 
@@ -76,3 +78,109 @@ def test_fit_spe():
 def test_build_spe():
     # test spe.build_spe(events, max_events)
     assert False
+
+
+class _RawHistogram:
+
+    def __init__(self):
+
+        self.samples = []
+
+    def fill(self, samples):
+
+        self.samples.append(np.array(samples))
+
+    def mode(self):
+
+        return np.concatenate(self.samples, axis=-1).mean(axis=-1)
+
+
+def test_fill_baseline_from_raw():
+
+    from types import SimpleNamespace
+
+    adc_samples = np.random.normal(300, 5, size=(6, 3, 50))
+    # a single container for all the events, as calibration_event_stream()
+    container = SimpleNamespace(data=SimpleNamespace(baseline=None))
+
+    def events():
+
+        for i, samples in enumerate(adc_samples):
+
+            container.event_id = i
+            container.data.adc_samples = samples
+
+            yield container
+
+    raw_histo = _RawHistogram()
+    baseline = adc_samples[:4].transpose(1, 0, 2).reshape(3, -1).mean(axis=-1)
+
+    for i, event in enumerate(spe.fill_baseline_from_raw(events(), raw_histo,
+                                                         4)):
+
+        assert event.event_id == i
+        np.testing.assert_array_equal(event.data.adc_samples, adc_samples[i])
+        np.testing.assert_allclose(event.data.baseline, baseline)
+
+    assert i == 5
+
+
+def test_compute_single_pass(tmpdir):
+
+    from digicampipe.io.event_stream import calibration_event_stream
+    from digicampipe.calib.camera.baseline import fill_baseline, \
+        subtract_baseline
+    from digicampipe.calib.camera.peak import find_pulse_with_max, \
+        find_pulse_wavelets
+    from digicampipe.calib.camera.charge import compute_pulses
+    from digicampipe.scripts import raw
+    from digicampipe.tests.test_calibration_container import \
+        example_file_path
+
+    pixel_id = np.arange(20)
+    integral_width = 7
+    event = next(calibration_event_stream(example_file_path, max_events=1))
+    n_samples = event.data.adc_samples.shape[-1]
+
+    # all the events are used for the baseline as in the multi pass mode
+    histograms = spe.compute_single_pass(
+        example_file_path, pixel_id, max_events=None,
+        integral_width=integral_width, shift=0, n_samples=n_samples,
+        n_baseline_events=1000, batch_size=7, n_threads=2)
+
+    raw_histo = raw.compute(example_file_path, None, pixel_id, str(tmpdir))
+    np.testing.assert_array_equal(histograms['raw'].data, raw_histo.data)
+
+    for pulse_finder, names in [(find_pulse_with_max, ['max', 'timing']),
+                                (partial(find_pulse_wavelets,
+                                         widths=[4, 5, 6],
+                                         threshold_sigma=2),
+                                 ['charge', 'amplitude'])]:
+
+        events = calibration_event_stream(example_file_path,
+                                          pixel_id=pixel_id)
+        events = fill_baseline(events, raw_histo.mode())
+        events = subtract_baseline(events)
+        events = pulse_finder(events)
+        events = compute_pulses(events, integral_width)
+        values = {name: [] for name in ['charge', 'amplitude', 'time',
+                                        'pixel']}
+
+        for event in events:
+
+            for name in values:
+
+                values[name].append(event.data.pulses[name])
+
+        values = {name: np.concatenate(value)
+                  for name, value in values.items()}
+        values['max'] = values['charge']
+        values['timing'] = values['time']
+
+        for name in names:
+
+            counts = np.array([
+                np.histogram(values[name][values['pixel'] == i],
+                             bins=histograms[name].bins)[0]
+                for i in range(len(pixel_id))])
+            np.testing.assert_array_equal(histograms[name].data, counts)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from digicampipe.calib.camera.time import estimate_time, TIME_METHODS, \
+    estimate_time_from_leading_edge
+
+N_SAMPLES = 50
+TEMPLATE = np.exp(-0.5 * ((np.arange(10) - 3) / 2.) ** 2)
+
+
+def make_waveforms(shape, seed=0):
+
+    random_state = np.random.RandomState(seed)
+    times = random_state.uniform(10, 30, size=shape)
+    t = np.arange(N_SAMPLES)
+    pulse = np.exp(-0.5 * ((t - times[..., np.newaxis] - 3) / 2.) ** 2)
+    waveforms = 300 + 100 * pulse
+    waveforms += random_state.normal(0, 1, size=waveforms.shape)
+
+    return times, waveforms.astype(np.uint16)
+
+
+@pytest.mark.parametrize('method', TIME_METHODS)
+def test_estimate_time_blocks(method):
+
+    times, waveforms = make_waveforms((5, 100))
+    copy = waveforms.copy()
+
+    estimated = estimate_time(waveforms, method=method, template=TEMPLATE)
+
+    assert estimated.shape == times.shape
+    assert (waveforms == copy).all()
+
+    # each estimator has its own offset w.r.t. the pulse
+    residuals = estimated - times
+    assert np.std(residuals) < 0.5
+
+    per_event = [estimate_time(w, method=method, template=TEMPLATE)
+                 for w in waveforms]
+    np.testing.assert_allclose(estimated, per_event)
+
+
+def test_estimate_time_from_leading_edge():
+
+    times, waveforms = make_waveforms((100, ))
+    estimated = estimate_time_from_leading_edge(waveforms)
+
+    np.testing.assert_allclose(estimated - times, 0.5, atol=0.2)
+
+    with pytest.raises(ValueError):
+
+        estimate_time(waveforms, method='unknown')
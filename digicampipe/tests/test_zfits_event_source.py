@@ -64,3 +64,39 @@ def test_count_number_event():
     files = [example_file_path] * n_files  # create a list of files
 
     assert count_number_events(files) == n_files * EVENTS_IN_EXAMPLE_FILE
+
+
+def test_zfits_reader_random_access(tmpdir):
+
+    from digicampipe.io.zfits import ZFitsReader
+
+    event_numbers = [
+        data.r0.tel[1].camera_event_number
+        for data in zfits_event_source(example_file_path, camera=digicam,
+                                       camera_geometry=digicam_geometry)
+    ]
+    index_path = str(tmpdir.join('index.npz'))
+    reader = ZFitsReader(example_file_path, camera=digicam,
+                         camera_geometry=digicam_geometry,
+                         index_path=index_path)
+
+    assert len(reader) == len(event_numbers)
+    assert reader[10].r0.tel[1].camera_event_number == event_numbers[10]
+    assert reader[2].r0.tel[1].camera_event_number == event_numbers[2]
+    assert reader[-1].r0.tel[1].camera_event_number == event_numbers[-1]
+    assert [data.r0.event_id for data in reader[5:50:10]] == \
+        list(range(5, 50, 10))
+    # the rows are read in the order requested
+    assert [data.r0.event_id for data in reader[50:5:-10]] == \
+        list(range(50, 5, -10))
+    assert [data.r0.event_id for data in reader.iter_rows([7, 3, 7])] == \
+        [7, 3, 7]
+
+    data = reader.get(event_number=event_numbers[42])
+    assert data.r0.event_id == 42
+    assert os.path.exists(index_path)
+
+    reader = ZFitsReader(example_file_path, camera=digicam,
+                         camera_geometry=digicam_geometry,
+                         index_path=index_path)
+    assert (reader.index['camera_event_number'] == event_numbers).all()
@@ -69,6 +69,135 @@ def get_gains():
     return np.ones(1296) * 23.
 
 
+class CalibrationConstants:
+    """
+    Per pixel calibration constants of a run, created once and shared by
+    the r1 and dl1 stages.
+
+    The gain drop and NSB rate splines are evaluated for a pixel only when
+    its pedestal (baseline shift or standard deviation) moved by more than
+    `tolerance` since the last evaluation, the cached values are returned
+    otherwise.
+
+    :param gains: gain of the pixels (LSB / p.e.), by default `get_gains()`
+    :param time_integration_options: dict of the charge integration, c.f.
+    `calibrate_to_dl1()`. The options are copied and the timing masks
+    ('peak', 'mask', 'mask_edges') are generated once if missing. They can
+    also be set later, e.g. by `calibrate_to_dl1()` on constants created by
+    `calibrate_to_r1()`.
+    :param template: a `PulseTemplate`, by default the SST-1M template
+    :param tolerance: pedestal variation (LSB) triggering the
+    recomputation of the gain drop and NSB rate of a pixel
+    """
+
+    def __init__(self, gains=None, time_integration_options=None,
+                 template=None, tolerance=0.05):
+
+        self.gains = get_gains() if gains is None else \
+            np.asarray(gains, dtype=float)
+        self.time_integration_options = time_integration_options
+        self.tolerance = tolerance
+        self._template = template
+        self._cache = {}
+
+    @property
+    def time_integration_options(self):
+
+        return self._time_integration_options
+
+    @time_integration_options.setter
+    def time_integration_options(self, options):
+
+        if options is not None:
+
+            # the dict of the caller is not modified
+            options = dict(options)
+
+            if options.get('mask') is None:
+
+                from digicampipe.utils import utils
+
+                peak_position = utils.fake_timing_hist(
+                    options['n_samples'],
+                    options['timing_width'],
+                    options['central_sample'])
+                options['peak'], options['mask'], options['mask_edges'] = \
+                    utils.generate_timing_mask(
+                        options['window_start'],
+                        options['window_width'],
+                        peak_position)
+
+        self._time_integration_options = options
+
+    @classmethod
+    def from_store(cls, store, camera, time, n_pixels=1296, **kwargs):
+        """
+        Constants with the gains of a `CalibrationStore` valid at `time`,
+        the pixels without a stored gain use `get_gains()`
+        """
+
+        gains = store.get(camera, 'gain', time, n_pixels=n_pixels)
+        default = np.resize(get_gains(), n_pixels)
+        gains = np.where(np.isnan(gains), default, gains)
+
+        return cls(gains=gains, **kwargs)
+
+    @property
+    def template(self):
+
+        if self._template is None:
+
+            from digicampipe.utils.pulse_template import default_template
+
+            self._template = default_template()
+
+        return self._template
+
+    def gain_drop_and_nsb(self, pedestal, type='mean'):
+        """
+        Gain drop and NSB rate of the pixels, c.f. `compute_gain_drop()`
+        and `compute_nsb_rate()`
+
+        :param pedestal: baseline shift ('mean') or standard deviation
+        ('std') of shape (n_pixels, ) or (n_events, n_pixels)
+        :return: gain_drop, nsb_rate of the same shape as `pedestal`
+        """
+
+        pedestal = np.asarray(pedestal, dtype=float)
+        n_pixels = pedestal.shape[-1]
+        block = pedestal.reshape(-1, n_pixels)
+        cache = self._cache.get(type)
+
+        if cache is None or cache['pedestal'].shape != (n_pixels, ):
+
+            cache = {
+                'pedestal': block[0].copy(),
+                'gain_drop': compute_gain_drop(block[0], type),
+                'nsb_rate': compute_nsb_rate(block[0], type),
+            }
+            self._cache[type] = cache
+
+        # all the events of a block are compared to the cache at once, NaN
+        # are always recomputed
+        moved = ~(np.abs(block - cache['pedestal']) <= self.tolerance)
+        gain_drop = np.tile(cache['gain_drop'], (len(block), 1))
+        nsb_rate = np.tile(cache['nsb_rate'], (len(block), 1))
+
+        if moved.any():
+
+            gain_drop[moved] = compute_gain_drop(block[moved], type)
+            nsb_rate[moved] = compute_nsb_rate(block[moved], type)
+
+            # the cache follows the last event
+            last = moved[-1]
+            cache['pedestal'][last] = block[-1, last]
+            cache['gain_drop'][last] = gain_drop[-1, last]
+            cache['nsb_rate'][last] = nsb_rate[-1, last]
+
+        return gain_drop.reshape(pedestal.shape), \
+            nsb_rate.reshape(pedestal.shape)
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
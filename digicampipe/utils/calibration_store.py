@@ -0,0 +1,235 @@
+"""
+SQLite store of the per pixel calibration constants (gain, crosstalk, dark
+count rate, ...) produced by `digicam-spe` and `digicam-fmpe`.
+
+Every value is stored for a camera, a pixel and a validity period
+[valid_from, valid_to[ in unix seconds (valid_to NULL: until the next
+value). The constants valid at a given time are served as arrays indexed
+by pixel, c.f. `CalibrationStore.get()`.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import sqlite3
+
+import numpy as np
+
+__all__ = ['CalibrationStore', 'NPZ_NAMES']
+
+# names of the constants stored under generic keys in the npz files
+NPZ_NAMES = {
+    'dcr': 'dark_count_rate',
+    'chi_2': 'chi2',
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS constants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    camera TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pixel INTEGER NOT NULL,
+    value REAL,
+    error REAL,
+    valid_from REAL NOT NULL,
+    valid_to REAL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS constants_lookup
+    ON constants (camera, name, valid_from);
+'''
+
+
+def _timestamp(time):
+
+    if isinstance(time, datetime):
+
+        if time.tzinfo is None:
+
+            # naive datetimes are UTC, not the local time of the machine
+            time = time.replace(tzinfo=timezone.utc)
+
+        return time.timestamp()
+
+    return float(time)
+
+
+class CalibrationStore:
+    """
+    :param path: path of the SQLite database, created if it does not exist
+    (':memory:' for a temporary store)
+    :param cache_size: number of constant arrays kept in memory
+    """
+
+    def __init__(self, path=':memory:', cache_size=64):
+
+        self.path = path
+        self.cache_size = cache_size
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        self._cache = OrderedDict()
+
+    def close(self):
+
+        self._connection.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def insert(self, camera, name, pixel_id, values, valid_from,
+               valid_to=None, errors=None, source=None):
+        """
+        Store the values of a constant for a set of pixels
+
+        :param camera: camera name, e.g. 'DigiCam'
+        :param name: name of the constant, e.g. 'gain'
+        :param pixel_id: pixel of each value
+        :param values: array of the values, NaN are not stored
+        :param valid_from: start of the validity (unix seconds or datetime,
+        naive datetimes are UTC)
+        :param valid_to: end of the validity, None for open ended
+        :param errors: array of the errors of the values
+        :param source: e.g. the file the values come from
+        """
+
+        pixel_id = np.asarray(pixel_id, dtype=int)
+        values = np.asarray(values, dtype=float)
+        errors = np.full(values.shape, np.nan) if errors is None else \
+            np.asarray(errors, dtype=float)
+        valid = np.isfinite(values)
+        valid_from = _timestamp(valid_from)
+        valid_to = None if valid_to is None else _timestamp(valid_to)
+
+        rows = [(camera, name, int(pixel), float(value),
+                 None if np.isnan(error) else float(error),
+                 valid_from, valid_to, source)
+                for pixel, value, error in zip(pixel_id[valid], values[valid],
+                                               errors[valid])]
+
+        with self._connection:
+
+            self._connection.executemany(
+                'INSERT INTO constants (camera, name, pixel, value, error, '
+                'valid_from, valid_to, source) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        self._cache.clear()
+
+        return len(rows)
+
+    def ingest(self, filename, camera, valid_from, valid_to=None):
+        """
+        Store the constants of a npz file of `digicam-spe` or `digicam-fmpe`.
+
+        The arrays are indexed by pixel, or by position in the 'pixel_id'
+        array of the file if present. The 'x_error' arrays are stored as the
+        errors of 'x'. Unnamed arrays ('arr_0') take the name of the file.
+
+        :return: dict of the number of values stored per constant
+        """
+
+        source = os.path.abspath(filename)
+        stored = {}
+
+        with np.load(filename) as data:
+
+            keys = list(data.keys())
+            pixel_id = data['pixel_id'] if 'pixel_id' in keys else None
+
+            for key in keys:
+
+                if key == 'pixel_id' or key.endswith('_error'):
+
+                    continue
+
+                values = np.atleast_1d(data[key])
+
+                if values.ndim != 1 or values.dtype.kind not in 'fiu':
+
+                    continue
+
+                if key.startswith('arr_'):
+
+                    name = os.path.splitext(os.path.basename(filename))[0]
+
+                else:
+
+                    name = NPZ_NAMES.get(key, key)
+
+                pixels = np.arange(len(values)) if pixel_id is None else \
+                    pixel_id
+                errors = data[key + '_error'] \
+                    if key + '_error' in keys else None
+                stored[name] = self.insert(camera, name, pixels, values,
+                                           valid_from, valid_to=valid_to,
+                                           errors=errors, source=source)
+
+        return stored
+
+    def get(self, camera, name, time, n_pixels=1296, default=np.nan,
+            errors=False):
+        """
+        Values of a constant valid at `time` for all the pixels. If several
+        values are valid, the one with the latest `valid_from` (then the
+        last inserted) is used. The arrays are cached in memory.
+
+        :param time: unix seconds or datetime (naive datetimes are UTC),
+        e.g. the start of the run
+        :param default: value of the pixels without a valid value
+        :param errors: also return the errors
+        :return: array of shape (n_pixels, ), and the errors if `errors`
+        """
+
+        time = _timestamp(time)
+        key = (camera, name, time, n_pixels, default)
+
+        if key in self._cache:
+
+            self._cache.move_to_end(key)
+
+        else:
+
+            rows = self._connection.execute(
+                'SELECT pixel, value, error FROM constants '
+                'WHERE camera = ? AND name = ? AND valid_from <= ? '
+                'AND (valid_to IS NULL OR valid_to > ?) '
+                'ORDER BY valid_from, id', (camera, name, time, time))
+            rows = np.array(rows.fetchall(), dtype=float).reshape(-1, 3)
+            # NULL errors are converted to NaN
+            rows = rows[rows[:, 0] < n_pixels]
+
+            # last valid value of each pixel
+            pixels, last = np.unique(rows[::-1, 0].astype(int),
+                                     return_index=True)
+            last = len(rows) - 1 - last
+            values = np.full(n_pixels, default, dtype=float)
+            value_errors = np.full(n_pixels, np.nan)
+            values[pixels] = rows[last, 1]
+            value_errors[pixels] = rows[last, 2]
+
+            self._cache[key] = values, value_errors
+
+            if len(self._cache) > self.cache_size:
+
+                self._cache.popitem(last=False)
+
+        values, value_errors = self._cache[key]
+
+        if errors:
+
+            return values.copy(), value_errors.copy()
+
+        return values.copy()
+
+    def names(self, camera):
+        """Names of the constants stored for `camera`"""
+
+        rows = self._connection.execute(
+            'SELECT DISTINCT name FROM constants WHERE camera = ? '
+            'ORDER BY name', (camera, ))
+
+        return [row[0] for row in rows]
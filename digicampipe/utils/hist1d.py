@@ -0,0 +1,483 @@
+from multiprocessing import Pool
+import hashlib
+import os
+
+import h5py
+import numpy as np
+from histogram.histogram import Histogram1D
+
+
+def fill_sparse(histogram, index, values):
+    """
+    Fill a `Histogram1D` of data shape (n_pixels, ) with sparse values,
+    e.g. the pulses of `digicampipe.calib.camera.charge.compute_pulses()`.
+
+    This is equivalent to filling the histogram with arrays of shape
+    (n_pixels, n) that are NaN but at the given values, without allocating
+    them. NaN values are ignored.
+
+    :param histogram: a `histogram.Histogram1D`
+    :param index: pixel index of each value
+    :param values: values to fill
+    """
+
+    index = np.asarray(index, dtype=int)
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values)
+    index, values = index[valid], values[valid]
+
+    bins = histogram.bins
+    n_pixels, n_bins = histogram.data.shape
+    position = np.searchsorted(bins, values, side='right') - 1
+    # the last bin is closed as in np.histogram
+    position[values == bins[-1]] = n_bins - 1
+    underflow = position < 0
+    overflow = position >= n_bins
+    inside = ~(underflow | overflow)
+
+    counts = np.bincount(index[inside] * n_bins + position[inside],
+                         minlength=n_pixels * n_bins)
+    histogram.data += counts.reshape(n_pixels, n_bins).astype(
+        histogram.data.dtype)
+    histogram.underflow += np.bincount(
+        index[underflow], minlength=n_pixels).astype(
+        histogram.underflow.dtype)
+    histogram.overflow += np.bincount(
+        index[overflow], minlength=n_pixels).astype(histogram.overflow.dtype)
+    np.maximum.at(histogram.max, index, values)
+    np.minimum.at(histogram.min, index, values)
+
+
+HISTOGRAM_FORMAT = 'sparse_histogram_1d'
+
+
+def _unsigned_dtype(maximum):
+
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+
+        if maximum <= np.iinfo(dtype).max:
+
+            return dtype
+
+    return np.uint64
+
+
+def _pickle_path(filename):
+    """The '.pk' file of `filename` written by `Histogram1D.save()`"""
+
+    return os.path.splitext(filename)[0] + '.pk'
+
+
+def save_histogram(histogram, filename, chunk_size=2**16, sources=None):
+    """
+    Save a `Histogram1D` in a HDF5 file in a sparse layout: only the
+    non-zero bins of each pixel are stored (as in a CSR matrix), with the
+    smallest integer types holding the bin indices and the counts, in
+    compressed chunks. Files ending in '.pk' are pickled with
+    `Histogram1D.save()` as before.
+
+    :param histogram: a `histogram.Histogram1D`
+    :param filename: path of the file
+    :param chunk_size: number of bins per chunk of the datasets
+    :param sources: list of the shards summed in `histogram`, c.f.
+    `merge_histogram_files()`
+    """
+
+    if filename.endswith('.pk'):
+
+        histogram.save(filename)
+
+        return
+
+    data = histogram.data.reshape(-1, histogram.data.shape[-1])
+    rows, indices = np.nonzero(data)
+    counts = data[rows, indices]
+    indptr = np.zeros(len(data) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=len(data)))
+
+    # an empty histogram has no bins to store, hence no chunks
+    options = dict(compression='gzip', shuffle=True,
+                   chunks=(min(chunk_size, len(counts)), )) if len(counts) \
+        else {}
+
+    with h5py.File(filename, 'w') as f:
+
+        f.attrs['format'] = HISTOGRAM_FORMAT
+        f.attrs['data_shape'] = histogram.data.shape[:-1]
+        f.attrs['dtype'] = histogram.data.dtype.str
+        f.attrs['axis_name'] = str(getattr(histogram, 'axis_name', None))
+        f.attrs['name'] = str(getattr(histogram, 'name', None))
+        f.create_dataset('bins', data=histogram.bins, compression='gzip')
+        f.create_dataset('indptr', data=indptr)
+        f.create_dataset(
+            'indices', data=indices.astype(_unsigned_dtype(data.shape[-1])),
+            **options)
+        f.create_dataset(
+            'counts', data=counts.astype(_unsigned_dtype(counts.max(
+                initial=0))), **options)
+
+        for name in ['underflow', 'overflow', 'max', 'min']:
+
+            f.create_dataset(name, data=getattr(histogram, name))
+
+        if sources is not None:
+
+            f.create_dataset('sources', data=np.array(sources, dtype='S'))
+
+
+def load_histogram(filename, index=None):
+    """
+    Load a histogram written by `save_histogram()`. If `filename` does not
+    exist, its '.pk' file is loaded with `Histogram1D.load()`.
+
+    :param index: flat indices of the pixels to load (in the order of the
+    pixels in the file), None for all the pixels
+    :return: a `Histogram1D` of data shape (len(index), ) or of the saved
+    data shape
+    """
+
+    with HistogramFile(filename) as histogram_file:
+
+        return histogram_file.histogram(index)
+
+
+class HistogramFile:
+    """
+    Histogram file of `save_histogram()` opened for reading the pixels on
+    demand: only the chunks of the requested pixels are decompressed.
+    Files pickled by `Histogram1D.save()` are loaded at once.
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self._file = None
+        self._histogram = None
+
+        if not os.path.exists(filename) and \
+                os.path.exists(_pickle_path(filename)):
+
+            filename = _pickle_path(filename)
+
+        # path of the file read
+        self.path = filename
+        # shards summed in the histogram, c.f. merge_histogram_files()
+        self.sources = []
+
+        if filename.endswith('.pk'):
+
+            self._histogram = Histogram1D.load(filename)
+            self.bins = self._histogram.bins
+            self.data_shape = self._histogram.data.shape[:-1]
+            self.axis_name = getattr(self._histogram, 'axis_name', None)
+            self.name = getattr(self._histogram, 'name', None)
+
+            return
+
+        self._file = h5py.File(filename, 'r')
+
+        if self._file.attrs.get('format') != HISTOGRAM_FORMAT:
+
+            self._file.close()
+
+            raise IOError('{} is not a histogram file'.format(filename))
+
+        self.bins = self._file['bins'][()]
+        self.data_shape = tuple(self._file.attrs['data_shape'])
+        self.axis_name, self.name = [
+            None if value == 'None' else value
+            for value in (self._file.attrs['axis_name'],
+                          self._file.attrs['name'])]
+        self._dtype = np.dtype(self._file.attrs['dtype'])
+        self._indptr = self._file['indptr'][()]
+
+        if 'sources' in self._file:
+
+            self.sources = [source.decode()
+                            for source in self._file['sources'][()]]
+
+    def __len__(self):
+
+        return int(np.prod(self.data_shape))
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def close(self):
+
+        if self._file is not None:
+
+            self._file.close()
+
+    def counts(self, index):
+        """Counts of the bins of the pixel at flat index `index`"""
+
+        if self._histogram is not None:
+
+            return self._histogram.data.reshape(
+                -1, len(self.bins) - 1)[index].copy()
+
+        start, stop = self._indptr[index], self._indptr[index + 1]
+        counts = np.zeros(len(self.bins) - 1, dtype=self._dtype)
+        counts[self._file['indices'][start:stop]] = \
+            self._file['counts'][start:stop]
+
+        return counts
+
+    def histogram(self, index=None):
+        """
+        `Histogram1D` of the pixels at flat indices `index`, None for all the
+        pixels with the saved data shape
+        """
+
+        if index is None and self._histogram is not None:
+
+            return self._histogram
+
+        data_shape = self.data_shape if index is None else (len(index), )
+        rows = np.arange(len(self)) if index is None else np.asarray(index)
+
+        histogram = Histogram1D(data_shape=data_shape, bin_edges=self.bins,
+                                axis_name=self.axis_name)
+
+        if self.name is not None:
+
+            histogram.name = self.name
+
+        if self._histogram is not None:
+
+            source = self._histogram
+
+            for name in ['data', 'underflow', 'overflow', 'max', 'min']:
+
+                values = getattr(source, name)
+                values = values.reshape((len(self), ) + values.shape[
+                    len(self.data_shape):])
+                setattr(histogram, name, values[rows])
+
+            return histogram
+
+        if index is None:
+
+            data = np.zeros((len(self), len(self.bins) - 1),
+                            dtype=self._dtype)
+            indptr = self._indptr
+            pixels = np.repeat(np.arange(len(self)), np.diff(indptr))
+            data[pixels, self._file['indices'][()]] = self._file['counts'][()]
+
+        else:
+
+            data = np.array([self.counts(row) for row in rows],
+                            dtype=self._dtype).reshape(
+                len(rows), len(self.bins) - 1)
+
+        histogram.data = data.reshape(data_shape + (len(self.bins) - 1, ))
+
+        for name in ['underflow', 'overflow', 'max', 'min']:
+
+            values = self._file[name][()].reshape(-1)[rows]
+            setattr(histogram, name, values.reshape(data_shape))
+
+        return histogram
+
+    def add_to(self, histogram):
+        """
+        Add the histogram of the file to `histogram` (of the same bins and
+        data shape), only the stored bins are read.
+
+        :raise ValueError: if the bins or the data shapes differ
+        """
+
+        if histogram.data.shape[:-1] != self.data_shape:
+
+            raise ValueError('Data shape {} of {} differs from {}'.format(
+                self.data_shape, self.path, histogram.data.shape[:-1]))
+
+        if not np.array_equal(histogram.bins, self.bins):
+
+            raise ValueError('Bin edges of {} differ'.format(self.path))
+
+        names = ['underflow', 'overflow', 'max', 'min']
+
+        if self._histogram is not None:
+
+            other = {name: getattr(self._histogram, name) for name in names}
+            histogram.data += self._histogram.data.astype(
+                histogram.data.dtype)
+
+        else:
+
+            other = {name: self._file[name][()].reshape(self.data_shape)
+                     for name in names}
+            data = histogram.data.reshape(-1, len(self.bins) - 1)
+            pixels = np.repeat(np.arange(len(self)), np.diff(self._indptr))
+            data[pixels, self._file['indices'][()]] += \
+                self._file['counts'][()].astype(data.dtype)
+
+        histogram.underflow += other['underflow'].astype(
+            histogram.underflow.dtype)
+        histogram.overflow += other['overflow'].astype(
+            histogram.overflow.dtype)
+        histogram.max = np.maximum(histogram.max, other['max'])
+        histogram.min = np.minimum(histogram.min, other['min'])
+
+
+def shard_filename(filename, source):
+    """
+    Shard of the histogram file `filename` computed from the input file
+    `source`, e.g. 'raw_histo.h5' and '/data/SST1M_01_0001.fits.fz' give
+    'raw_histo.SST1M_01_0001.fits.fz.<digest>.h5'. The digest of the
+    directory of `source` tells apart the input files of the same name.
+    """
+
+    stem, extension = os.path.splitext(filename)
+    directory = os.path.dirname(os.path.abspath(source))
+    digest = hashlib.sha1(directory.encode()).hexdigest()[:8]
+
+    return '{}.{}.{}{}'.format(stem, os.path.basename(source), digest,
+                               extension)
+
+
+def merge_histogram_files(filename, shards, update=False):
+    """
+    Sum the histogram files `shards` (of the same bins and data shape) into
+    `filename`. The shards summed are recorded in `filename`, merged files
+    can therefore be merged again.
+
+    :param update: add the shards to the histogram of `filename` if it
+    exists, the shards already summed in it are skipped. `filename` must
+    then have been written by `merge_histogram_files()`.
+    :return: list of the shards added
+    :raise ValueError: if the bins or the data shapes differ, a shard is
+    partly summed in `filename` or `filename` does not record its shards
+    """
+
+    histogram = None
+    sources = []
+
+    if update and os.path.exists(filename):
+
+        with HistogramFile(filename) as histogram_file:
+
+            if not histogram_file.sources:
+
+                # e.g. computed without shards, the shards may already be
+                # counted in it
+                raise ValueError(
+                    '{} does not record the shards summed in it, remove it '
+                    'or merge it as a shard'.format(filename))
+
+            histogram = histogram_file.histogram()
+            sources = histogram_file.sources
+
+    merged = []
+
+    for shard in shards:
+
+        with HistogramFile(shard) as shard_file:
+
+            shard_sources = shard_file.sources or \
+                [os.path.abspath(shard_file.path)]
+            summed = set(shard_sources) & set(sources)
+
+            if summed and len(summed) == len(shard_sources):
+
+                continue
+
+            if summed:
+
+                raise ValueError('{} is partly summed in {}'.format(
+                    shard, filename))
+
+            if histogram is None:
+
+                histogram = shard_file.histogram()
+
+            else:
+
+                shard_file.add_to(histogram)
+
+        sources += shard_sources
+        merged.append(shard)
+
+    if histogram is None:
+
+        raise ValueError('No histogram to merge into {}'.format(filename))
+
+    if merged or not os.path.exists(filename):
+
+        # the histogram is replaced once completely written
+        save_histogram(histogram, filename + '.tmp', sources=sources)
+        os.replace(filename + '.tmp', filename)
+
+    return merged
+
+
+def _compute_shard(arguments):
+
+    function, source, shards = arguments
+    # the shards are complete once renamed
+    temporary = [shard + '.tmp' for shard in shards]
+
+    for filename in temporary:
+
+        if os.path.exists(filename):
+
+            os.remove(filename)
+
+    function(source, *temporary)
+
+    for filename, shard in zip(temporary, shards):
+
+        os.replace(filename, shard)
+
+    return shards
+
+
+def compute_sharded(function, sources, filenames, n_workers=1):
+    """
+    Compute histograms as a shard per input file, c.f. `shard_filename()`,
+    and sum the shards in the histogram files. The shards already written
+    are not computed again, so an interrupted computation is resumed and
+    new input files are simply added to the histograms. A histogram file
+    computed otherwise (without shards) raises a ValueError.
+
+    :param function: `function(source, *shards)` computing the histograms
+    of `source` and writing them in the files `shards` (one for each of
+    `filenames`). It must be picklable.
+    :param sources: input files
+    :param filenames: the histogram files
+    :param n_workers: number of processes computing the shards
+    :return: list of the shards of each histogram file
+    """
+
+    shards = [[shard_filename(filename, source) for filename in filenames]
+              for source in sources]
+    todo = [(function, source, source_shards)
+            for source, source_shards in zip(sources, shards)
+            if not all(os.path.exists(shard) for shard in source_shards)]
+
+    if n_workers == 1:
+
+        for arguments in todo:
+
+            _compute_shard(arguments)
+
+    else:
+
+        with Pool(n_workers) as pool:
+
+            pool.map(_compute_shard, todo, chunksize=1)
+
+    shards = [list(filename_shards) for filename_shards in zip(*shards)]
+
+    for filename, filename_shards in zip(filenames, shards):
+
+        merge_histogram_files(filename, filename_shards, update=True)
+
+    return shards
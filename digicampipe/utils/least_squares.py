@@ -0,0 +1,136 @@
+"""
+Levenberg-Marquardt least squares fit of many independent pixels at once.
+
+Every step is computed for all the pixels with batched linear algebra, the
+damping of each pixel is adapted independently and a pixel stops as soon
+as it has converged.
+"""
+import numpy as np
+
+__all__ = ['fit_least_squares']
+
+
+def fit_least_squares(function, x, y, y_err, params, lower=None, upper=None,
+                      fixed=None, max_iterations=100, tolerance=1e-6,
+                      damping=1e-3):
+    """
+    Minimise the chi2 of every pixel.
+
+    :param function: `function(x, params, jacobian=True)` returning the
+    model of shape (n_pixels, n_bins) and its jacobian of shape
+    (n_pixels, n_bins, n_params), e.g. `digicampipe.utils.pdf.fmpe_pdf_batch`
+    with the bin width bound. `jacobian=False` only returns the model.
+    :param x: bin centers, (n_bins, ) or (n_pixels, n_bins)
+    :param y: data of shape (n_pixels, n_bins)
+    :param y_err: errors of `y`, the bins with a null or infinite error are
+    not fitted
+    :param params: initial parameters of shape (n_pixels, n_params), the
+    pixels with non finite parameters are not fitted
+    :param lower: lower limits of the parameters, broadcast with `params`
+    :param upper: upper limits of the parameters
+    :param fixed: boolean array broadcast with `params`, True for the
+    parameters kept at their initial value
+    :param max_iterations: maximum number of steps
+    :param tolerance: relative decrease of the chi2 below which a pixel has
+    converged
+    :param damping: initial damping of the steps
+    :return: params, errors (of shape (n_pixels, n_params)), chi_2 and ndf
+    (of shape (n_pixels, ))
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    y_err = np.asarray(y_err, dtype=np.float64)
+    params = np.array(params, dtype=np.float64)
+    n_pixels, n_params = params.shape
+    lower = np.broadcast_to(-np.inf if lower is None else lower, params.shape)
+    upper = np.broadcast_to(np.inf if upper is None else upper, params.shape)
+    fixed = np.broadcast_to(False if fixed is None else fixed, params.shape)
+    free = ~fixed
+
+    with np.errstate(divide='ignore'):
+
+        weights = np.where(y_err > 0, 1 / y_err**2, 0.)
+
+    weights[~np.isfinite(y)] = 0
+    y = np.where(weights > 0, y, 0.)
+    params = np.clip(params, lower, upper)
+
+    def evaluate(index, p, jacobian):
+
+        x_index = x if x.ndim == 1 else x[index]
+
+        return function(x_index, p, jacobian=jacobian)
+
+    def chi_square(index, model):
+
+        return np.sum(weights[index] * (y[index] - model)**2, axis=-1)
+
+    def normal_equations(index, p):
+
+        model, jac = evaluate(index, p, True)
+        jac = jac * free[index][:, np.newaxis]
+        weighted_jac = jac * weights[index][..., np.newaxis]
+        hessian = np.einsum('pbi,pbj->pij', weighted_jac, jac)
+        gradient = np.einsum('pbi,pb->pi', weighted_jac, y[index] - model)
+
+        return chi_square(index, model), hessian, gradient
+
+    valid = np.all(np.isfinite(params), axis=-1)
+    chi_2 = np.full(n_pixels, np.nan)
+    lambdas = np.full(n_pixels, damping)
+    active = np.flatnonzero(valid)
+    eye = np.eye(n_params)
+
+    for _ in range(max_iterations):
+
+        if not len(active):
+
+            break
+
+        p = params[active]
+        chi_2[active], hessian, gradient = normal_equations(active, p)
+
+        # the fixed parameters have a null gradient hence a null step
+        diagonal = np.diagonal(hessian, axis1=1, axis2=2)
+        diagonal = np.where(diagonal > 0, diagonal, 1.)
+        matrix = hessian + \
+            (lambdas[active][:, np.newaxis] * diagonal)[..., np.newaxis] * eye
+
+        try:
+
+            step = np.linalg.solve(matrix, gradient[..., np.newaxis])[..., 0]
+
+        except np.linalg.LinAlgError:
+
+            step = np.einsum('pij,pj->pi', np.linalg.pinv(matrix), gradient)
+
+        trial = np.clip(p + step * free[active], lower[active],
+                        upper[active])
+        trial_chi_2 = chi_square(active, evaluate(active, trial, False))
+
+        improved = trial_chi_2 < chi_2[active]
+        decrease = chi_2[active] - trial_chi_2
+        params[active[improved]] = trial[improved]
+        lambdas[active] = np.where(improved, lambdas[active] / 10,
+                                   lambdas[active] * 10)
+        converged = (improved & (decrease <= tolerance * chi_2[active])) | \
+            (lambdas[active] > 1e10) | ~np.isfinite(chi_2[active])
+        chi_2[active[improved]] = trial_chi_2[improved]
+        active = active[~converged]
+
+    # covariance matrix of the chi2 at the minimum
+    errors = np.full(params.shape, np.nan)
+    index = np.flatnonzero(valid)
+
+    if len(index):
+
+        chi_2[index], hessian, _ = normal_equations(index, params[index])
+        covariance = np.linalg.pinv(hessian)
+        errors[index] = np.sqrt(np.abs(
+            np.diagonal(covariance, axis1=1, axis2=2)))
+
+    errors[fixed & valid[:, np.newaxis]] = 0
+    ndf = np.sum(weights > 0, axis=-1) - np.sum(free, axis=-1)
+
+    return params, errors, chi_2, ndf
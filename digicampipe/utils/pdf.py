@@ -11,67 +11,85 @@ def gaussian(x, mean, sigma, amplitude):
     return pdf
 
 
-def fmpe_pdf_10(x, baseline, gain, sigma_e, sigma_s, bin_width, a_0=0, a_1=0,
-                a_2=0, a_3=0, a_4=0, a_5=0, a_6=0, a_7=0, a_8=0, a_9=0):
+FMPE_PARAMETERS = ['baseline', 'gain', 'sigma_e', 'sigma_s']
 
-    # sigma_e = np.sqrt(sigma_e**2 - 2**2 / 12)
 
-    params = {'baseline': baseline,
-              'gain': gain,
-              'sigma_e': sigma_e,
-              'sigma_s': sigma_s,
-              'a_0': a_0,
-              'a_1': a_1,
-              'a_2': a_2,
-              'a_3': a_3,
-              'a_4': a_4,
-              'a_5': a_5,
-              'a_6': a_6,
-              'a_7': a_7,
-              'a_8': a_8,
-              'a_9': a_9}
+def fmpe_parameter_names(n_peaks):
+    """Names of the columns of the parameter arrays of `fmpe_pdf_batch()`"""
 
-    return fmpe_pdf(x, bin_width, **params)
+    return FMPE_PARAMETERS + ['a_{}'.format(i) for i in range(n_peaks)]
 
 
-def fmpe_pdf(x, bin_width, **params):
+def fmpe_pdf_batch(x, params, bin_width, jacobian=False):
+    """
+    FMPE pdf of many pixels at once: a sum of gaussian peaks of
+    amplitude a_N at baseline + N * gain, of variance
+    sigma_e**2 + N * sigma_s**2 + bin_width**2 / 12.
 
-    baseline = params['baseline']
-    sigma_e = params['sigma_e']
-    sigma_s = params['sigma_s']
-    gain = params['gain']
+    :param x: bin centers, (n_bins, ) or (n_pixels, n_bins)
+    :param params: array of shape (n_pixels, 4 + n_peaks), the columns are
+    given by `fmpe_parameter_names()`
+    :param bin_width: scalar or array of shape (n_pixels, )
+    :param jacobian: also return the derivatives of the pdf with respect to
+    the parameters
+    :return: pdf of shape (n_pixels, n_bins), and the jacobian of shape
+    (n_pixels, n_bins, 4 + n_peaks) if `jacobian`
+    """
 
-    ids = []
+    params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+    x = np.asarray(x, dtype=np.float64)
+    x = x[np.newaxis] if x.ndim == 1 else x
+    bin_width = np.asarray(bin_width, dtype=np.float64).reshape(-1, 1)
 
-    for key, val in params.items():
+    baseline, gain, sigma_e, sigma_s = params[:, :4].T[..., np.newaxis]
+    amplitudes = params[:, 4:]
+    n = np.arange(amplitudes.shape[-1])
 
-        if key[:2] == 'a_':
+    # (n_pixels, n_peaks) then (n_pixels, n_peaks, n_bins)
+    variance = sigma_e**2 + n * sigma_s**2 + bin_width**2 / 12
+    residual = x[:, np.newaxis] - (baseline + n * gain)[..., np.newaxis]
+    variance = variance[..., np.newaxis]
+    peaks = np.exp(-residual**2 / (2 * variance))
+    peaks /= np.sqrt(2 * np.pi * variance)
 
-            id = int(key[2:])
-            ids.append(id)
+    pdf = np.einsum('ij,ijk->ik', amplitudes, peaks)
 
-    n_peaks = len(ids)
+    if not jacobian:
 
-    amplitudes = np.zeros(n_peaks)
+        return pdf
 
-    for key, val in params.items():
+    weighted = amplitudes[..., np.newaxis] * peaks
+    d_mean = weighted * residual / variance
+    d_variance = weighted * (residual**2 / variance - 1) / (2 * variance)
+    n = n[:, np.newaxis]
 
-        if key[:2] == 'a_':
+    derivatives = np.empty(pdf.shape + (params.shape[-1], ))
+    derivatives[..., 0] = d_mean.sum(axis=1)
+    derivatives[..., 1] = (n * d_mean).sum(axis=1)
+    derivatives[..., 2] = 2 * sigma_e * d_variance.sum(axis=1)
+    derivatives[..., 3] = 2 * sigma_s * (n * d_variance).sum(axis=1)
+    derivatives[..., 4:] = np.swapaxes(peaks, 1, 2)
 
-            id = int(key[2:])
-            amplitudes[id] = val
+    return pdf, derivatives
 
-    N = np.arange(0, n_peaks, 1)
-    sigma = sigma_e**2 + N * sigma_s**2 + bin_width**2 / 12
 
-    value = x - (N * gain + baseline)[..., np.newaxis]
-    value = value**2
-    value /= 2 * sigma[..., np.newaxis]
-    temp = np.exp(-value) * (amplitudes / np.sqrt(sigma))[..., np.newaxis]
-    temp = np.sum(temp, axis=0)
-    temp /= np.sqrt(2 * np.pi)
+def fmpe_pdf_10(x, baseline, gain, sigma_e, sigma_s, bin_width, a_0=0, a_1=0,
+                a_2=0, a_3=0, a_4=0, a_5=0, a_6=0, a_7=0, a_8=0, a_9=0):
+
+    # sigma_e = np.sqrt(sigma_e**2 - 2**2 / 12)
+
+    params = [baseline, gain, sigma_e, sigma_s,
+              a_0, a_1, a_2, a_3, a_4, a_5, a_6, a_7, a_8, a_9]
+
+    return fmpe_pdf_batch(x, params, bin_width)[0]
+
+
+def fmpe_pdf(x, bin_width, **params):
+
+    n_peaks = len([key for key in params if key[:2] == 'a_'])
+    params = [params[key] for key in fmpe_parameter_names(n_peaks)]
 
-    return temp
+    return fmpe_pdf_batch(x, params, bin_width)[0]
 
 
 def single_photoelectron_pdf(x, baseline, gain,
@@ -0,0 +1,223 @@
+"""
+Independent per pixel fits distributed over a pool of processes.
+
+The result of every pixel is appended to a checkpoint file (one JSON line
+per pixel) as soon as it is known, so that an interrupted or repeated fit
+only runs the pixels that are missing, that failed or whose fit inputs
+changed.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+import numpy as np
+from tqdm import tqdm
+
+__all__ = ['FitCheckpoint', 'fit_pixels', 'arguments_digest', 'code_digest']
+
+
+def _to_builtin(value):
+
+    if isinstance(value, np.generic):
+
+        return value.item()
+
+    if isinstance(value, np.ndarray):
+
+        return value.tolist()
+
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+
+def arguments_digest(arguments):
+    """Digest of the fit arguments of a pixel (numpy arrays included)"""
+
+    return hashlib.sha1(pickle.dumps(arguments, protocol=2)).hexdigest()
+
+
+def code_digest(function):
+    """
+    Digest of the source of the module defining `function`, a change of
+    the fit code of this module invalidates the checkpoints. The changes
+    of the modules it calls are not detected.
+    """
+
+    digest = hashlib.sha1(function.__qualname__.encode())
+
+    try:
+
+        with open(inspect.getsourcefile(function), 'rb') as f:
+
+            digest.update(f.read())
+
+    except (OSError, TypeError):
+
+        pass
+
+    return digest.hexdigest()
+
+
+class FitCheckpoint:
+    """
+    Checkpoint file of per pixel fit results.
+
+    :param path: path of the file, None for no checkpoint
+    :param key: identifies the fitted data (e.g. modification time of the
+    histogram file), a checkpoint written for another key is discarded.
+    Each line also records the digest of the fit arguments of its pixel,
+    c.f. `arguments_digest()`.
+    """
+
+    def __init__(self, path, key=None):
+
+        self.path = path
+        self.key = None if key is None else str(key)
+        self.results = OrderedDict()
+        self.errors = OrderedDict()
+        self.digests = {}
+
+        if path is None:
+
+            return
+
+        if os.path.exists(path):
+
+            with open(path) as f:
+
+                lines = [json.loads(line) for line in f if line.strip()]
+
+            if lines and lines[0].get('key') == self.key:
+
+                for line in lines[1:]:
+
+                    self._add(line)
+
+                return
+
+        with open(path, 'w') as f:
+
+            f.write(json.dumps({'key': self.key}) + '\n')
+
+    def __contains__(self, pixel):
+
+        return pixel in self.results
+
+    def is_done(self, pixel, digest=None):
+        """True if `pixel` was fitted, with the same arguments if `digest`"""
+
+        return pixel in self.results and \
+            (digest is None or self.digests.get(pixel) == digest)
+
+    def _add(self, line):
+
+        pixel = line['pixel']
+        self.digests[pixel] = line.get('digest')
+
+        if line['error'] is None:
+
+            self.results[pixel] = line['result']
+            self.errors.pop(pixel, None)
+
+        else:
+
+            self.results.pop(pixel, None)
+            self.errors[pixel] = line['error']
+
+    def write(self, pixel, result=None, error=None, digest=None):
+        """Record the result of a pixel, or its error if the fit failed"""
+
+        line = json.dumps({'pixel': int(pixel), 'result': result,
+                           'error': None if error is None else str(error),
+                           'digest': digest},
+                          default=_to_builtin)
+        # the results are the same whether they are resumed or not
+        self._add(json.loads(line))
+
+        if self.path is None:
+
+            return
+
+        with open(self.path, 'a') as f:
+
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def fit_pixels(function, pixel_id, arguments, n_workers=1, checkpoint=None,
+               key=None, desc='Pixel'):
+    """
+    Call `function(*arguments[i])` for every pixel `pixel_id[i]`.
+
+    A pixel of the checkpoint is fitted again if its arguments changed, and
+    the whole checkpoint is discarded if `key` or the source of the module
+    of `function` changed (c.f. `code_digest()`).
+
+    :param function: fit of one pixel, a module level function (it is sent
+    to the workers) returning a dict of JSON serializable values (numpy
+    scalars and arrays are converted). It raises if the fit fails.
+    :param pixel_id: list of pixel ids
+    :param arguments: list of the argument tuples of each pixel
+    :param n_workers: number of processes, 1 runs the fits in this process
+    :param checkpoint: path of the checkpoint file, c.f. `FitCheckpoint`
+    :param key: key of the checkpoint, e.g. the modification time of the
+    histogram file and the fit options common to all the pixels
+    :return: OrderedDict pixel -> result (as read back from JSON), None for
+    the failed fits
+    """
+
+    checkpoint = FitCheckpoint(checkpoint, key=(key, code_digest(function)))
+    digests = {int(pixel): arguments_digest(args)
+               for pixel, args in zip(pixel_id, arguments)}
+    todo = [(pixel, args) for pixel, args in zip(pixel_id, arguments)
+            if not checkpoint.is_done(int(pixel), digests[int(pixel)])]
+
+    def record(pixel, result, error):
+
+        if error is not None:
+
+            print('Could not fit pixel {}'.format(pixel))
+            print(error)
+
+        checkpoint.write(pixel, result=result, error=error,
+                         digest=digests[int(pixel)])
+
+    with tqdm(total=len(todo), desc=desc) as progress:
+
+        if n_workers == 1:
+
+            for pixel, args in todo:
+
+                try:
+
+                    record(pixel, function(*args), None)
+
+                except Exception as exception:
+
+                    record(pixel, None, exception)
+
+                progress.update(1)
+
+        else:
+
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+
+                futures = {executor.submit(function, *args): pixel
+                           for pixel, args in todo}
+
+                for future in as_completed(futures):
+
+                    pixel = futures[future]
+                    error = future.exception()
+                    result = None if error is not None else future.result()
+                    record(pixel, result, error)
+                    progress.update(1)
+
+    return OrderedDict(
+        (pixel, checkpoint.results.get(int(pixel))
+         if checkpoint.is_done(int(pixel), digests[int(pixel)]) else None)
+        for pixel in pixel_id)
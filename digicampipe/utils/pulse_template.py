@@ -0,0 +1,171 @@
+import numpy as np
+import h5py
+from scipy.interpolate import CubicSpline
+
+from digicampipe.utils.utils import TEMPLATE
+
+__all__ = ['PulseTemplate', 'default_template']
+
+
+class PulseTemplate:
+    """
+    Pulse template tabulated on a dense time grid.
+
+    The template is interpolated once with a cubic spline on a grid of
+    `resolution` ns, it is then evaluated by linear interpolation in this
+    lookup table (or exactly with the spline with `kind='cubic'`).
+    The template is 0 outside of its time range.
+
+    Per pixel templates are given as a 2D `amplitude` of shape
+    (n_pixels, n_times), they are then evaluated with the `pixel_id`
+    argument.
+
+    :param time: sorted times of the template (ns)
+    :param amplitude: amplitude of the template at `time`, (n_times, ) or
+    (n_pixels, n_times)
+    :param resolution: time step of the lookup table (ns)
+    """
+
+    def __init__(self, time, amplitude, resolution=0.1):
+
+        self.time = np.asarray(time, dtype=float)
+        self.amplitude = np.asarray(amplitude, dtype=float)
+        self.resolution = resolution
+        self.spline = CubicSpline(self.time, self.amplitude, axis=-1)
+
+        n_points = int(np.ceil((self.time[-1] - self.time[0]) / resolution))
+        self.table_time = self.time[0] + np.arange(n_points + 1) * resolution
+        self.table = self._pad(self.spline(self.table_time))
+        self.table_derivative = self._pad(
+            self.spline.derivative()(self.table_time))
+
+    @classmethod
+    def from_file(cls, filename=TEMPLATE, **kwargs):
+        """Template from a text file of 2 columns: time (ns), amplitude"""
+
+        time, amplitude = np.loadtxt(filename, unpack=True, skiprows=1)
+
+        return cls(time, amplitude, **kwargs)
+
+    @classmethod
+    def from_histogram(cls, filename, **kwargs):
+        """
+        Per pixel templates from the 2D histograms of the normalised
+        waveforms written by `digicam-template`. The template of a pixel is
+        the mean amplitude in each time bin, normalised to a maximum of 1.
+        Its time origin is the arrival time of the pulses.
+        """
+
+        with h5py.File(filename, 'r') as f:
+
+            histo = f['adc_count_histo'][()].astype(float)
+            extent = f['adc_count_histo'].attrs['extent']
+
+        n_pixels, n_time_bins, n_amplitude_bins = histo.shape
+        time = np.linspace(extent[0], extent[1], num=n_time_bins + 1)
+        time = 0.5 * (time[1:] + time[:-1])
+        amplitude = np.linspace(extent[2], extent[3],
+                                num=n_amplitude_bins + 1)
+        amplitude = 0.5 * (amplitude[1:] + amplitude[:-1])
+
+        counts = histo.sum(axis=-1)
+        mean = np.sum(histo * amplitude, axis=-1)
+        mean = np.divide(mean, counts, out=np.zeros(mean.shape),
+                         where=counts > 0)
+        maximum = mean.max(axis=-1, keepdims=True)
+        mean = np.divide(mean, maximum, out=np.zeros(mean.shape),
+                         where=maximum > 0)
+
+        return cls(time, mean, **kwargs)
+
+    @property
+    def n_pixels(self):
+        """number of pixel templates, None for a single template"""
+
+        return None if self.amplitude.ndim == 1 else self.amplitude.shape[0]
+
+    def __call__(self, t, pixel_id=None, kind='linear'):
+        """
+        Template at times `t` (ns)
+
+        :param t: array of times
+        :param pixel_id: pixel of each time (broadcast with `t`), for per
+        pixel templates
+        :param kind: 'linear' interpolation of the lookup table or exact
+        'cubic' spline
+        """
+
+        if kind == 'cubic':
+
+            return self._evaluate_spline(self.spline, t, pixel_id)
+
+        return self._interpolate(self.table, t, pixel_id)
+
+    def derivative(self, t, pixel_id=None):
+        """Time derivative of the template at times `t` (ns)"""
+
+        return self._interpolate(self.table_derivative, t, pixel_id)
+
+    def _interpolate(self, table, t, pixel_id):
+
+        t = np.asarray(t, dtype=float)
+        position = (t - self.time[0]) / self.resolution
+        # index of the padded table, 0 and -1 are padding zeros
+        outside = (position < 0) | (position > table.shape[-1] - 3)
+        index = np.floor(position).astype(int) + 1
+        index = np.clip(index, 0, table.shape[-1] - 2)
+        fraction = position - (index - 1)
+
+        if pixel_id is None:
+
+            left = table[..., index]
+            right = table[..., index + 1]
+
+        else:
+
+            pixel_id = np.asarray(pixel_id)
+            left = table[pixel_id, index]
+            right = table[pixel_id, index + 1]
+
+        values = left + fraction * (right - left)
+
+        return np.where(outside, 0., values)
+
+    def _evaluate_spline(self, spline, t, pixel_id):
+
+        t = np.asarray(t, dtype=float)
+        outside = (t < self.time[0]) | (t > self.time[-1])
+
+        if pixel_id is None:
+
+            values = spline(t)
+
+        else:
+
+            # all the pixels are evaluated, this is the slow exact path
+            pixel_id, t = np.broadcast_arrays(pixel_id, t)
+            values = np.take_along_axis(spline(t), pixel_id[np.newaxis],
+                                        axis=0)[0]
+
+        return np.where(outside, 0., values)
+
+    def _pad(self, table):
+
+        padding = [(0, 0)] * (table.ndim - 1) + [(1, 1)]
+
+        return np.pad(table, padding, mode='constant')
+
+
+_DEFAULT_TEMPLATE = None
+
+
+def default_template():
+    """The SST-1M pulse template, loaded once"""
+
+    global _DEFAULT_TEMPLATE
+
+    if _DEFAULT_TEMPLATE is None:
+
+        _DEFAULT_TEMPLATE = PulseTemplate.from_file(TEMPLATE)
+
+    return _DEFAULT_TEMPLATE
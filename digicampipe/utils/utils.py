@@ -59,24 +59,23 @@ def extract_charge(
     :return:
     """
     is_saturated = np.max(data, axis=-1) > threshold_saturation
-    local_max = np.argmax(np.multiply(data, timing_mask), axis=1)
-    local_max_edge = np.argmax(np.multiply(data, timing_mask_edge), axis=1)
+    local_max = np.argmax(np.multiply(data, timing_mask), axis=-1)
+    local_max_edge = np.argmax(np.multiply(data, timing_mask_edge), axis=-1)
+    peak_start = np.broadcast_to(peak - window_start, local_max.shape)
     ind_max_at_edge = (local_max == local_max_edge)
-    local_max[ind_max_at_edge] = peak[ind_max_at_edge] - window_start
-    index_max = (np.arange(0, data.shape[0]), local_max,)
+    local_max[ind_max_at_edge] = peak_start[ind_max_at_edge]
+    index_max = np.indices(local_max.shape, sparse=True) + (local_max, )
     ind_with_lt_th = data[index_max] < 10.
-    local_max[ind_with_lt_th] = peak[ind_with_lt_th] - window_start
+    local_max[ind_with_lt_th] = peak_start[ind_with_lt_th]
     local_max[local_max < 0] = 0
-    index_max = (np.arange(0, data.shape[0]), local_max,)
+    index_max = np.indices(local_max.shape, sparse=True) + (local_max, )
     charge = data[index_max]
     # TODO, find a better evaluation that it is saturated
     if np.any(is_saturated):
-        sat_indices = tuple(np.where(is_saturated)[0])
-        _data = data[sat_indices, ...]
-        charge[sat_indices, ...] = np.apply_along_axis(
+        charge[is_saturated] = np.apply_along_axis(
             contiguous_regions,
-            1,
-            _data
+            -1,
+            data[is_saturated]
         )
 
     return charge, index_max
@@ -171,6 +170,6 @@ def _template_pulse(filename):
 
 def get_pulse_shape(time, t, amplitude, baseline):
 
-    f = _template_pulse(TEMPLATE)
+    from digicampipe.utils.pulse_template import default_template
 
-    return amplitude * f(time - t) + baseline
+    return amplitude * default_template()(time - t) + baseline
@@ -18,6 +18,7 @@ Options:
   -b <path>, --baseline_path=<path>  \
 path to baseline file usually called "dark.npz"
   --min_photon <int>     Filtering on big showers [default: 20]
+  --n_workers <int>      Number of files processed in parallel
 '''
 from digicampipe.calib.camera import filter, r1, random_triggers, dl0, dl2, dl1
 from digicampipe.io.event_stream import event_stream
@@ -29,11 +30,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import astropy.units as u
 from docopt import docopt
+from functools import partial
 
 
 def main(args):
     # Input/Output files
-    dark_baseline = np.load(args['--baseline_path'])
+    dark_baseline = dict(np.load(args['--baseline_path']))
 
     digicam = Camera(
         # Source coordinates (in camera frame)
@@ -85,8 +87,46 @@ def main(args):
     boundary_threshold = 10
     shower_distance = 200 * u.mm
 
+    pipeline = partial(
+        process,
+        dark_baseline=dark_baseline,
+        n_bins=n_bins,
+        pixel_not_wanted=pixel_not_wanted,
+        additional_mask=additional_mask,
+        time_integration_options=time_integration_options,
+        picture_threshold=picture_threshold,
+        boundary_threshold=boundary_threshold,
+        min_photon=args['--min_photon'],
+        reclean=reclean,
+        shower_distance=shower_distance,
+    )
+
     # Define the event stream
-    data_stream = event_stream(args['<files>'], camera=digicam)
+    if args['--n_workers'] is None:
+
+        data_stream = event_stream(args['<files>'], camera=digicam)
+        data_stream = pipeline(data_stream)
+
+    else:
+        # Each file is processed by a worker, the baseline is therefore
+        # computed for each file independently
+        data_stream = event_stream(args['<files>'], camera=digicam,
+                                   n_workers=args['--n_workers'],
+                                   pipeline=pipeline)
+
+    if args['--display']:
+
+        with plt.style.context('ggplot'):
+            display = EventViewer(data_stream)
+            display.draw()
+    else:
+        save_hillas_parameters_in_text(
+            data_stream=data_stream, output_filename=args['--outfile_path'])
+
+
+def process(data_stream, dark_baseline, n_bins, pixel_not_wanted,
+            additional_mask, time_integration_options, picture_threshold,
+            boundary_threshold, min_photon, reclean, shower_distance):
     # Clean pixels
     data_stream = filter.set_pixels_to_zero(data_stream,
                                             unwanted_pixels=pixel_not_wanted)
@@ -113,23 +153,18 @@ def main(args):
                                        boundary_threshold=boundary_threshold)
     # Return only showers with total number of p.e. above min_photon
     data_stream = filter.filter_shower(
-        data_stream, min_photon=args['--min_photon'])
+        data_stream, min_photon=min_photon)
     # Run the dl2 calibration (Hillas)
     data_stream = dl2.calibrate_to_dl2(
         data_stream, reclean=reclean, shower_distance=shower_distance)
 
-    if args['--display']:
-
-        with plt.style.context('ggplot'):
-            display = EventViewer(data_stream)
-            display.draw()
-    else:
-        save_hillas_parameters_in_text(
-            data_stream=data_stream, output_filename=args['--outfile_path'])
+    return data_stream
 
 
 if __name__ == '__main__':
     args = docopt(__doc__)
     print(args)
     args['--min_photon'] = int(args['--min_photon'])
+    if args['--n_workers'] is not None:
+        args['--n_workers'] = int(args['--n_workers'])
     main(args)
@@ -52,6 +52,11 @@ setup(
             'digicam-raw=digicampipe.scripts.raw:entry',
             'digicam-timing=digicampipe.scripts.timing:entry',
             'digicam-rate-scan=digicampipe.scripts.rate_scan:entry',
+            'digicam-catalog=digicampipe.scripts.catalog:entry',
+            'digicam-calibration-store='
+            'digicampipe.scripts.calibration_store:entry',
+            'digicam-merge-histograms='
+            'digicampipe.scripts.merge_histograms:entry',
         ],
     }
 )